@@ -0,0 +1,293 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+
+import os
+import threading
+import unittest
+import numpy
+from datetime import datetime, timedelta
+import Shared.Utils.HfgeoLogger as Logger
+from IonoModelEngine.ROAM.TiltField import latticeAxes
+from IonoModelEngine.ROAM.IonoStateArchive import ArchiveWriter, loadArchive, ionoStateRow
+from Shared.Utils.Timing import timed
+
+logger = Logger.getLogger()
+
+## @package Framework.AssimilationDaemon
+#  Continuous assimilation of the newest data at reference sites, published to ionoState archives
+#
+#  Every epoch, once the soundings of the epoch had time to come in, the data is staged and the
+#  ionoStates of the reference sites and of the points of a lattice are computed together. The
+#  state of each site is appended to the archive of the site for the UT day of the epoch, see
+#  IonoStateArchive, which ROAM.read_ionoState, ROAM.queryROAM and ROAM.queryROAMBatch read like
+#  the ROAM_ionoState.txt file of that day. Consumers only look the states up in the archives and
+#  never run the assimilation themselves.
+#
+#  Only the newest epoch is assimilated, epochs missed while the daemon was stopped or busy are
+#  not caught up. A daemon started again on the same archives goes on after the last epoch
+#  published to every site, and an epoch already in the archive of a site is not written again.
+
+## The archive of a site for a UT day
+#
+#  @param directory - AssimilationConfig.archiveDirectory
+#  @param lat       - latitude of the site (degrees)
+#  @param lon       - longitude of the site (degrees)
+#  @param date      - python datetime or date of the UT day
+#
+def archivePath(directory, lat, lon, date):
+    return os.path.join(directory, date.strftime('%Y%m%d'), 'ionoState_{:+07.3f}_{:07.3f}.arc'.format(lat, lon % 360.0))
+
+## The last epoch in an archive
+#
+#  @param path - archive of a site, see archivePath
+#
+#  @retval python datetime, None if the archive does not exist or is empty
+#
+def archiveEpoch(path):
+    if not os.path.exists(path):
+        return None
+    records = loadArchive(path)
+    if len(records) == 0:
+        return None
+    return datetime(*[int(t) for t in records['UT'][-1]])
+
+## Assimilates the newest epoch of the sites and publishes their ionoStates
+#
+class AssimilationDaemon(threading.Thread):
+
+    ## Constructor
+    #
+    #  @param config     - AssimilationConfig() - defined in ConfigDef.py
+    #  @param computeFcn - computeFcn(lats, lons, epoch) returns (ionoStates, version, backgroundModel),
+    #                      ionoStates being a (N, 11) array for the N locations, see Manager.computeLattice
+    #
+    def __init__(self, config, computeFcn):
+        # Init the thread
+        super().__init__(name='AssimilationDaemon')
+        # Kill this thread when the main thread exist
+        self.daemon = True
+        # Wait until start is called
+        self.running = False
+        # Wakes the background thread up when it is told to stop
+        self.wakeUp = threading.Event()
+
+        self.config = config
+        self.computeFcn = computeFcn
+
+        # The reference sites followed by every point of the lattice, latitude major
+        lats = [site[0] for site in config.sites or []]
+        lons = [site[1] for site in config.sites or []]
+        if config.latticeConfig:
+            (latAxis, lonAxis) = latticeAxes(config.latticeConfig)
+            (latticeLats, latticeLons) = numpy.meshgrid(latAxis, lonAxis, indexing='ij')
+            lats += latticeLats.ravel().tolist()
+            lons += latticeLons.ravel().tolist()
+        self.lats = numpy.array(lats, dtype=float)
+        self.lons = numpy.array(lons, dtype=float)
+
+        os.makedirs(config.archiveDirectory, exist_ok=True)
+        # Last epoch published, from the archives when the daemon is started again
+        self.lastEpoch = self.publishedEpoch()
+
+    ## Start assimilating the epochs as the wall clock goes
+    #
+    def start(self):
+        self.running = True
+        super().start()
+
+    ## Stop the background thread, an assimilation in progress is finished first
+    #
+    def shutdown(self):
+        self.running = False
+        self.wakeUp.set()
+        if self.is_alive():
+            self.join()
+
+    ## The archives of every site for a UT day
+    #
+    #  @param date - python datetime or date of the UT day
+    #
+    #  @retval list of paths, the sites in the order of lats and lons
+    #
+    def archivePaths(self, date):
+        return [archivePath(self.config.archiveDirectory, lat, lon, date) for lat, lon in zip(self.lats, self.lons)]
+
+    ## The last epoch published to every site, None if a site has nothing published yet
+    #
+    #  Each site is looked up in the newest day it has an archive for.
+    #
+    def publishedEpoch(self):
+        days = sorted((day for day in os.listdir(self.config.archiveDirectory)
+                       if len(day) == 8 and day.isdigit()), reverse=True)
+        epochs = [None] * len(self.lats)
+        for day in days:
+            paths = self.archivePaths(datetime.strptime(day, '%Y%m%d'))
+            epochs = [epoch or archiveEpoch(path) for epoch, path in zip(epochs, paths)]
+            if all(epochs):
+                return min(epochs, default=None)
+        return None
+
+    ## The newest epoch old enough to be assimilated
+    #
+    #  @param now - python datetime
+    #
+    def latestEpoch(self, now):
+        dt = now - timedelta(seconds=self.config.delay)
+        midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        index = int((dt - midnight).total_seconds() // self.config.epochStep)
+        return midnight + timedelta(seconds=index * self.config.epochStep)
+
+    ## Compute the ionoStates of every site for an epoch and append them to the archives of its day
+    #
+    #  The sites whose archive already ends with the epoch, such as when an earlier attempt
+    #  failed part way, are left as they are.
+    #
+    #  @param epoch - python datetime of the epoch, on a whole minute
+    #
+    #  @retval ionoStates - (N, 11) array, the sites in the order of lats and lons
+    #
+    @timed('assimilation.epoch')
+    def assimilate(self, epoch):
+        (ionoStates, version, backgroundModel) = self.computeFcn(self.lats, self.lons, epoch)
+        ionoStates = numpy.asarray(ionoStates, dtype=float).reshape(len(self.lats), -1)
+        os.makedirs(os.path.join(self.config.archiveDirectory, epoch.strftime('%Y%m%d')), exist_ok=True)
+        for (path, lat, lon, ionoState) in zip(self.archivePaths(epoch), self.lats, self.lons, ionoStates):
+            if archiveEpoch(path) == epoch:
+                continue
+            with ArchiveWriter(path) as writer:
+                writer.writeRows(ionoStateRow(ionoState, epoch, lat, lon))
+        self.lastEpoch = epoch
+        logger.info('ionoStates of {} assimilated with {:s}, {:d} sites'.format(epoch, str(backgroundModel), len(self.lats)))
+        return ionoStates
+
+    ## Run the thread. Assimilates each epoch once its delay is over
+    #
+    def run(self):
+        while self.running:
+            now = datetime.utcnow()
+            epoch = self.latestEpoch(now)
+            failed = False
+            if self.lastEpoch is None or epoch > self.lastEpoch:
+                try:
+                    self.assimilate(epoch)
+                except Exception as e:
+                    logger.error('Assimilating the ionoStates of {} failed.'.format(epoch))
+                    logger.error('{}'.format(e))
+                    failed = True
+            # Until the next epoch is due, retrying sooner after a failure
+            timeout = (epoch + timedelta(seconds=self.config.epochStep + self.config.delay) - now).total_seconds()
+            if failed:
+                timeout = min(timeout, self.config.delay)
+            self.wakeUp.wait(max(timeout, 1.0))
+
+class UnitTest_AssimilationDaemon(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from IonoModelEngine.Config import ConfigValues
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = ConfigValues.AssimilationConfig()
+        self.config.archiveDirectory = self.directory.name
+        self.config.latticeConfig = ConfigValues.LatticeConfig()
+        self.config.latticeConfig.latMax = 21.0
+        self.config.latticeConfig.lonMax = 231.0
+        self.computed = []
+        self.done = threading.Event()
+        # Linear in latitude, longitude and time of day
+        def compute(lats, lons, epoch):
+            self.computed.append(epoch)
+            self.done.set()
+            return (self.expected(lats, lons, epoch), 1, 'ripe')
+        self.daemon = AssimilationDaemon(self.config, compute)
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.directory.cleanup()
+
+    def expected(self, lats, lons, epoch):
+        hours = epoch.hour + epoch.minute / 60.0
+        return numpy.outer(8.0 + 0.1 * lats - 0.02 * lons + 0.5 * hours + 0.2 * epoch.day, numpy.arange(1, 12))
+
+    def test_assimilate(self):
+        from numpy.testing import assert_allclose
+        from IonoModelEngine.ROAM.IonoStateArchive import readArchive
+        from IonoModelEngine.ROAM.IonoStateTable import readTable, ionoStateColumns
+        first = datetime(2015, 10, 20, 1, 0)
+        second = datetime(2015, 10, 20, 1, 5)
+        self.assertEqual(len(self.daemon.archivePaths(first)), 2 + 4)
+        self.assertIsNone(self.daemon.lastEpoch)
+        self.daemon.assimilate(first)
+        self.daemon.assimilate(second)
+        for (path, lat, lon) in zip(self.daemon.archivePaths(first), self.daemon.lats, self.daemon.lons):
+            rows = readArchive(path)
+            self.assertEqual(rows.shape, (2, 24))
+            assert_allclose(rows[1], ionoStateRow(self.expected(lat, lon, second)[0], second, lat, lon), atol=5e-5)
+            # Looked up like a ROAM_ionoState.txt file, between the epochs
+            state = readTable(path).at(1.05)[ionoStateColumns]
+            assert_allclose(state[0], self.expected(lat, lon, datetime(2015, 10, 20, 1, 3))[0, 0], atol=1e-4)
+        # Started again on the same archives
+        self.assertEqual(AssimilationDaemon(self.config, None).lastEpoch, second)
+
+    def test_days(self):
+        from numpy.testing import assert_allclose
+        from IonoModelEngine.ROAM.IonoStateTable import readTable, ionoStateColumns
+        epochs = [datetime(2015, 10, 20, 12, 0), datetime(2015, 10, 20, 12, 5),
+                  datetime(2015, 10, 21, 12, 0), datetime(2015, 10, 21, 12, 5)]
+        for epoch in epochs:
+            self.daemon.assimilate(epoch)
+        # Each day has its own archives, the states of a day are not mixed with the same hour of another day
+        for day in (epochs[0], epochs[2]):
+            for (path, lat, lon) in zip(self.daemon.archivePaths(day), self.daemon.lats, self.daemon.lons):
+                table = readTable(path)
+                self.assertEqual(len(table.uth), 2)
+                state = table.at(12.0 + 2 / 60.0)[ionoStateColumns]
+                assert_allclose(state[0], self.expected(lat, lon, day.replace(minute=2))[0, 0], atol=1e-4)
+        self.assertEqual(self.daemon.publishedEpoch(), epochs[3])
+
+    def test_retry(self):
+        from IonoModelEngine.ROAM.IonoStateArchive import readArchive
+        first = datetime(2015, 10, 20, 1, 0)
+        second = datetime(2015, 10, 20, 1, 5)
+        self.daemon.assimilate(first)
+        # An attempt at the second epoch that stopped after the first site
+        (lat, lon) = (self.daemon.lats[0], self.daemon.lons[0])
+        with ArchiveWriter(self.daemon.archivePaths(second)[0]) as writer:
+            writer.writeRows(ionoStateRow(self.expected(lat, lon, second)[0], second, lat, lon))
+        # Goes on after the epoch every site has
+        self.assertEqual(self.daemon.publishedEpoch(), first)
+        self.daemon.assimilate(second)
+        for path in self.daemon.archivePaths(second):
+            self.assertEqual(readArchive(path).shape[0], 2)
+        self.assertEqual(self.daemon.publishedEpoch(), second)
+
+    def test_run(self):
+        self.assertEqual(self.daemon.latestEpoch(datetime(2015, 10, 20, 1, 6)), datetime(2015, 10, 20, 1, 5))
+        self.assertEqual(self.daemon.latestEpoch(datetime(2015, 10, 20, 1, 5, 59)), datetime(2015, 10, 20, 1, 0))
+        self.daemon.start()
+        self.assertTrue(self.done.wait(10))
+        self.daemon.shutdown()
+        # The epoch due is assimilated once
+        self.assertEqual(self.computed, [self.daemon.latestEpoch(datetime.utcnow())])
+        self.assertEqual(self.daemon.publishedEpoch(), self.computed[0])
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
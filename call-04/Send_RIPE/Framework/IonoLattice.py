@@ -0,0 +1,302 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import math
+import threading
+import unittest
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import Shared.Utils.HfgeoLogger as Logger
+from IonoModelEngine.ROAM.TiltField import latticeAxes
+from Shared.Utils.Cache import LRUCache
+from Shared.Utils.Timing import timed
+
+logger = Logger.getLogger()
+
+## @package Framework.IonoLattice
+#  IonoStates of the theater on a lattice, for the Manager
+#
+#  For each epoch the 11 parameters of the ionoState are computed at once for every point of
+#  a lat/lon lattice. A request inside the lattice is then answered by bilinear interpolation
+#  between the 4 lattice points around it and linear interpolation between the epochs before
+#  and after it, without running ROAM.
+#
+#  The lattice of an epoch is computed by a single background thread: a request for an epoch
+#  that is not built yet is not answered by the lattice and schedules the build. In real time
+#  the thread started by start() keeps the epochs around the wall clock built, and rebuilds an
+#  epoch when the version of its data changes, i.e. when new soundings came in. The epochs whose
+#  data did not change are left as they are, and the old lattice of an epoch answers until its
+#  new lattice is complete.
+
+## The ionoStates of the recent epochs on a lattice
+#
+class IonoLattice(threading.Thread):
+
+    ## Constructor
+    #
+    #  @param config     - LatticeConfig() - defined in ConfigDef.py
+    #  @param computeFcn - computeFcn(lats, lons, epoch) returns (ionoStates, version, backgroundModel),
+    #                      ionoStates being a (N, 11) array for the N locations
+    #  @param versionFcn - versionFcn(epoch) returns the current version of the data of the epoch,
+    #                      the lattice of the epoch is rebuilt when it differs from the one built
+    #
+    def __init__(self, config, computeFcn, versionFcn):
+        # Init the thread
+        super().__init__(name='IonoLattice')
+        # Kill this thread when the main thread exist
+        self.daemon = True
+        # Wait until start is called
+        self.running = False
+        # Wakes the background thread up when it is told to stop
+        self.wakeUp = threading.Event()
+
+        self.config = config
+        self.computeFcn = computeFcn
+        self.versionFcn = versionFcn
+
+        # Every point of the lattice, latitude major
+        (self.latAxis, self.lonAxis) = latticeAxes(config)
+        (lats, lons) = numpy.meshgrid(self.latAxis, self.lonAxis, indexing='ij')
+        self.lats = lats.ravel()
+        self.lons = lons.ravel()
+
+        # epoch -> (ionoStates (numLat, numLon, 11), version, backgroundModel)
+        self.epochs = LRUCache(config.maxEpochs)
+
+        # The epochs are built one at a time by the builder thread
+        self.builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='IonoLatticeBuild')
+        # Epochs scheduled and not built yet, guarded by lock
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    ## Start keeping the epochs around the wall clock built
+    #
+    def start(self):
+        self.running = True
+        super().start()
+
+    ## Stop the background thread, a build in progress is not waited for
+    #
+    def shutdown(self):
+        self.running = False
+        self.wakeUp.set()
+        if self.is_alive():
+            self.join()
+        self.builder.shutdown(wait=False, cancel_futures=True)
+
+    ## The epochs before and after a time
+    #
+    #  @param dt - python datetime
+    #
+    #  @retval (first, second, weight) - datetimes of the epochs and the weight of the second one,
+    #          0 when dt is an epoch
+    #
+    def epochsAround(self, dt):
+        step = self.config.epochStep
+        midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        seconds = (dt - midnight).total_seconds()
+        index = math.floor(seconds / step)
+        first = midnight + timedelta(seconds=index * step)
+        return (first, first + timedelta(seconds=step), (seconds - index * step) / step)
+
+    ## Bring a longitude in the longitude range of the lattice when it is 360 degrees apart
+    #
+    def wrapLongitude(self, lon):
+        return self.lonAxis[0] + (lon - self.lonAxis[0]) % 360.0
+
+    ## True if the location is inside the lattice
+    #
+    def Contains(self, lat, lon):
+        lon = self.wrapLongitude(lon)
+        return self.latAxis[0] <= lat <= self.latAxis[-1] and lon <= self.lonAxis[-1]
+
+    ## Bilinear interpolation of the ionoStates of one epoch
+    #
+    #  @param ionoStates - (numLat, numLon, 11) array
+    #  @param lat        - latitude inside the lattice (degrees)
+    #  @param lon        - longitude inside the lattice (degrees)
+    #
+    #  @retval ionoState - array of 11
+    #
+    def Interpolate(self, ionoStates, lat, lon):
+        x = (lat - self.latAxis[0]) / self.config.spacing
+        y = (self.wrapLongitude(lon) - self.lonAxis[0]) / self.config.spacing
+        # The last row and column interpolate in the cell before them
+        i = min(int(x), len(self.latAxis) - 2)
+        j = min(int(y), len(self.lonAxis) - 2)
+        x -= i
+        y -= j
+        return ((1.0 - x) * ((1.0 - y) * ionoStates[i, j] + y * ionoStates[i, j + 1]) +
+                x * ((1.0 - y) * ionoStates[i + 1, j] + y * ionoStates[i + 1, j + 1]))
+
+    ## Answer a request from the lattice
+    #
+    #  Never waits for a build: when an epoch around the request is missing its build is
+    #  scheduled and None is returned.
+    #
+    #  @param lat - latitude (degrees)
+    #  @param lon - longitude (degrees)
+    #  @param dt  - python datetime
+    #
+    #  @retval (ionoState, backgroundModel), or None if the lattice cannot answer
+    #
+    def lookup(self, lat, lon, dt):
+        if not self.Contains(lat, lon):
+            return None
+        (first, second, weight) = self.epochsAround(dt)
+        epochs = [(first, 1.0 - weight)]
+        if weight > 0.0:
+            epochs.append((second, weight))
+        entries = [self.epochs.get(epoch) for (epoch, w) in epochs]
+        missing = [epoch for ((epoch, w), entry) in zip(epochs, entries) if entry is None]
+        if missing:
+            for epoch in missing:
+                self.schedule(epoch)
+            return None
+        ionoState = sum(w * self.Interpolate(entry[0], lat, lon) for ((epoch, w), entry) in zip(epochs, entries))
+        # The model of the nearest epoch
+        backgroundModel = entries[-1][2] if weight > 0.5 else entries[0][2]
+        return (ionoState, backgroundModel)
+
+    ## Have the builder thread build the lattice of an epoch, unless it is already scheduled
+    #
+    def schedule(self, epoch):
+        with self.lock:
+            if epoch in self.pending:
+                return
+            self.pending.add(epoch)
+        self.builder.submit(self.buildScheduled, epoch)
+
+    ## Build a scheduled epoch, run by the builder thread
+    #
+    def buildScheduled(self, epoch):
+        try:
+            self.build(epoch)
+        except Exception as e:
+            logger.error('Building the ionoState lattice of {} failed.'.format(epoch))
+            logger.error('{}'.format(e))
+        finally:
+            with self.lock:
+                self.pending.discard(epoch)
+
+    ## Compute the ionoStates of every point of the lattice for an epoch
+    #
+    #  @param epoch - python datetime of the epoch, see epochsAround
+    #
+    #  @retval (ionoStates, version, backgroundModel) - ionoStates is a (numLat, numLon, 11) array
+    #
+    @timed('lattice.build')
+    def build(self, epoch):
+        (ionoStates, version, backgroundModel) = self.computeFcn(self.lats, self.lons, epoch)
+        entry = (numpy.asarray(ionoStates, dtype=float).reshape(len(self.latAxis), len(self.lonAxis), -1),
+                 version, backgroundModel)
+        self.epochs.put(epoch, entry)
+        logger.info('ionoState lattice of {} built with {:s}, {:d} points'.format(epoch, str(backgroundModel), len(self.lats)))
+        return entry
+
+    ## Schedule the rebuild of the epochs whose data changed since they were built
+    #
+    #  @retval list of the epochs scheduled
+    #
+    def refresh(self):
+        changed = []
+        for epoch in self.epochs.keys():
+            entry = self.epochs.get(epoch)
+            if entry is not None and self.versionFcn(epoch) != entry[1]:
+                changed.append(epoch)
+                self.schedule(epoch)
+        return changed
+
+    ## Run the thread. Keeps the epochs around the wall clock built and up to date with the data
+    #
+    def run(self):
+        while self.running:
+            try:
+                for epoch in self.refresh():
+                    logger.info('New data for {}, rebuilding its ionoState lattice'.format(epoch))
+                (first, second, weight) = self.epochsAround(datetime.utcnow())
+                for epoch in [first, second]:
+                    if self.epochs.get(epoch) is None:
+                        self.schedule(epoch)
+            except Exception as e:
+                logger.error('Refreshing the ionoState lattice failed.')
+                logger.error('{}'.format(e))
+            self.wakeUp.wait(self.config.refreshInterval)
+
+class UnitTest_IonoLattice(unittest.TestCase):
+
+    def setUp(self):
+        from IonoModelEngine.Config import ConfigValues
+        self.config = ConfigValues.LatticeConfig()
+        self.version = 1
+        self.computed = []
+        # Linear in latitude, longitude and time, so the interpolation is exact
+        def compute(lats, lons, epoch):
+            self.computed.append(epoch)
+            hours = (epoch - datetime(2015, 10, 20)).total_seconds() / 3600.0
+            ionoStates = numpy.outer(8.0 + 0.1 * lats - 0.02 * lons + 0.5 * hours, numpy.arange(1, 12))
+            return (ionoStates, self.version, 'ripe')
+        self.lattice = IonoLattice(self.config, compute, lambda epoch: self.version)
+
+    def tearDown(self):
+        self.lattice.shutdown()
+
+    def expected(self, lat, lon, dt):
+        hours = (dt - datetime(2015, 10, 20)).total_seconds() / 3600.0
+        return (8.0 + 0.1 * lat - 0.02 * (lon % 360.0) + 0.5 * hours) * numpy.arange(1, 12)
+
+    def test_lookup(self):
+        from numpy.testing import assert_allclose
+        dt = datetime(2015, 10, 20, 0, 5)
+        # Nothing built yet, both epochs around the request are scheduled
+        self.assertIsNone(self.lattice.lookup(37.2321, 256.2323, dt))
+        self.lattice.builder.submit(lambda: None).result()
+        self.assertEqual(sorted(self.computed), [datetime(2015, 10, 20), datetime(2015, 10, 20, 0, 15)])
+        for (lat, lon) in [(37.2321, 256.2323), (32.4824, -106.3809), (55.0, 300.0), (20.0, 230.0)]:
+            (ionoState, backgroundModel) = self.lattice.lookup(lat, lon, dt)
+            assert_allclose(ionoState, self.expected(lat, lon, dt))
+            self.assertEqual(backgroundModel, 'ripe')
+        # Outside of the lattice
+        self.assertIsNone(self.lattice.lookup(10.0, 256.0, dt))
+        self.assertIsNone(self.lattice.lookup(40.0, 0.0, dt))
+        # On an epoch only that epoch is needed
+        self.assertIsNotNone(self.lattice.lookup(40.0, 260.0, datetime(2015, 10, 20)))
+
+    def test_refresh(self):
+        first = datetime(2015, 10, 20)
+        second = datetime(2015, 10, 20, 0, 15)
+        self.lattice.build(first)
+        self.lattice.build(second)
+        self.assertEqual(self.lattice.refresh(), [])
+        # New soundings for the second epoch only
+        self.lattice.versionFcn = lambda epoch: 2 if epoch == second else 1
+        self.assertEqual(self.lattice.refresh(), [second])
+        self.lattice.builder.submit(lambda: None).result()
+        self.assertEqual(self.computed, [first, second, second])
+        # The builder only keeps maxEpochs
+        for n in range(0, self.config.maxEpochs):
+            self.lattice.build(second + timedelta(minutes=15 * (n + 1)))
+        self.assertEqual(len(self.lattice.epochs), self.config.maxEpochs)
+        self.assertIsNone(self.lattice.epochs.get(first))
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
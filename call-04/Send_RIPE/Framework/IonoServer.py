@@ -0,0 +1,311 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import json
+import queue
+import socket
+import threading
+import time
+import unittest
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import Shared.Utils.DateTime as DateTime
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package Framework.IonoServer
+#  Socket front end of the Manager. Requests are newline delimited JSON objects
+#
+#    {"id": 1, "lat": 40.0, "lon": 254.7, "time": "2018-01-28T13:30:00.000000Z"}
+#
+#  and every request is answered with one JSON line carrying the same id and a status:
+#
+#    {"id": 1, "status": "ok", "ionoState": [foF2, hmF2, ..., beta_lon], "model": "ripe"}
+#    {"id": 1, "status": "busy"}      - the request queue is full, try again later
+#    {"id": 1, "status": "timeout"}   - no answer within ServerConfig.requestTimeout
+#    {"id": 1, "status": "error", "message": "..."}
+#
+#  The model is only sent when the query function tells which model answered.
+
+## Convert a request message into the arguments of Manager.queryIonoState
+#
+#  @param message - bytes or string - one JSON encoded request
+#
+#  @retval (requestId, lat, lon, requestDateTime)
+#
+def messageToIonoRequest(message):
+    request = json.loads(message)
+    requestId = request.get('id')
+    lat = float(request['lat'])
+    lon = float(request['lon'])
+    requestDateTime = DateTime.iso8601ToDateTimeObj(request['time'])
+    return (requestId, lat, lon, requestDateTime)
+
+## Convert a reply into a message that can be sent back to the client
+#
+#  @param requestId - the id of the request being answered
+#  @param status    - string - 'ok', 'busy', 'timeout' or 'error'
+#  @param ionoState - the 11 parameter ionoState, only used when status is 'ok'
+#  @param message   - string - explanation, only used when status is 'error'
+#  @param model     - string - the model that computed the ionoState, only used when status is 'ok'
+#
+#  @retval bytes - one JSON encoded reply terminated by a newline
+#
+def ionoReplyToMessage(requestId, status, ionoState=None, message=None, model=None):
+    reply = {'id': requestId, 'status': status}
+    if ionoState is not None:
+        reply['ionoState'] = [float(x) for x in ionoState]
+    if model is not None:
+        reply['model'] = model
+    if message is not None:
+        reply['message'] = message
+    return (json.dumps(reply) + '\n').encode('utf-8')
+
+## Serving loop behind Manager.run()
+#
+#  The server thread accepts connections and hands each one to its own connection thread.
+#  Connection threads put the requests on a bounded queue which is drained by a fixed pool
+#  of worker threads calling queryFcn. When the queue is full the request is answered 'busy'
+#  straight away, so a burst of clients cannot pile up unbounded work behind a slow NOAA fetch.
+#
+class IonoServer(threading.Thread):
+
+    ## Constructor
+    #
+    #  @param config   - ServerConfig() - defined in ConfigDef.py
+    #  @param queryFcn - callable(lat, lon, requestDateTime) returning the ionoState,
+    #                    or a tuple (ionoState, model) to tell the client which model answered
+    #
+    def __init__(self, config, queryFcn):
+        # Init the thread
+        super().__init__()
+        # Kill this thread when the main thread exist
+        self.daemon = True
+        # Wait until start is called
+        self.running = False
+        # Locking mechanism
+        self.lock = threading.Lock()
+
+        self.config = config
+        self.queryFcn = queryFcn
+
+        # Requests waiting for a worker
+        self.requestQueue = queue.Queue(maxsize=self.config.queueSize)
+        self.workers = []
+        self.connections = []
+
+        # Bind now so that the caller knows straight away if the port is taken
+        self.listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listenSocket.bind((self.config.host, self.config.port))
+        self.listenSocket.listen()
+        # Wake up regularly to check if we were told to stop
+        self.listenSocket.settimeout(0.5)
+
+    ## The address the server is listening on, useful when the configured port is 0
+    #
+    def address(self):
+        return self.listenSocket.getsockname()
+
+    ## Start the workers and the accept loop
+    #
+    def start(self):
+        self.running = True
+        for n in range(0, self.config.numWorkers):
+            worker = threading.Thread(target=self.work, name='IonoServerWorker-{:d}'.format(n), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        super().start()
+
+    ## Stop accepting requests, let the workers finish the queued ones and close everything
+    #
+    #  @param timeout - seconds to wait for each worker to finish
+    #
+    def shutdown(self, timeout=None):
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
+        for worker in self.workers:
+            worker.join(timeout)
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                conn.close()
+            self.connections = []
+        logger.info('IonoServer stopped')
+
+    ## Accept loop
+    #
+    def run(self):
+        logger.info('IonoServer listening on {}:{}'.format(*self.address()))
+        try:
+            while self.running:
+                try:
+                    (conn, addr) = self.listenSocket.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                with self.lock:
+                    self.connections.append(conn)
+                threading.Thread(target=self.serveConnection, args=(conn, addr), daemon=True).start()
+        finally:
+            self.listenSocket.close()
+
+    ## Read requests from one client and answer them in order
+    #
+    def serveConnection(self, conn, addr):
+        logger.debug('IonoServer connection from {}'.format(addr))
+        try:
+            with conn.makefile('rb') as reader:
+                for line in reader:
+                    if not line.strip():
+                        continue
+                    conn.sendall(self.handle(line))
+                    if not self.running:
+                        break
+        except OSError as e:
+            logger.debug('IonoServer connection {} closed: {}'.format(addr, e))
+        finally:
+            with self.lock:
+                if conn in self.connections:
+                    self.connections.remove(conn)
+            conn.close()
+
+    ## Queue one request and wait for its answer
+    #
+    #  @param message - bytes - one JSON encoded request
+    #
+    #  @retval bytes - the JSON encoded reply
+    #
+    def handle(self, message):
+        requestId = None
+        try:
+            (requestId, lat, lon, requestDateTime) = messageToIonoRequest(message)
+        except Exception as e:
+            logger.error('IonoServer could not parse request {}'.format(message))
+            return ionoReplyToMessage(requestId, 'error', message='bad request: {}'.format(e))
+
+        if not self.running:
+            return ionoReplyToMessage(requestId, 'error', message='server is shutting down')
+
+        future = Future()
+        try:
+            self.requestQueue.put_nowait((future, lat, lon, requestDateTime))
+        except queue.Full:
+            logger.warning('IonoServer queue is full, request {} rejected'.format(requestId))
+            return ionoReplyToMessage(requestId, 'busy')
+
+        model = None
+        try:
+            ionoState = future.result(timeout=self.config.requestTimeout)
+            if isinstance(ionoState, tuple):
+                (ionoState, model) = ionoState
+        except FutureTimeoutError:
+            # If no worker picked it up yet this stops it from ever running
+            future.cancel()
+            logger.warning('IonoServer request {} timed out'.format(requestId))
+            return ionoReplyToMessage(requestId, 'timeout')
+        except Exception as e:
+            logger.error('IonoServer request {} failed: {}'.format(requestId, e))
+            return ionoReplyToMessage(requestId, 'error', message=str(e))
+
+        return ionoReplyToMessage(requestId, 'ok', ionoState=ionoState, model=model)
+
+    ## Worker loop. Keeps draining the queue after shutdown so accepted requests are answered
+    #
+    def work(self):
+        while self.running or not self.requestQueue.empty():
+            try:
+                (future, lat, lon, requestDateTime) = self.requestQueue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                # False if the client already gave up on it
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.queryFcn(lat, lon, requestDateTime))
+                except Exception as e:
+                    future.set_exception(e)
+            finally:
+                self.requestQueue.task_done()
+
+class UnitTest_IonoServer(unittest.TestCase):
+
+    def setUp(self):
+        from IonoModelEngine.Config import ConfigValues
+        self.config = ConfigValues.ServerConfig()
+        self.config.port = 0
+        self.config.numWorkers = 1
+        self.config.queueSize = 1
+        self.config.requestTimeout = 0.5
+
+    def request(self, address, lat):
+        message = json.dumps({'id': lat, 'lat': lat, 'lon': 254.7, 'time': '2018-01-28T13:30:00.000000Z'})
+        with socket.create_connection(address) as client:
+            client.sendall((message + '\n').encode('utf-8'))
+            with client.makefile('rb') as reader:
+                return json.loads(reader.readline())
+
+    def test_ok(self):
+        server = IonoServer(self.config, lambda lat, lon, dt: [lat, lon, dt.hour])
+        server.start()
+        reply = self.request(server.address(), 40.0)
+        server.shutdown()
+        self.assertEqual(reply['status'], 'ok')
+        self.assertEqual(reply['ionoState'], [40.0, 254.7, 13.0])
+        self.assertNotIn('model', reply)
+
+    def test_model(self):
+        server = IonoServer(self.config, lambda lat, lon, dt: ([lat], 'iri'))
+        server.start()
+        reply = self.request(server.address(), 40.0)
+        server.shutdown()
+        self.assertEqual(reply['ionoState'], [40.0])
+        self.assertEqual(reply['model'], 'iri')
+
+    def test_timeoutAndBusy(self):
+        release = threading.Event()
+        def slowQuery(lat, lon, dt):
+            release.wait(5)
+            return [lat]
+        server = IonoServer(self.config, slowQuery)
+        server.start()
+        replies = {}
+        def ask(lat):
+            replies[lat] = self.request(server.address(), lat)
+        # One request on the worker, one in the queue, the third is rejected
+        threads = [threading.Thread(target=ask, args=(float(n),)) for n in range(0, 3)]
+        for t in threads:
+            t.start()
+            time.sleep(0.1)
+        for t in threads:
+            t.join()
+        release.set()
+        server.shutdown()
+        statuses = sorted(reply['status'] for reply in replies.values())
+        self.assertEqual(statuses, ['busy', 'timeout', 'timeout'])
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
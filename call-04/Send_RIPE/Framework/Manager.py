@@ -19,31 +19,60 @@
 # MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
 
 import unittest
+import unittest.mock
 import time
 import os
 import threading
 import shutil
+import copy
+import numpy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as waitFutures
 from datetime import datetime
 import Shared.IonoPyIface.Pharlap as IonoPyIface
 from IonoModelEngine.Config import ConfigDef, ConfigValues
-from IonoModelEngine.DataControl.DataController import DataController
+from IonoModelEngine.DataControl.DataController import DataController, dataVersion
 from IonoModelEngine.ROAM.ROAM import ROAM
 import Shared.Utils.HfgeoLogger as Logger
 from Shared.IonoPyIface.Pharlap import Pharlap
 from IonoModelEngine.Fit.SaoPyIface import SaoPyIface
 from IonoModelEngine.IRTAM.IrtamPyIface import IrtamPyIface 
+from Framework.IonoServer import IonoServer
+from Framework.WorkerPool import WorkerPool
+from Framework.IonoLattice import IonoLattice
+from Framework.AssimilationDaemon import AssimilationDaemon
+from Shared.Utils.Cache import LRUCache, quantize
+from Shared.Utils.DateTime import snapDateTime
+from Shared.Utils.SingleFlight import SingleFlight
+import Shared.Utils.Timing as Timing
+from Shared.Utils.Geodesy import greatCircleControlPoints
 
 logger = Logger.getLogger()
 
 ## @package IonoModelnEngine.Framework.Manager
 #  The manager for IonoModelnEngine
 
+## Subsystems of the Manager, in the order they are warmed up
+managerSubsystems = ['pharlap', 'irtam', 'roam', 'saoReader', 'dataController', 'workerPool', 'lattice', 'assimilation']
+
 ## The manager class. It creates and owns all threaded modules
 #
+#  Loading the native libraries and standing up the data controller and the worker processes
+#  takes a while, so the constructor only records the configuration and a warm up thread
+#  builds the subsystems in the background. Requests wait for the subsystems they need,
+#  readiness() and waitReady() tell when each of them is warm.
+#
 class Manager():
-    __slots__ = ['config', 'heartbeatChannel', 'ionoChannel', 'saoReaderHandle', 'irtamHandle', 'pharlapHandle', 'dataController', 'roam', 'running']
+    __slots__ = ['config', 'heartbeatChannel', 'ionoChannel', 'saoReaderHandle', 'irtamHandle', 'pharlapHandle', 'dataController', 'roam', 'workerPool', 'cache', 'singleFlight', 'running',
+                 'ready', 'readyCondition', 'warmUpError', 'warmUpThread', 'breakdowns', 'fallbackRoams', 'latestCache', 'deadlineExecutor', 'lattice',
+                 'assimilation', 'dataVersions']
 
-    ## Constructor
+    ## Constructor, returns straight away and warms the subsystems up in the background
+    #
+    #  @param saoReaderHandle - SaoPyIface() - created during the warm up if not provided
+    #  @param irtamHandle     - IrtamPyIface() - created during the warm up if not provided
+    #  @param pharlapHandle   - Pharlap() - created during the warm up if not provided
     #
     def __init__(self, config, saoReaderHandle=None, irtamHandle=None, pharlapHandle=None):
 
@@ -53,72 +82,590 @@ class Manager():
         self.heartbeatChannel = None
         self.ionoChannel      = None
 
-        # Create handle to SAO reader 
-        if saoReaderHandle:
-            self.saoReaderHandle = saoReaderHandle
-        else:
-            self.saoReaderHandle = SaoPyIface()
-
-        # Create handle to IRTAM Processor
-        if irtamHandle:
-            self.irtamHandle = irtamHandle
-        else:
-            self.irtamHandle = IrtamPyIface()
-
-        # Create handle to Pharlap
-        if pharlapHandle:
-            self.pharlapHandle = pharlapHandle
-        else:
-            self.pharlapHandle = Pharlap()
-
-        # Standup the data controler which does the downloading and massaging of external data        
-        self.dataController = DataController(self.config.dataControllerConfig,
-                                             self.saoReaderHandle, 
-                                             self.irtamHandle,
-                                             self.pharlapHandle)
-
-        self.roam = ROAM(self.config.roamConfig,
-                         self.irtamHandle, 
-                         self.pharlapHandle)
+        # Handles provided by the caller, the missing ones are created by warmUp()
+        self.saoReaderHandle = saoReaderHandle
+        self.irtamHandle = irtamHandle
+        self.pharlapHandle = pharlapHandle
+        self.dataController = None
+        self.roam = None
+        self.workerPool = None
+        self.lattice = None
+        self.assimilation = None
+        # ROAMs answering the requests that cannot wait for the configured model, keyed by model
+        self.fallbackRoams = {}
+
+        # Cache of the ionoStates already computed, only if configured
+        self.cache = None
+        # Last state computed for each cell, whatever the version of the data, see computeIonoStateWithin
+        self.latestCache = None
+        # Version of the data of each epoch, so that a cache hit needs neither the data check nor the version
+        self.dataVersions = None
+        cacheConfig = getattr(self.config, 'cacheConfig', None)
+        if cacheConfig:
+            self.cache = LRUCache(cacheConfig.maxSize, cacheConfig.ttl)
+            self.latestCache = LRUCache(cacheConfig.maxSize, cacheConfig.ttl)
+            self.dataVersions = LRUCache(cacheConfig.maxSize, getattr(cacheConfig, 'versionTtl', None) or 0)
+
+        # Threads computing the requests that have a latency budget, see queryIonoStateTagged
+        self.deadlineExecutor = ThreadPoolExecutor(thread_name_prefix='ManagerDeadline')
+
+        # Identical requests arriving together are only computed once
+        self.singleFlight = SingleFlight()
+
+        # Per stage timings of the last requests, see timingBreakdowns()
+        self.breakdowns = deque(maxlen=100)
+
+        # Which subsystems are warm, guarded by readyCondition
+        self.ready = {subsystem: False for subsystem in managerSubsystems}
+        self.readyCondition = threading.Condition()
+        self.warmUpError = None
+        self.warmUpThread = threading.Thread(target=self.warmUp, name='ManagerWarmUp', daemon=True)
+        self.warmUpThread.start()
 
         # Set this method up to run
         self.running = True
 
+    ## Build the subsystems, run by the warm up thread
+    #
+    def warmUp(self):
+        start = time.time()
+        try:
+            # Create handle to Pharlap
+            if not self.pharlapHandle:
+                self.pharlapHandle = Pharlap()
+            self.setReady('pharlap')
+
+            # Create handle to IRTAM Processor
+            if not self.irtamHandle:
+                self.irtamHandle = IrtamPyIface()
+            self.setReady('irtam')
+
+            self.roam = ROAM(self.config.roamConfig,
+                             self.irtamHandle, 
+                             self.pharlapHandle)
+            for backgroundModel in ['irtam', 'iri']:
+                roamConfig = copy.copy(self.config.roamConfig)
+                roamConfig.backgroundModel = backgroundModel
+                self.fallbackRoams[backgroundModel] = ROAM(roamConfig, self.irtamHandle, self.pharlapHandle)
+            self.setReady('roam')
+
+            # Create handle to SAO reader 
+            if not self.saoReaderHandle:
+                self.saoReaderHandle = SaoPyIface()
+            self.setReady('saoReader')
+
+            # Standup the data controler which does the downloading and massaging of external data        
+            self.dataController = DataController(self.config.dataControllerConfig,
+                                                 self.saoReaderHandle, 
+                                                 self.irtamHandle,
+                                                 self.pharlapHandle)
+            self.setReady('dataController')
+
+            # Worker processes evaluating roam, only if configured
+            workerPoolConfig = getattr(self.config, 'workerPoolConfig', None)
+            if workerPoolConfig:
+                self.workerPool = WorkerPool(workerPoolConfig, self.config.roamConfig)
+                self.workerPool.warmUp()
+            self.setReady('workerPool')
+
+            # IonoStates of the theater on a lattice, only if configured
+            latticeConfig = getattr(self.config, 'latticeConfig', None)
+            if latticeConfig:
+                self.lattice = IonoLattice(latticeConfig, self.computeLattice, self.latticeVersion)
+                # In real time the lattice follows the wall clock and the data staged in the background
+                if self.config.dataControllerConfig.realTime:
+                    self.lattice.start()
+            self.setReady('lattice')
+
+            # Continuous assimilation publishing the ionoStates of the reference sites, only if configured
+            assimilationConfig = getattr(self.config, 'assimilationConfig', None)
+            if assimilationConfig:
+                self.assimilation = AssimilationDaemon(assimilationConfig, self.computeLattice)
+                self.assimilation.start()
+            self.setReady('assimilation')
+        except Exception as e:
+            logger.error('Manager warm up failed.')
+            logger.error('{}'.format(e))
+            with self.readyCondition:
+                self.warmUpError = e
+                self.readyCondition.notify_all()
+            return
+        logger.info('Manager warmed up in {:.3f} s'.format(time.time() - start))
+
+    ## Mark a subsystem as warm and wake up the requests waiting for it
+    #
+    def setReady(self, subsystem):
+        with self.readyCondition:
+            self.ready[subsystem] = True
+            self.readyCondition.notify_all()
+        logger.debug('Manager {:s} is ready'.format(subsystem))
+
+    ## Which subsystems are warm
+    #
+    #  @retval dictionary subsystem -> Boolean, see managerSubsystems
+    #
+    def readiness(self):
+        with self.readyCondition:
+            return dict(self.ready)
+
+    ## Wait until subsystems are warm
+    #
+    #  @param subsystems - list of names from managerSubsystems, None for all of them
+    #  @param timeout    - seconds to wait, None to wait as long as it takes
+    #
+    #  @retval True if the subsystems are ready, False if the timeout expired first
+    #
+    def waitReady(self, subsystems=None, timeout=None):
+        if subsystems is None:
+            subsystems = managerSubsystems
+        with self.readyCondition:
+            isReady = self.readyCondition.wait_for(
+                lambda: self.warmUpError is not None or all(self.ready[subsystem] for subsystem in subsystems),
+                timeout)
+            if all(self.ready[subsystem] for subsystem in subsystems):
+                return True
+            if self.warmUpError is not None:
+                raise RuntimeError('Manager could not start: {}'.format(self.warmUpError)) from self.warmUpError
+            return isReady
+
+    ## The subsystems needed to answer a request with the configured background model
+    #
+    def requiredSubsystems(self):
+        subsystems = ['workerPool' if getattr(self.config, 'workerPoolConfig', None) else 'roam']
+        if not 'iri' in self.config.roamConfig.backgroundModel:
+            subsystems.append('dataController')
+        return subsystems
+
     ## Return the ionostate for the location and time specified in the request
     #
-    def queryIonoState(self, requestLat, requestLon, requestDateTime):
+    #  When the cache is configured the request is snapped to the cache steps first, so
+    #  every request falling in the same cell gets the state computed for the cell.
+    #  Requests for a cell that is being computed wait for it rather than computing it again.
+    #
+    #  @param budget - seconds the caller can wait, None to wait for the configured model, see queryIonoStateTagged
+    #
+    def queryIonoState(self, requestLat, requestLon, requestDateTime, budget=None):
+        return self.queryIonoStateTagged(requestLat, requestLon, requestDateTime, budget)[0]
+
+    ## Same as queryIonoState, also telling which model answered
+    #
+    #  With a budget, the configured model is computed in the background. If the data download
+    #  or the model cannot finish in time the best answer available without the data is returned,
+    #  see computeIonoStateWithin, and the computation goes on to fill the cache for the next requests.
+    #
+    #  With the lattice configured, a request inside it is interpolated from the lattice once the
+    #  epochs around it are built, see Framework.IonoLattice.
+    #
+    #  @param budget - seconds the caller can wait, None to wait for the configured model
+    #
+    #  @retval (ionoState, backgroundModel) - backgroundModel is 'ripe', 'ripe-irtam', 'irtam' or 'iri',
+    #          prefixed with 'cache:' when an earlier state of the cell is returned and with 'lattice:'
+    #          when the state is interpolated from the lattice
+    #
+    def queryIonoStateTagged(self, requestLat, requestLon, requestDateTime, budget=None):
+        with Timing.request() as breakdown:
+            with Timing.stage('query'):
+                reply = self.lattice.lookup(requestLat, requestLon, requestDateTime) if self.lattice else None
+                if reply is not None:
+                    (reply, backgroundModel) = (reply[0], 'lattice:' + reply[1])
+                else:
+                    if self.cache is not None:
+                        (cellKey, requestLat, requestLon, requestDateTime) = self.quantizeRequest(requestLat, requestLon, requestDateTime)
+                    else:
+                        cellKey = (requestLat, requestLon, requestDateTime, str(self.config.roamConfig.backgroundModel))
+                    if budget is None:
+                        (reply, backgroundModel) = self.singleFlight.do(cellKey, self.computeIonoState, requestLat, requestLon, requestDateTime, cellKey)
+                    else:
+                        (reply, backgroundModel) = self.computeIonoStateWithin(budget, requestLat, requestLon, requestDateTime, cellKey)
+        self.breakdowns.append({'lat': requestLat, 'lon': requestLon, 'time': requestDateTime,
+                                'model': backgroundModel, 'stages': breakdown})
+        # Return a copy so that the caller cannot modify the cached or shared state
+        return (reply.copy(), backgroundModel)
+
+    ## Do the work of queryIonoState, only one call per cell at a time
+    #
+    #  @param cellKey - key of the cell of the request, see quantizeRequest
+    #
+    #  @retval (ionoState, backgroundModel)
+    #
+    def computeIonoState(self, requestLat, requestLon, requestDateTime, cellKey):
         # Check the if there are supporting data to answer the request.
         # If yes then just return so that roam can continue to process
         # If no then fetch the data, massage it and then put it in a locaiton that roam wants
         # Only do this if the background model is NOT IRI
+        self.waitReady(self.requiredSubsystems())
+        # Look for the state of this cell with the version of the data last seen for the epoch
+        if self.cache is not None:
+            version = self.dataVersions.get(requestDateTime)
+            if version is not None:
+                reply = self.cache.get(cellKey + (version,))
+                if reply is not None:
+                    logger.debug(reply)
+                    return reply
         dataControlerOutput = []
         if not 'iri' in self.config.roamConfig.backgroundModel:
             dataControlerOutput = self.dataController.process(requestDateTime)
-        # Tell roam to process the request provided that the data is in place.
-        # If there is no data default to using IRI        
-        reply = self.roam.CalcIonoState(requestLat, requestLon, requestDateTime, dataControlerOutput)
+        # No cache, go straight to roam
+        if self.cache is None:
+            reply = (self.calcIonoState(requestLat, requestLon, requestDateTime, dataControlerOutput),
+                     self.roam.SelectInputFiles(dataControlerOutput)[0])
+            logger.debug(reply)
+            return reply
+        # Look for the state of this cell and this version of the data
+        key = cellKey + (self.recordDataVersion(requestDateTime, dataControlerOutput),)
+        reply = self.cache.get(key)
+        if reply is None:
+            # Tell roam to process the request provided that the data is in place.
+            # If there is no data default to using IRI
+            reply = (self.calcIonoState(requestLat, requestLon, requestDateTime, dataControlerOutput),
+                     self.roam.SelectInputFiles(dataControlerOutput)[0])
+            self.cache.put(key, reply)
+            self.latestCache.put(cellKey, reply)
         logger.debug(reply)
-        # Return the reply
         return reply
 
+    ## Compute the version of the data of an epoch and remember it for the next requests
+    #
+    #  The version is remembered for cacheConfig.versionTtl, so the requests of the epoch that
+    #  hit the cache within it skip DataController.process and the checksum of the files. After
+    #  it the data is checked again and new data gives a new version.
+    #
+    #  @param requestDateTime     - epoch of the data, snapped to the cache step
+    #  @param dataControlerOutput - dictionary of file lists returned by DataController.process
+    #
+    #  @retval version - see DataController.dataVersion
+    #
+    def recordDataVersion(self, requestDateTime, dataControlerOutput):
+        version = dataVersion(dataControlerOutput)
+        self.dataVersions.put(requestDateTime, version)
+        return version
+
+    ## computeIonoState with a latency budget
+    #
+    #  When computeIonoState is not done within the budget the last state computed for the cell
+    #  answers straight away. Without one, the fallback of degradedIonoState is started and the
+    #  first of the configured model and the fallback done within another budget answers.
+    #
+    #  @param budget  - seconds to wait for computeIonoState, then for the fallback
+    #  @param cellKey - key of the cell of the request, see quantizeRequest
+    #
+    #  @retval (ionoState, backgroundModel)
+    #
+    def computeIonoStateWithin(self, budget, requestLat, requestLon, requestDateTime, cellKey):
+        # The stages run by the executor are collected there and added to the breakdown of the request
+        future = self.deadlineExecutor.submit(Timing.collect, self.singleFlight.do, cellKey, self.computeIonoState,
+                                              requestLat, requestLon, requestDateTime, cellKey)
+        try:
+            return self.collected(future, budget)
+        except FutureTimeoutError:
+            logger.warning('ionoState for {} not ready within {} s, degrading'.format(requestDateTime, budget))
+        except Exception as e:
+            logger.error('ionoState for {} failed, degrading'.format(requestDateTime))
+            logger.error('{}'.format(e))
+            future = None
+
+        with Timing.stage('degraded'):
+            if self.latestCache is not None:
+                latest = self.latestCache.get(cellKey)
+                if latest is not None:
+                    return (latest[0], 'cache:' + latest[1])
+
+            deadline = time.monotonic() + budget
+            degraded = self.deadlineExecutor.submit(Timing.collect, self.degradedIonoState, requestLat, requestLon,
+                                                    requestDateTime, budget)
+            pending = {degraded} if future is None else {future, degraded}
+            while pending:
+                (done, pending) = waitFutures(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                # The configured model first if both are done
+                for answer in [future, degraded]:
+                    if answer in done and answer.exception() is None:
+                        degraded.cancel()
+                        return self.collected(answer)
+            if degraded.done():
+                # Raises the error of the fallback
+                return self.collected(degraded)
+            degraded.cancel()
+            raise FutureTimeoutError('No ionoState for {}, the fallback is not done within {} s either'.format(requestDateTime, budget))
+
+    ## The result of a Timing.collect task, its stages added to the breakdown of the request
+    #
+    #  @param future  - future of Timing.collect
+    #  @param timeout - seconds to wait for it, None to wait until it is done
+    #
+    def collected(self, future, timeout=None):
+        (result, stages) = future.result(timeout=timeout)
+        Timing.merge(stages)
+        return result
+
+    ## Best answer available without waiting for data: IRTAM if its coefficients are already
+    #  on disk, else IRI
+    #
+    #  @param timeout - seconds to wait for roam to be warm, None to wait until it is
+    #
+    #  @retval (ionoState, backgroundModel)
+    #
+    def degradedIonoState(self, requestLat, requestLon, requestDateTime, timeout=None):
+        if not self.waitReady(['roam'], timeout):
+            raise RuntimeError('ROAM is not warm after {} s, no ionoState for {}'.format(timeout, requestDateTime))
+
+        giroManager = self.dataController.giroManager if self.readiness()['dataController'] else None
+        if giroManager:
+            giroFiles = giroManager.localFiles(requestDateTime)
+            if len(giroFiles) == 4:
+                return (self.fallbackRoams['irtam'].CalcIonoState(requestLat, requestLon, requestDateTime,
+                                                                  {'noaa': [], 'giro': giroFiles}),
+                        'irtam')
+
+        return (self.fallbackRoams['iri'].CalcIonoState(requestLat, requestLon, requestDateTime, {}), 'iri')
+
+    ## ROAM.CalcIonoState in the worker processes if there are any, else in this process
+    #
+    def calcIonoState(self, requestLat, requestLon, requestDateTime, dataControlerOutput):
+        if self.workerPool:
+            return self.workerPool.CalcIonoState(requestLat, requestLon, requestDateTime, dataControlerOutput)
+        return self.roam.CalcIonoState(requestLat, requestLon, requestDateTime, dataControlerOutput)
+
+    ## ROAM.CalcIonoStateBatch in the worker processes if there are any, else in this process
+    #
+    def calcIonoStateBatch(self, requestLats, requestLons, requestDateTime, dataControlerOutput):
+        if self.workerPool:
+            return self.workerPool.CalcIonoStateBatch(requestLats, requestLons, requestDateTime, dataControlerOutput)
+        return self.roam.CalcIonoStateBatch(requestLats, requestLons, requestDateTime, dataControlerOutput)
+
+    ## Return the ionostate of several background models for the location and time specified in the request
+    #
+    #  The data is fetched once for all the models and they share their IRI and IRTAM evaluations,
+    #  see ROAM.CalcIonoStateEnsemble. The branches of the ensemble run in the worker processes if
+    #  there are any. A model is left out when the DataController is not configured with the
+    #  sources it needs or when its files are missing.
+    #
+    #  @param models - list of models, None for ROAM.ensembleModels
+    #
+    #  @retval dictionary backgroundModel -> ionoState
+    #
+    def queryIonoStateEnsemble(self, requestLat, requestLon, requestDateTime, models=None):
+        self.waitReady(['roam', 'dataController', 'workerPool'])
+        dataControlerOutput = self.dataController.process(requestDateTime)
+        submitFcn = self.workerPool.SubmitEnsembleBranch if self.workerPool else None
+        ionoStates = self.roam.CalcIonoStateEnsemble([requestLat], [requestLon], requestDateTime,
+                                                     dataControlerOutput, models, submitFcn)
+        return {backgroundModel: states[0] for backgroundModel, states in ionoStates.items()}
+
+    ## Compute the ionoStates of the lattice points for an epoch, the computeFcn of the lattice
+    #
+    #  @param lats  - array of latitudes of the lattice points (degrees)
+    #  @param lons  - array of longitudes of the lattice points (degrees)
+    #  @param epoch - python datetime of the epoch
+    #
+    #  @retval (ionoStates, version, backgroundModel) - see Framework.IonoLattice
+    #
+    def computeLattice(self, lats, lons, epoch):
+        self.waitReady(self.requiredSubsystems())
+        dataControlerOutput = []
+        if not 'iri' in self.config.roamConfig.backgroundModel:
+            dataControlerOutput = self.dataController.process(epoch)
+        ionoStates = self.calcIonoStateBatch(lats, lons, epoch, dataControlerOutput)
+        return (ionoStates, dataVersion(dataControlerOutput), self.roam.SelectInputFiles(dataControlerOutput)[0])
+
+    ## Version of the data of an epoch, the versionFcn of the lattice
+    #
+    def latticeVersion(self, epoch):
+        self.waitReady(self.requiredSubsystems())
+        if 'iri' in self.config.roamConfig.backgroundModel:
+            return dataVersion([])
+        return dataVersion(self.dataController.process(epoch))
+
+    ## Return the ionostates for many locations and times at once
+    #
+    #  Requests are grouped by time so that the data check and the RIPE/IRTAM inputs are
+    #  only processed once per epoch, then every location of the epoch is evaluated together.
+    #  With the cache configured only the cells not in the cache are evaluated.
+    #
+    #  @param requestLats      - array of latitudes (degrees)
+    #  @param requestLons      - array of longitudes (degrees)
+    #  @param requestDateTimes - list of python datetime, or a single datetime used for all locations
+    #
+    #  @retval ionoStates - (N, 11) array in the same layout as queryIonoState
+    #
+    def queryIonoStateBatch(self, requestLats, requestLons, requestDateTimes):
+        requestLats = numpy.atleast_1d(numpy.asarray(requestLats, dtype=float))
+        requestLons = numpy.atleast_1d(numpy.asarray(requestLons, dtype=float))
+        if isinstance(requestDateTimes, datetime):
+            requestDateTimes = [requestDateTimes] * len(requestLats)
+        if not (len(requestLats) == len(requestLons) == len(requestDateTimes)):
+            raise ValueError('queryIonoStateBatch needs as many latitudes, longitudes and datetimes')
+
+        self.waitReady(self.requiredSubsystems())
+
+        # Indices of the requests for each epoch, in the order the epochs first appear
+        epochs = {}
+        for n, requestDateTime in enumerate(requestDateTimes):
+            if self.cache is not None:
+                requestDateTime = snapDateTime(requestDateTime, self.config.cacheConfig.timeStep)
+            epochs.setdefault(requestDateTime, []).append(n)
+
+        reply = numpy.zeros((len(requestLats), 11))
+        for requestDateTime, indices in epochs.items():
+            # Same data check as queryIonoState, once for the whole epoch
+            dataControlerOutput = []
+            if not 'iri' in self.config.roamConfig.backgroundModel:
+                dataControlerOutput = self.dataController.process(requestDateTime)
+            if self.cache is None:
+                reply[indices] = self.calcIonoStateBatch(requestLats[indices], requestLons[indices],
+                                                         requestDateTime, dataControlerOutput)
+                logger.debug('{:d} ionoStates for {}'.format(len(indices), requestDateTime))
+                continue
+            # Requests of the epoch whose cell is not in the cache, grouped by cell
+            version = self.recordDataVersion(requestDateTime, dataControlerOutput)
+            missing = {}
+            for n in indices:
+                (cellKey, lat, lon, dt) = self.quantizeRequest(requestLats[n], requestLons[n], requestDateTime)
+                key = cellKey + (version,)
+                cached = self.cache.get(key)
+                if cached is None:
+                    missing.setdefault(key, (lat, lon, cellKey, []))[3].append(n)
+                else:
+                    reply[n] = cached[0]
+            if missing:
+                cells = list(missing.values())
+                states = self.calcIonoStateBatch([cell[0] for cell in cells], [cell[1] for cell in cells],
+                                                 requestDateTime, dataControlerOutput)
+                backgroundModel = self.roam.SelectInputFiles(dataControlerOutput)[0]
+                for key, cell, state in zip(missing.keys(), cells, states):
+                    self.cache.put(key, (state.copy(), backgroundModel))
+                    self.latestCache.put(cell[2], (state.copy(), backgroundModel))
+                    reply[cell[3]] = state
+            logger.debug('{:d} ionoStates for {}, {:d} computed'.format(len(indices), requestDateTime, len(missing)))
+        return reply
+
+    ## Return the ionostates at the control points of many transmitter to receiver paths at once
+    #
+    #  The control points of every path are computed together, see Geodesy.greatCircleControlPoints,
+    #  and all of them are evaluated by one queryIonoStateBatch call.
+    #
+    #  @param txLats           - array of latitudes of the transmitters (degrees)
+    #  @param txLons           - array of longitudes of the transmitters (degrees)
+    #  @param rxLats           - array of latitudes of the receivers (degrees)
+    #  @param rxLons           - array of longitudes of the receivers (degrees)
+    #  @param requestDateTimes - list of python datetime, or a single datetime used for all paths
+    #  @param fractions        - fractions of the path lengths where the control points are, default the midpoints
+    #
+    #  @retval (ionoStates, controlPoints) - (N, F, 11) array in the same layout as queryIonoState and
+    #                                        (N, F, 2) array of the [lat, lon] of the control points (degrees)
+    #
+    def queryIonoStatePaths(self, txLats, txLons, rxLats, rxLons, requestDateTimes, fractions=(0.5,)):
+        latLonTx = numpy.vstack((numpy.atleast_1d(txLats), numpy.atleast_1d(txLons))).astype(float) * numpy.pi / 180
+        latLonRx = numpy.vstack((numpy.atleast_1d(rxLats), numpy.atleast_1d(rxLons))).astype(float) * numpy.pi / 180
+        if latLonTx.shape != latLonRx.shape:
+            raise ValueError('queryIonoStatePaths needs as many transmitters and receivers')
+        numPaths = latLonTx.shape[1]
+        if not isinstance(requestDateTimes, datetime) and len(requestDateTimes) != numPaths:
+            raise ValueError('queryIonoStatePaths needs as many datetimes as paths')
+
+        # (N, F, 2) [lat, lon] of the control points
+        controlPoints = numpy.moveaxis(greatCircleControlPoints(latLonTx, latLonRx, fractions), 0, -1) * 180 / numpy.pi
+        numPoints = controlPoints.shape[1]
+        if not isinstance(requestDateTimes, datetime):
+            requestDateTimes = [dt for dt in requestDateTimes for n in range(numPoints)]
+
+        reply = self.queryIonoStateBatch(controlPoints[:, :, 0].ravel(), controlPoints[:, :, 1].ravel(), requestDateTimes)
+        logger.debug('ionoStates of {:d} paths at {:d} control points each'.format(numPaths, numPoints))
+        return (reply.reshape(numPaths, numPoints, -1), controlPoints)
+
+    ## Snap a request to the cache steps
+    #
+    #  @param requestLat      - latitude (degrees)
+    #  @param requestLon      - longitude (degrees)
+    #  @param requestDateTime - python datetime
+    #
+    #  @retval (cellKey, lat, lon, dateTime) - the key of the cell and the request snapped to the cache steps
+    #
+    def quantizeRequest(self, requestLat, requestLon, requestDateTime):
+        cacheConfig = self.config.cacheConfig
+        (latIndex, lat) = quantize(requestLat, cacheConfig.latStep)
+        (lonIndex, lon) = quantize(requestLon, cacheConfig.lonStep)
+        dateTime = snapDateTime(requestDateTime, cacheConfig.timeStep)
+        cellKey = (latIndex, lonIndex, dateTime, str(self.config.roamConfig.backgroundModel))
+        return (cellKey, lat, lon, dateTime)
+
+    ## Counters of the ionoState cache
+    #
+    #  @retval dictionary with hits, misses, evictions, expirations and size, None without cache
+    #
+    def cacheStatistics(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    ## Per stage timings of the last requests answered by queryIonoState
+    #
+    #  Each breakdown only holds the stages run by the thread answering the request: a request
+    #  answered with the result of an identical request in flight only shows the 'query' stage,
+    #  and the stages run by the worker processes are not recorded.
+    #
+    #  @retval list of dictionaries with lat, lon, time and stages, the most recent last.
+    #          stages maps the stage name to {'calls': n, 'seconds': total}, see Shared.Utils.Timing
+    #
+    def timingBreakdowns(self):
+        return list(self.breakdowns)
+
+    ## Statistics of the recent durations of every stage
+    #
+    #  @retval dictionary stage -> dictionary with count, mean, p50, p95 and max in seconds
+    #
+    def timingSummary(self):
+        return Timing.timings.summary()
+
+    ## Histograms of the recent durations of every stage
+    #
+    #  @retval dictionary stage -> (edges, counts), the edges are in seconds
+    #
+    def timingHistograms(self):
+        return {stage: Timing.timings.histogram(stage) for stage in Timing.timings.stages()}
+
+    ## Stop the serving loop started by run(). Requests already queued are still answered
+    #
     def shutdown(self):
-        self.running = False    
+        self.running = False
+
+    ## Release the worker processes and stop the background data staging,
+    #  the Manager cannot answer requests afterwards
+    #
+    def close(self):
+        # Let the warm up finish so that nothing is started behind our back
+        self.warmUpThread.join()
+        # Computations left behind by degraded requests are not waited for
+        self.deadlineExecutor.shutdown(wait=False)
+        if self.lattice:
+            self.lattice.shutdown()
+        if self.assimilation:
+            self.assimilation.shutdown()
+        if self.dataController:
+            self.dataController.shutdown()
+        if self.workerPool:
+            self.workerPool.shutdown()
+            self.workerPool = None
 
-    ## Run loop DO NOT CALL THIS
+    ## Run loop DO NOT CALL THIS from a thread that needs to do anything else.
+    #  Serves queryIonoState over a local socket until shutdown() is called.
     #
     def run(self):
-        # Keep running forever
-        while self.running:
-            # Wait for the zmq message blocking call
-            xmlIonoRequest = self.comms.recv()
-            # Need to implement this
-            request = xmlToIonoRequest(xmlIonoRequest)
-            # Process the request
-            reply = queryIonoState(request)
-            # Need to implement this
-            xmlIonoReply = xmlToIonoReply(reply)
-            # Respond via comms channel
-            self.comms.send(reply)
+        serverConfig = getattr(self.config, 'serverConfig', None)
+        if not serverConfig:
+            serverConfig = ConfigValues.ServerConfig()
+        # Respond via comms channel, telling the client which model answered
+        queryFcn = lambda lat, lon, requestDateTime: self.queryIonoStateTagged(lat, lon, requestDateTime, serverConfig.queryBudget)
+        self.ionoChannel = IonoServer(serverConfig, queryFcn)
+        self.ionoChannel.start()
+        # Keep running until we are told to stop
+        try:
+            while self.running:
+                time.sleep(0.5)
+        finally:
+            self.ionoChannel.shutdown()
+            self.ionoChannel = None
 
 class UnitTest_Manager(unittest.TestCase):
 
@@ -148,7 +695,254 @@ class UnitTest_Manager(unittest.TestCase):
         managerConfig.dataControllerConfig.sources = ['noaa','giro']
         managerConfig.roamConfig.backgroundModel = ['ripe-irtam']
         manager = Manager(managerConfig)
-        manager.queryIonoState(37.2321, 256.2323, datetime(2015, 10, 20)) 
+        manager.queryIonoState(37.2321, 256.2323, datetime(2015, 10, 20))
+
+    def testReadiness(self):
+        logger.info("testReadiness")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        managerConfig.roamConfig.backgroundModel = 'iri'
+        manager = Manager(managerConfig)
+        self.assertTrue(manager.waitReady(['roam'], timeout=60))
+        self.assertTrue(manager.waitReady(timeout=60))
+        self.assertEqual(manager.readiness(), {subsystem: True for subsystem in managerSubsystems})
+        manager.queryIonoState(37.2321, 256.2323, datetime(2015, 10, 20))
+        manager.close()
+
+    def testTiming(self):
+        logger.info("testTiming")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        managerConfig.roamConfig.backgroundModel = 'iri'
+        manager = Manager(managerConfig)
+        try:
+            manager.queryIonoState(37.2321, 256.2323, datetime(2015, 10, 20))
+            stages = manager.timingBreakdowns()[-1]['stages']
+            # The centre and the 4 nodes of the tilt stencil
+            self.assertEqual(stages['iri']['calls'], 5)
+            self.assertEqual(stages['roam']['calls'], 1)
+            self.assertIn('query', manager.timingSummary())
+            (edges, counts) = manager.timingHistograms()['iri']
+            self.assertGreaterEqual(counts.sum(), 5)
+            # With a budget the stages run by the deadline threads are part of the breakdown too
+            manager.queryIonoState(38.2321, 256.2323, datetime(2015, 10, 20), budget=60)
+            stages = manager.timingBreakdowns()[-1]['stages']
+            self.assertEqual(stages['iri']['calls'], 5)
+            self.assertEqual(stages['roam']['calls'], 1)
+        finally:
+            manager.close()
+
+    def testDeadline(self):
+        logger.info("testDeadline")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        # Tell the datacontroller to use noaa and roam to use ripe
+        managerConfig.dataControllerConfig.sources = ['noaa']
+        managerConfig.roamConfig.backgroundModel = 'ripe'
+        managerConfig.cacheConfig = ConfigValues.CacheConfig()
+        manager = Manager(managerConfig)
+        manager.waitReady()
+        # No time for the NOAA data, IRI answers
+        (state, model) = manager.queryIonoStateTagged(37.2321, 256.2323, datetime(2015, 10, 20), budget=0.001)
+        self.assertEqual(model, 'iri')
+        (cellKey, lat, lon, dt) = manager.quantizeRequest(37.2321, 256.2323, datetime(2015, 10, 20))
+        iri = manager.fallbackRoams['iri'].CalcIonoState(lat, lon, dt, {})
+        numpy.testing.assert_allclose(state, iri)
+        # Without a budget the configured model answers, and the state of the cell is cached
+        (state, model) = manager.queryIonoStateTagged(37.2321, 256.2323, datetime(2015, 10, 20))
+        self.assertEqual(model, 'ripe')
+        (cached, model) = manager.queryIonoStateTagged(37.2321, 256.2323, datetime(2015, 10, 20), budget=0.001)
+        self.assertIn(model, ['ripe', 'cache:ripe'])
+        numpy.testing.assert_array_equal(cached, state)
+        manager.close()
+
+    def testDegraded(self):
+        logger.info("testDegraded")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        managerConfig.roamConfig.backgroundModel = 'iri'
+        managerConfig.cacheConfig = ConfigValues.CacheConfig()
+        manager = Manager(managerConfig)
+        try:
+            manager.waitReady()
+            # Done within the budget, the fallback is not computed
+            with unittest.mock.patch.object(Manager, 'degradedIonoState') as degraded:
+                (state, model) = manager.queryIonoStateTagged(37.2321, 256.2323, datetime(2015, 10, 20), budget=60)
+            self.assertEqual(model, 'iri')
+            degraded.assert_not_called()
+            # Past the budget the last state of the cell answers without the fallback either
+            with unittest.mock.patch.object(Manager, 'computeIonoState', side_effect=lambda *args: time.sleep(1)), \
+                 unittest.mock.patch.object(Manager, 'degradedIonoState') as degraded:
+                (latest, model) = manager.queryIonoStateTagged(37.2321, 256.2323, datetime(2015, 10, 20), budget=0.01)
+            self.assertEqual(model, 'cache:iri')
+            numpy.testing.assert_array_equal(latest, state)
+            degraded.assert_not_called()
+        finally:
+            manager.close()
+
+    def testCacheDataChange(self):
+        import tempfile
+        logger.info("testCacheDataChange")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        managerConfig.dataControllerConfig.sources = ['noaa']
+        managerConfig.roamConfig.backgroundModel = ['ripe']
+        managerConfig.cacheConfig = ConfigValues.CacheConfig()
+        testFiles = os.path.dirname(os.path.realpath(__file__)) + '/../IonoModelEngine/RIPE/TestFiles/'
+        with tempfile.TemporaryDirectory() as directory:
+            fname = os.path.join(directory, 'AU930_NOAA.TXT')
+            shutil.copyfile(testFiles + 'AU930_NOAA.TXT', fname)
+            manager = Manager(managerConfig)
+            clock = [0.0]
+            manager.dataVersions.clock = lambda: clock[0]
+            try:
+                dt = datetime(2015, 10, 20)
+                with unittest.mock.patch.object(DataController, 'process', return_value={'noaa': [fname], 'giro': []}):
+                    first = manager.queryIonoState(37.2321, 256.2323, dt)
+                    # New data for the epoch, not seen while its version is trusted
+                    shutil.copyfile(testFiles + 'BC840_NOAA.TXT', fname)
+                    numpy.testing.assert_array_equal(manager.queryIonoState(37.2321, 256.2323, dt), first)
+                    # Seen once the version is checked again
+                    clock[0] += managerConfig.cacheConfig.versionTtl + 1
+                    manager.queryIonoState(37.2321, 256.2323, dt)
+                statistics = manager.cacheStatistics()
+                self.assertEqual(statistics['hits'], 1)
+                self.assertEqual(statistics['misses'], 2)
+            finally:
+                manager.close()
+
+    def testLattice(self):
+        logger.info("testLattice")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        managerConfig.roamConfig.backgroundModel = 'iri'
+        managerConfig.latticeConfig = ConfigValues.LatticeConfig()
+        managerConfig.latticeConfig.latMin = 35.0
+        managerConfig.latticeConfig.latMax = 40.0
+        managerConfig.latticeConfig.lonMin = 254.0
+        managerConfig.latticeConfig.lonMax = 258.0
+        manager = Manager(managerConfig)
+        manager.waitReady()
+        dt = datetime(2015, 10, 20)
+        # The epoch is not built yet, roam answers and the build is scheduled
+        (state, model) = manager.queryIonoStateTagged(37.0, 256.0, dt)
+        self.assertEqual(model, 'iri')
+        manager.lattice.builder.submit(lambda: None).result()
+        # On a lattice point of an epoch the lattice holds the state roam computed there
+        (latticeState, model) = manager.queryIonoStateTagged(37.0, 256.0, dt)
+        self.assertEqual(model, 'lattice:iri')
+        numpy.testing.assert_allclose(latticeState, state, rtol=1e-10)
+        # Outside of the lattice roam answers
+        (state, model) = manager.queryIonoStateTagged(32.4824, -106.3809, dt)
+        self.assertEqual(model, 'iri')
+        manager.close()
+
+    def testAssimilation(self):
+        import tempfile
+        from Framework.AssimilationDaemon import archivePath
+        logger.info("testAssimilation")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        managerConfig.roamConfig.backgroundModel = 'iri'
+        with tempfile.TemporaryDirectory() as directory:
+            managerConfig.assimilationConfig = ConfigValues.AssimilationConfig()
+            managerConfig.assimilationConfig.archiveDirectory = directory
+            manager = Manager(managerConfig)
+            manager.waitReady()
+            self.assertTrue(manager.waitReady(['assimilation'], timeout=60))
+            # Publish an epoch, then look it up like a consumer does
+            dt = datetime(2015, 10, 20, 1, 5)
+            manager.assimilation.shutdown()
+            states = manager.assimilation.assimilate(dt)
+            (lat, lon) = managerConfig.assimilationConfig.sites[0]
+            (ionoStateJIGSE, lonLatRad, success) = manager.roam.queryROAM([2015, 10, 20, 1, 5],
+                                                                          archivePath(directory, lat, lon, dt))
+            # foF2 (MHz) and hmF2 (km) to the 4 decimals of the archive
+            self.assertTrue(success)
+            self.assertAlmostEqual(ionoStateJIGSE[2], states[0][0] * 1.e6, delta=50)
+            self.assertAlmostEqual(ionoStateJIGSE[3], states[0][1] * 1000, delta=0.05)
+            manager.close()
+
+    def testEnsemble(self):
+        logger.info("testEnsemble")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        # Fetch the data of every model, roam uses ripe
+        managerConfig.dataControllerConfig.sources = ['noaa', 'giro']
+        managerConfig.roamConfig.backgroundModel = 'ripe'
+        manager = Manager(managerConfig)
+        dt = datetime(2015, 10, 20)
+        ensemble = manager.queryIonoStateEnsemble(37.2321, 256.2323, dt)
+        numpy.testing.assert_allclose(ensemble['iri'], manager.fallbackRoams['iri'].CalcIonoState(37.2321, 256.2323, dt, {}))
+        if 'ripe' in ensemble:
+            numpy.testing.assert_allclose(ensemble['ripe'],
+                                          manager.roam.CalcIonoState(37.2321, 256.2323, dt, manager.dataController.process(dt)))
+        manager.close()
+
+    def testBatch(self):
+        logger.info("testBatch")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        # Tell the datacontroller to use noaa and roam to use ripe
+        managerConfig.dataControllerConfig.sources = ['noaa']
+        managerConfig.roamConfig.backgroundModel = ['ripe']
+        manager = Manager(managerConfig)
+        try:
+            lats = [37.2321, 40.0, 37.2321]
+            lons = [256.2323, 254.7, 256.2323]
+            times = [datetime(2015, 10, 20), datetime(2015, 10, 20), datetime(2015, 10, 20, 1)]
+            reply = manager.queryIonoStateBatch(lats, lons, times)
+            self.assertEqual(reply.shape, (3, 11))
+            for n in range(0, len(lats)):
+                numpy.testing.assert_allclose(reply[n], manager.queryIonoState(lats[n], lons[n], times[n]))
+        finally:
+            manager.close()
+
+    def testPaths(self):
+        logger.info("testPaths")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        # Tell the datacontroller to use noaa and roam to use ripe
+        managerConfig.dataControllerConfig.sources = ['noaa']
+        managerConfig.roamConfig.backgroundModel = ['ripe']
+        manager = Manager(managerConfig)
+        try:
+            txLats = [37.2321, 40.0]
+            txLons = [256.2323, 254.7]
+            rxLats = [40.0, 45.07]
+            rxLons = [254.7, 276.44]
+            times = [datetime(2015, 10, 20), datetime(2015, 10, 20, 1)]
+            (reply, controlPoints) = manager.queryIonoStatePaths(txLats, txLons, rxLats, rxLons, times, [0.25, 0.5])
+            self.assertEqual(reply.shape, (2, 2, 11))
+            self.assertEqual(controlPoints.shape, (2, 2, 2))
+            for n in range(0, len(txLats)):
+                for m in range(0, 2):
+                    numpy.testing.assert_allclose(reply[n, m], manager.queryIonoState(controlPoints[n, m, 0],
+                                                                                      controlPoints[n, m, 1], times[n]))
+        finally:
+            manager.close()
+
+    def testCache(self):
+        logger.info("testCache")
+        # Top level manager config
+        managerConfig = ConfigValues.TICSConfig()
+        # Tell the datacontroller to use noaa and roam to use ripe
+        managerConfig.dataControllerConfig.sources = ['noaa']
+        managerConfig.roamConfig.backgroundModel = ['ripe']
+        managerConfig.cacheConfig = ConfigValues.CacheConfig()
+        manager = Manager(managerConfig)
+        try:
+            first = manager.queryIonoState(37.2321, 256.2323, datetime(2015, 10, 20))
+            # Same cell, same minute, answered without checking the data again
+            with unittest.mock.patch.object(DataController, 'process') as process:
+                second = manager.queryIonoState(37.2400, 256.2300, datetime(2015, 10, 20, 0, 0, 20))
+            numpy.testing.assert_array_equal(first, second)
+            process.assert_not_called()
+            statistics = manager.cacheStatistics()
+            self.assertEqual(statistics['hits'], 1)
+            self.assertEqual(statistics['misses'], 1)
+        finally:
+            manager.close()
 
 if __name__ == '__main__':
     logger.setLevel('DEBUG')
@@ -19,49 +19,196 @@
 # MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
 
 import os
-from datetime import datetime
+import unittest
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from Framework.Manager import Manager
 import Shared.Utils.HfgeoLogger as Logger
 from IonoModelEngine.Config.KentIsland_test_20180320 import *
+from IonoModelEngine.ROAM.IonoStateArchive import ionoStateHeader, ionoStateRowFormat, ionoStateRow, \
+    ArchiveWriter
 
 logger = Logger.getLogger()
 
 ## @package IonoModelEngine.QueryIono
 #  Module That run TICS Manager. Can be used to generate IonoState Files
 
+## Format one row of an ionoState file
+#
+#  @retval row - string terminated by a newline, see IonoStateArchive.ionoStateRow for the parameters
+#
+def formatIonoState(replyState, date, lat, lon):
+    return ionoStateRowFormat % tuple(ionoStateRow(replyState, date, lat, lon)) + "\n"
+
+## Buffered writer of ionoState files, the file is opened once for all the rows
+#
+class IonoStateWriter:
+
+    ## Constructor, opens the file for appending and writes the header if the file is new
+    #
+    #  @param ionoStateFileName - the output file
+    #  @param bufferSize        - size in bytes of the write buffer
+    #
+    def __init__(self, ionoStateFileName, bufferSize=1024*1024):
+        newFile = not os.path.exists(ionoStateFileName)
+        self.outFile = open(ionoStateFileName, 'a', buffering=bufferSize)
+        if newFile:
+            self.outFile.write(ionoStateHeader)
+
+    ## Append one row
+    #
+    def write(self, replyState, date, lat, lon):
+        self.outFile.write(formatIonoState(replyState, date, lat, lon))
+
+    ## Flush the buffer and close the file
+    #
+    def close(self):
+        self.outFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+## Buffered writer of binary ionoState archives, see IonoModelEngine.ROAM.IonoStateArchive
+#
+#  Same interface as IonoStateWriter, the rows are appended as fixed size records.
+#
+class IonoStateArchiveWriter:
+
+    ## Constructor, opens the archive for appending and writes the header if the archive is new
+    #
+    #  @param ionoStateFileName - the output archive
+    #  @param bufferSize        - size in bytes of the write buffer
+    #
+    def __init__(self, ionoStateFileName, bufferSize=1024*1024):
+        self.archive = ArchiveWriter(ionoStateFileName, bufferSize)
+
+    ## Append one row
+    #
+    def write(self, replyState, date, lat, lon):
+        self.archive.writeRows(ionoStateRow(replyState, date, lat, lon))
+
+    ## Flush the buffer and close the archive
+    #
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 def saveIonoState(replyState, ionoStateFileName, date, lat, lon):
-    if not os.path.exists(ionoStateFileName):
-       with open(ionoStateFileName, 'w') as outFile:				
-         outFile.write("YEAR MON DAY  HR MIN       foF2      hmF2      foF1       foE        " + \
-                     "B0        B1   gradLat   gradLon         a         C    lambda     gamma     "  + \
-                     "omega       psi       Vh       Vaz   Ref_lat   Ref_lon    AoAErr\n")
+    with IonoStateWriter(ionoStateFileName) as writer:
+        writer.write(replyState, date, lat, lon)
+
+## Query the ionoStates of several sites over a time range and stream them to a writer
+#
+#  The epochs are queried in parallel by numWorkers threads, each epoch with one
+#  Manager.queryIonoStateBatch call for all the sites. Rows are written as soon as the
+#  epochs are done, in time order and in the order of the sites within an epoch.
+#
+#  @param manager   - the Manager answering the queries
+#  @param sites     - list of (lat, lon) in degrees
+#  @param startTime - python datetime of the first epoch
+#  @param endTime   - python datetime of the last epoch, included
+#  @param step      - python timedelta between the epochs
+#  @param writer    - IonoStateWriter, or any object with the same write method
+#  @param numWorkers - number of epochs queried at the same time
+#
+#  @retval numRows - number of rows written
+#
+def queryIonoStateSeries(manager, sites, startTime, endTime, step, writer, numWorkers=4):
+    lats = [site[0] for site in sites]
+    lons = [site[1] for site in sites]
+    numRows = 0
 
-    with open(ionoStateFileName, 'a') as outFile:				
-         outFile.write("{0:04d}  {1:02d}  {2:02d}  {3:02d}  {4:02d} ".format(date.year, date.month, date.day, date.hour, date.minute))
-         for n in range (0,11):
-             if n == 4 or n == 7 or n == 8:
-                continue
-             outFile.write("{:10.4f}".format(replyState[n]))
+    # Write the oldest epoch once it is done
+    def writeEpoch(epoch, future):
+        states = future.result()
+        for n in range(0, len(sites)):
+            writer.write(states[n], epoch, lats[n], lons[n])
+        logger.debug('ionoStates written for {}'.format(epoch))
+        return len(sites)
 
-         for n in range (0,8):
-             outFile.write("{:10.4f}".format(0))
+    with ThreadPoolExecutor(max_workers=numWorkers) as executor:
+        # Epochs submitted but not written yet, bounded so that a long range does not queue everything
+        pending = deque()
+        epoch = startTime
+        while epoch <= endTime:
+            pending.append((epoch, executor.submit(manager.queryIonoStateBatch, lats, lons, epoch)))
+            if len(pending) >= 2*numWorkers:
+                numRows += writeEpoch(*pending.popleft())
+            epoch += step
+        while pending:
+            numRows += writeEpoch(*pending.popleft())
 
-         outFile.write("{:10.4f}{:10.4f}{:10.4f}\n".format(lat, lon, 0))
+    return numRows
 
 def run():
     # Generate the top level config
     ticsConfig = TICSConfig()
     manager = Manager(ticsConfig) 
 
-    for total_minute in range(810,875,5):
-        hour = int(total_minute / 60)
-        minute =  total_minute - hour * 60
-#        replyState = manager.queryIonoState(40.333, 286.550, datetime(2018, 2, 28, hour, minute))
-#        saveIonoState(replyState, "testIonoState_0310.txt", datetime(2018, 2, 28, hour, minute), 40.333, 286.550)
+#    sites = [(40.333, 286.550)]
+#    startTime = datetime(2018, 2, 28, 13, 30)
 # 40.0, 254.7 - Boulder; 45.07, 276.440 - Alpena
-        replyState = manager.queryIonoState(40.0, 254.7, datetime(2018, 1, 28, hour, minute))
-        saveIonoState(replyState, "testIonoState_0312.txt", datetime(2018, 1, 28, hour, minute), 40.0, 254.7)
-        logger.debug(replyState) 
+    sites = [(40.0, 254.7)]
+    startTime = datetime(2018, 1, 28, 13, 30)
+    endTime = datetime(2018, 1, 28, 14, 30)
+
+    with IonoStateWriter("testIonoState_0312.txt") as writer:
+        queryIonoStateSeries(manager, sites, startTime, endTime, timedelta(minutes=5), writer)
+
+class UnitTest_QueryIono(unittest.TestCase):
+
+    ## Stands in for the Manager, the state tells which site and epoch it is for
+    class EchoManager:
+        def queryIonoStateBatch(self, lats, lons, epoch):
+            return [[lat, lon, epoch.hour, epoch.minute, 0, 0, 0, 0, 0, 0, 0] for lat, lon in zip(lats, lons)]
+
+    def test_series(self):
+        import tempfile
+        sites = [(40.0, 254.7), (45.07, 276.44)]
+        startTime = datetime(2018, 1, 28, 13, 30)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            seriesFileName = os.path.join(tmpDir, 'series.txt')
+            savedFileName = os.path.join(tmpDir, 'saved.txt')
+            with IonoStateWriter(seriesFileName) as writer:
+                numRows = queryIonoStateSeries(self.EchoManager(), sites, startTime, startTime + timedelta(hours=1),
+                                               timedelta(minutes=5), writer, numWorkers=3)
+            self.assertEqual(numRows, 26)
+            # Same content as writing the rows one at a time
+            for n in range(0, 13):
+                epoch = startTime + n*timedelta(minutes=5)
+                for lat, lon in sites:
+                    saveIonoState([lat, lon, epoch.hour, epoch.minute, 0, 0, 0, 0, 0, 0, 0], savedFileName, epoch, lat, lon)
+            with open(seriesFileName) as series, open(savedFileName) as saved:
+                self.assertEqual(series.read(), saved.read())
+
+    def test_archive(self):
+        import tempfile
+        import numpy
+        from numpy.testing import assert_array_equal
+        from IonoModelEngine.ROAM.IonoStateArchive import readArchive, archiveToText
+        sites = [(40.0, 254.7), (45.07, 276.44)]
+        startTime = datetime(2018, 1, 28, 13, 30)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            textFileName = os.path.join(tmpDir, 'series.txt')
+            archiveFileName = os.path.join(tmpDir, 'series.arc')
+            convertedFileName = os.path.join(tmpDir, 'converted.txt')
+            for writerClass, fileName in [(IonoStateWriter, textFileName), (IonoStateArchiveWriter, archiveFileName)]:
+                with writerClass(fileName) as writer:
+                    queryIonoStateSeries(self.EchoManager(), sites, startTime, startTime + timedelta(hours=1),
+                                         timedelta(minutes=5), writer, numWorkers=3)
+            assert_array_equal(readArchive(archiveFileName), numpy.loadtxt(textFileName, skiprows=1))
+            archiveToText(archiveFileName, convertedFileName)
+            with open(textFileName) as text, open(convertedFileName) as converted:
+                self.assertEqual(converted.read(), text.read())
 
 if __name__ == "__main__":
     logger.setLevel('DEBUG')
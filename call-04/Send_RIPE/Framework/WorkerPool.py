@@ -0,0 +1,178 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import math
+import multiprocessing
+import unittest
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import Shared.Utils.HfgeoLogger as Logger
+from Shared.IonoPyIface.Pharlap import Pharlap
+from IonoModelEngine.IRTAM.IrtamPyIface import IrtamPyIface
+from IonoModelEngine.ROAM.ROAM import ROAM
+
+logger = Logger.getLogger()
+
+## @package Framework.WorkerPool
+#  Pool of worker processes evaluating ROAM for the Manager.
+#
+#  Every IRI call goes through the ig_rz_mutex of PharlapPytoCIface, so threads of one process
+#  cannot evaluate IRI in parallel. Each worker process owns its own Pharlap and IRTAM handles
+#  and its own ROAM, so the workers run IRI in parallel. The Manager keeps the DataController:
+#  the downloads and translations write into the shared local stores and stay in one process.
+
+## The ROAM of this worker process, built by initWorker
+workerRoam = None
+
+## Build the handles and the ROAM of a worker process
+#
+#  @param roamConfig - ROAMConfig() - defined in ConfigDef.py
+#
+def initWorker(roamConfig):
+    global workerRoam
+    workerRoam = ROAM(roamConfig, IrtamPyIface(), Pharlap())
+
+## True once initWorker ran in this worker process
+#
+def workerReady():
+    return workerRoam is not None
+
+## ROAM.CalcIonoState in a worker process
+#
+def workerCalcIonoState(lat, lon, DT, listOfFiles):
+    return workerRoam.CalcIonoState(lat, lon, DT, listOfFiles)
+
+## ROAM.CalcIonoStateBatch in a worker process
+#
+def workerCalcIonoStateBatch(lats, lons, DT, listOfFiles):
+    return workerRoam.CalcIonoStateBatch(lats, lons, DT, listOfFiles)
+
+## ROAM.CalcEnsembleBranch in a worker process
+def workerCalcEnsembleBranch(branch, lats, lons, DT, listOfFiles):
+    return workerRoam.CalcEnsembleBranch(branch, lats, lons, DT, listOfFiles)
+
+## ROAM.CalcColumnProfiles in a worker process
+def workerCalcColumnProfiles(lats, lons, ionoStates, DT, iono_grid_parms, SporadicE):
+    return workerRoam.CalcColumnProfiles(lats, lons, ionoStates, DT, iono_grid_parms, SporadicE)
+
+## The pool of worker processes
+#
+class WorkerPool:
+
+    ## Constructor, starts the worker processes
+    #
+    #  @param config     - WorkerPoolConfig() - defined in ConfigDef.py
+    #  @param roamConfig - ROAMConfig() - the configuration of the ROAM of every worker
+    #
+    def __init__(self, config, roamConfig):
+        self.config = config
+        # Start fresh interpreters rather than forking the handles of the Manager
+        context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=self.config.numProcesses,
+                                            mp_context=context,
+                                            initializer=initWorker,
+                                            initargs=(roamConfig,))
+        logger.info('WorkerPool started with {:d} processes'.format(self.config.numProcesses))
+
+    ## Start every worker process and wait until its handles are loaded
+    #
+    #  The executor only spawns a process when a request finds no idle one, so one request
+    #  per process is submitted at once.
+    #
+    #  @retval True if every worker is ready
+    #
+    def warmUp(self):
+        futures = [self.executor.submit(workerReady) for n in range(0, self.config.numProcesses)]
+        return all(future.result() for future in futures)
+
+    ## Same as ROAM.CalcIonoState, evaluated by one of the workers
+    #
+    def CalcIonoState(self, lat, lon, DT, listOfFiles):
+        return self.executor.submit(workerCalcIonoState, lat, lon, DT, listOfFiles).result()
+
+    ## Same as ROAM.CalcIonoStateBatch, the locations are split in chunks evaluated by the workers
+    #
+    #  Every chunk parses the RIPE/IRTAM inputs again, so a chunk holds at least chunkSize locations.
+    #
+    def CalcIonoStateBatch(self, lats, lons, DT, listOfFiles):
+        lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))
+        numChunks = max(1, min(self.config.numProcesses, math.ceil(len(lats) / self.config.chunkSize)))
+        futures = []
+        for chunk in numpy.array_split(numpy.arange(len(lats)), numChunks):
+            futures.append(self.executor.submit(workerCalcIonoStateBatch, lats[chunk], lons[chunk], DT, listOfFiles))
+        return numpy.vstack([future.result() for future in futures])
+
+    ## Start ROAM.CalcEnsembleBranch in one of the workers, the submitFcn of ROAM.CalcIonoStateEnsemble
+    #
+    #  @retval concurrent.futures.Future of the result of the branch
+    #
+    def SubmitEnsembleBranch(self, branch, lats, lons, DT, listOfFiles):
+        return self.executor.submit(workerCalcEnsembleBranch, branch, lats, lons, DT, listOfFiles)
+
+    ## Same as ROAM.CalcColumnProfiles, the columns are split between the workers, the profileFcn
+    #  of ROAM.IonoStatesToColumnGrid
+    #
+    def CalcColumnProfiles(self, lats, lons, ionoStates, DT, iono_grid_parms, SporadicE):
+        numChunks = max(1, min(self.config.numProcesses, len(lats)))
+        futures = []
+        for chunk in numpy.array_split(numpy.arange(len(lats)), numChunks):
+            futures.append(self.executor.submit(workerCalcColumnProfiles, lats[chunk], lons[chunk], ionoStates[chunk],
+                                                DT, iono_grid_parms, SporadicE))
+        return numpy.vstack([future.result() for future in futures])
+
+    ## Stop the worker processes
+    #
+    #  @param wait - wait for the requests already submitted
+    #
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        logger.info('WorkerPool stopped')
+
+class UnitTest_WorkerPool(unittest.TestCase):
+
+    def test_IRI(self):
+        from IonoModelEngine.Config import ConfigValues
+        from numpy.testing import assert_allclose
+        roamConfig = ConfigValues.ROAMConfig()
+        roamConfig.backgroundModel = 'iri'
+        config = ConfigValues.WorkerPoolConfig()
+        config.numProcesses = 2
+        config.chunkSize = 2
+        pool = WorkerPool(config, roamConfig)
+        roam = ROAM(roamConfig, IrtamPyIface(), Pharlap())
+        DT = datetime(2015, 10, 20)
+        lats = [32.4824, 37.2321, 40.0, 51.5]
+        lons = [-106.3809, 256.2323, 254.7, 0.1]
+        try:
+            self.assertTrue(pool.warmUp())
+            states = pool.CalcIonoStateBatch(lats, lons, DT, [])
+            assert_allclose(states, roam.CalcIonoStateBatch(lats, lons, DT, []))
+            assert_allclose(pool.CalcIonoState(lats[0], lons[0], DT, []), states[0])
+            iono_grid_parms = [30.0, 1.0, 5, 252.0, 1.0, 6, 60.0, 2.0, 201]
+            assert_allclose(roam.IonoStatesToColumnGrid(iono_grid_parms, DT, [], profileFcn=pool.CalcColumnProfiles),
+                            roam.IonoStatesToColumnGrid(iono_grid_parms, DT, []))
+        finally:
+            pool.shutdown()
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
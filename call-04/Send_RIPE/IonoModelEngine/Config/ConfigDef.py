@@ -45,7 +45,7 @@ class NOAAConfig:
 ## Data controler config
 #
 class DataControllerConfig:
-    __slots__ = ('noaaConfig', 'giroConfig', 'lpiConfig', 'localSounderConfig', 'sources')
+    __slots__ = ('noaaConfig', 'giroConfig', 'lpiConfig', 'localSounderConfig', 'sources', 'realTime', 'windowStep')
     
     def __init__(self):
         ## Config for noaa db
@@ -58,11 +58,17 @@ class DataControllerConfig:
         self.localSounderConfig = None
         ## A list of the sources that we are going to use, for example ['noaa', 'giro']
         self.sources = None
+        ## True to stage the data in the background and answer requests from the local stores only
+        self.realTime = None
+        ## Seconds of the data windows, None to process each request time. The windows start on multiples of
+        #  windowStep after midnight, a request is processed at the start of its window so it never gets data
+        #  staged for a later time, and the requests of one window share one download and the same files
+        self.windowStep = None
 
 ## Config for ROAM
 #
 class ROAMConfig:
-    __slots__ = ('ripeStore', 'irtamStore', 'localStore', 'noaaConfig','giroConfig','backgroundModel','refreshIRI','synopticTilt')
+    __slots__ = ('ripeStore', 'irtamStore', 'localStore', 'noaaConfig','giroConfig','backgroundModel','refreshIRI','synopticTilt','tiltFieldConfig','gridThreads','gridStoreConfig','columnSpacing')
 
     def __init__(self):
         ## The local directories to store the RIPE format input
@@ -82,17 +88,159 @@ class ROAMConfig:
         self.refreshIRI = None
         ## Flag to use synotic tilt
         self.synopticTilt = None
+        ## TiltFieldConfig() - compute the tilts from a regional foF2 field, None to evaluate a stencil around each point
+        self.tiltFieldConfig = None
+        ## Threads building the electron density grids, None for every core
+        self.gridThreads = None
+        ## GridStoreConfig() - keep the electron density grids on disk, None to build them at every call
+        self.gridStoreConfig = None
+        ## Spacing (degrees) of the lattice of columns evaluated by ROAM.IonoStatesToColumnGrid, None for 2 degrees
+        self.columnSpacing = None
+
+## Configuration for the electron density grids kept on disk
+#
+class GridStoreConfig:
+    __slots__ = ('directory', 'dtype')
+
+    def __init__(self):
+        ## Directory of the grid files
+        self.directory = None
+        ## Type the grids are stored as, 'float32' or 'float64'
+        self.dtype = None
+
+## Configuration for the regional foF2 field the tilts are computed from
+#
+class TiltFieldConfig:
+    __slots__ = ('latMin', 'latMax', 'lonMin', 'lonMax', 'spacing', 'epochStep', 'maxEpochs')
+
+    def __init__(self):
+        ## Southern edge of the field (degrees)
+        self.latMin = None
+        ## Northern edge of the field (degrees)
+        self.latMax = None
+        ## Western edge of the field (degrees)
+        self.lonMin = None
+        ## Eastern edge of the field (degrees), east of lonMin
+        self.lonMax = None
+        ## Spacing of the lattice (degrees)
+        self.spacing = None
+        ## Seconds between the epochs a field is computed for, the field of a request is interpolated
+        #  in time between the epochs around it. None to compute a field for every request time
+        self.epochStep = None
+        ## Number of epochs whose field is kept
+        self.maxEpochs = None
 
 ## Configuration for TICS
 #         
 class TICSConfig:
-    __slots__ = ('dataControllerConfig', 'roamConfig')
+    __slots__ = ('dataControllerConfig', 'roamConfig', 'serverConfig', 'cacheConfig', 'workerPoolConfig', 'latticeConfig',
+                 'assimilationConfig')
 
     def __init__(self):
         ## Configuration for the DataController
         self.dataControllerConfig = None
         ## Configuration for ROAM
         self.roamConfig  = None
+        ## Configuration for the request server run by Manager.run()
+        self.serverConfig = None
+        ## Configuration for the ionoState cache of the Manager, None to disable the cache
+        self.cacheConfig = None
+        ## Configuration for the ROAM worker processes of the Manager, None to run ROAM in the Manager process
+        self.workerPoolConfig = None
+        ## Configuration for the ionoState lattice of the Manager, None to compute every request with ROAM
+        self.latticeConfig = None
+        ## Configuration for the continuous assimilation of the Manager, None to only assimilate on request
+        self.assimilationConfig = None
+
+## Configuration for the iono-state request server
+#
+class ServerConfig:
+    __slots__ = ('host', 'port', 'numWorkers', 'queueSize', 'requestTimeout', 'queryBudget')
+
+    def __init__(self):
+        ## The local interface the server listens on
+        self.host = None
+        ## The TCP port the server listens on
+        self.port = None
+        ## Number of worker threads answering requests
+        self.numWorkers = None
+        ## Maximum number of requests waiting for a worker, extra requests are answered 'busy'
+        self.queueSize = None
+        ## Time in seconds a client waits for its answer before it is answered 'timeout'
+        self.requestTimeout = None
+        ## Time in seconds given to the configured model before a degraded answer is sent, None to always wait
+        self.queryBudget = None
+
+## Configuration for the ionoState cache
+#
+class CacheConfig:
+    __slots__ = ('latStep', 'lonStep', 'timeStep', 'maxSize', 'ttl', 'versionTtl')
+
+    def __init__(self):
+        ## Requests are snapped to this latitude step (degrees) before the state is computed
+        self.latStep = None
+        ## Requests are snapped to this longitude step (degrees) before the state is computed
+        self.lonStep = None
+        ## Requests are snapped to this time step (seconds) before the state is computed
+        self.timeStep = None
+        ## Maximum number of ionoStates kept
+        self.maxSize = None
+        ## Time in seconds a cached ionoState stays valid
+        self.ttl = None
+        ## Time in seconds the version of the data of an epoch is trusted before the data is checked
+        #  again, new data staged within it is not seen. None to check the data on every request
+        self.versionTtl = None
+
+## Configuration for the ionoState lattice answering the requests of the Manager
+#
+class LatticeConfig:
+    __slots__ = ('latMin', 'latMax', 'lonMin', 'lonMax', 'spacing', 'epochStep', 'maxEpochs', 'refreshInterval')
+
+    def __init__(self):
+        ## Southern edge of the lattice (degrees)
+        self.latMin = None
+        ## Northern edge of the lattice (degrees)
+        self.latMax = None
+        ## Western edge of the lattice (degrees)
+        self.lonMin = None
+        ## Eastern edge of the lattice (degrees), east of lonMin
+        self.lonMax = None
+        ## Spacing of the lattice (degrees)
+        self.spacing = None
+        ## Time between two epochs (seconds), should divide a day evenly
+        self.epochStep = None
+        ## Number of epochs whose lattice is kept
+        self.maxEpochs = None
+        ## Seconds between two checks for new data in real time
+        self.refreshInterval = None
+
+## Configuration for the continuous assimilation publishing ionoState archives
+#
+class AssimilationConfig:
+    __slots__ = ('sites', 'latticeConfig', 'epochStep', 'delay', 'archiveDirectory')
+
+    def __init__(self):
+        ## List of (lat, lon) in degrees of the reference sites assimilated
+        self.sites = None
+        ## LatticeConfig() of the lattice whose points are assimilated as well, None for the sites only
+        self.latticeConfig = None
+        ## Time between two epochs (seconds), should divide a day evenly
+        self.epochStep = None
+        ## Seconds after an epoch before it is assimilated, for the soundings of the epoch to come in
+        self.delay = None
+        ## Directory of the ionoState archives, one directory per UT day holding one archive per site
+        self.archiveDirectory = None
+
+## Configuration for the ROAM worker processes
+#
+class WorkerPoolConfig:
+    __slots__ = ('numProcesses', 'chunkSize')
+
+    def __init__(self):
+        ## Number of worker processes, each with its own IRI and IRTAM handles
+        self.numProcesses = None
+        ## Minimum number of locations of a batch sent to one worker
+        self.chunkSize = None
 
 ## Configuration for GIRO
 #
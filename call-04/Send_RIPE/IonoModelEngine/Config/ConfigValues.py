@@ -52,6 +52,8 @@ def DataControllerConfig():
     dataControllerConfig.giroConfig = GIROConfig()
     #dataControllerConfig.sources = ['noaa'] #['noaa'] , ['giro'] or both ['noaa', 'giro']
     dataControllerConfig.sources = ['noaa', 'giro']
+    dataControllerConfig.realTime = False
+    dataControllerConfig.windowStep = None
     return dataControllerConfig
 
 ## Default values for ROAMConfig
@@ -67,14 +69,107 @@ def ROAMConfig():
     roamConfig.backgroundModel = 'irtam' # 'iri', 'ripe', 'irtam', 'ripe-irtam'
     roamConfig.refreshIRI = False
     roamConfig.synopticTilt = True
+    roamConfig.tiltFieldConfig = None
+    roamConfig.gridThreads = None
+    roamConfig.gridStoreConfig = None
+    roamConfig.columnSpacing = 2.0
     return roamConfig
 
+## Default values for GridStoreConfig
+#
+def GridStoreConfig():
+    import os
+    pythonRoot = os.environ['PYTHONPATH'].split(os.pathsep)[0]
+    gridStoreConfig = ConfigDef.GridStoreConfig()
+    gridStoreConfig.directory = os.path.join(pythonRoot, 'tmp/gridStore')
+    gridStoreConfig.dtype = 'float32'
+    return gridStoreConfig
+
+## Default values for TiltFieldConfig, covers the continental US
+#
+def TiltFieldConfig():
+    tiltFieldConfig = ConfigDef.TiltFieldConfig()
+    tiltFieldConfig.latMin = 20.0
+    tiltFieldConfig.latMax = 55.0
+    tiltFieldConfig.lonMin = 230.0
+    tiltFieldConfig.lonMax = 300.0
+    tiltFieldConfig.spacing = 0.5
+    tiltFieldConfig.epochStep = 5*60
+    tiltFieldConfig.maxEpochs = 4
+    return tiltFieldConfig
+
+## Default values for ServerConfig
+#
+def ServerConfig():
+    serverConfig = ConfigDef.ServerConfig()
+    serverConfig.host = '127.0.0.1'
+    serverConfig.port = 5555
+    serverConfig.numWorkers = 4
+    serverConfig.queueSize = 64
+    serverConfig.requestTimeout = 60
+    serverConfig.queryBudget = 30
+    return serverConfig
+
+## Default values for CacheConfig
+#
+def CacheConfig():
+    cacheConfig = ConfigDef.CacheConfig()
+    cacheConfig.latStep = 0.05
+    cacheConfig.lonStep = 0.05
+    cacheConfig.timeStep = 60
+    cacheConfig.maxSize = 10000
+    cacheConfig.ttl = 5*60
+    cacheConfig.versionTtl = 30
+    return cacheConfig
+
+## Default values for WorkerPoolConfig. The Manager only starts the workers if
+#  TICSConfig.workerPoolConfig is set
+#
+def WorkerPoolConfig():
+    import os
+    workerPoolConfig = ConfigDef.WorkerPoolConfig()
+    workerPoolConfig.numProcesses = os.cpu_count()
+    workerPoolConfig.chunkSize = 16
+    return workerPoolConfig
+
+## Default values for LatticeConfig, covers the continental US. The Manager only builds the
+#  lattice if TICSConfig.latticeConfig is set
+#
+def LatticeConfig():
+    latticeConfig = ConfigDef.LatticeConfig()
+    latticeConfig.latMin = 20.0
+    latticeConfig.latMax = 55.0
+    latticeConfig.lonMin = 230.0
+    latticeConfig.lonMax = 300.0
+    latticeConfig.spacing = 1.0
+    latticeConfig.epochStep = 15*60
+    latticeConfig.maxEpochs = 4
+    latticeConfig.refreshInterval = 60
+    return latticeConfig
+
+## Default values for AssimilationConfig. The Manager only runs the assimilation if
+#  TICSConfig.assimilationConfig is set
+#
+def AssimilationConfig():
+    import os
+    pythonRoot = os.environ['PYTHONPATH'].split(os.pathsep)[0]
+    assimilationConfig = ConfigDef.AssimilationConfig()
+    # 40.0, 254.7 - Boulder; 45.07, 276.440 - Alpena
+    assimilationConfig.sites = [(40.0, 254.7), (45.07, 276.44)]
+    assimilationConfig.latticeConfig = None
+    assimilationConfig.epochStep = 5*60
+    assimilationConfig.delay = 60
+    assimilationConfig.archiveDirectory = os.path.join(pythonRoot, 'tmp/ionoStateArchive')
+    return assimilationConfig
+
 ## Default values for TICSConfig
 #
 def TICSConfig():
     ticsConfig = ConfigDef.TICSConfig()
     ticsConfig.dataControllerConfig = DataControllerConfig()
     ticsConfig.roamConfig = ROAMConfig()
+    ticsConfig.serverConfig = ServerConfig()
+    ticsConfig.cacheConfig = None
     # Condition the input source based upon the background model
     if ticsConfig.roamConfig.backgroundModel == 'ripe':
         ticsConfig.dataControllerConfig.sources = ['noaa']
@@ -23,6 +23,7 @@ import threading
 import unittest
 import os
 import shutil
+import zlib
 import Shared.Utils.HfgeoLogger as Logger
 from IonoModelEngine.DataControl.NOAADataManager import NOAADataManager
 from IonoModelEngine.DataControl.GIRODataManager import GIRODataManager
@@ -30,17 +31,43 @@ from IonoModelEngine.Config import ConfigDef, ConfigValues
 from Shared.IonoPyIface.Pharlap import Pharlap
 from IonoModelEngine.Fit.SaoPyIface import SaoPyIface
 from IonoModelEngine.IRTAM.IrtamPyIface import IrtamPyIface 
+from Shared.Utils.SingleFlight import SingleFlight
+from Shared.Utils.DateTime import floorDateTime
+from Shared.Utils.Timing import timed
 
 logger = Logger.getLogger()
 
 ## package IonoModelEngine.DataControl.DataController 
 #  Data controller for all possible data sources
 
+## Tag identifying the content of the files returned by DataController.process
+#
+#  The NOAA manager rewrites its output files on every call, so the tag is computed from
+#  the content of the files rather than their modification time.
+#
+#  @param outputFileList - dictionary of file lists returned by DataController.process
+#
+#  @retval version - integer, equal for equal inputs
+#
+def dataVersion(outputFileList):
+    version = 0
+    if not outputFileList:
+        return version
+    for source in sorted(outputFileList):
+        for fname in sorted(outputFileList[source]):
+            version = zlib.crc32(fname.encode('utf-8'), version)
+            try:
+                with open(fname, 'rb') as fd:
+                    version = zlib.crc32(fd.read(), version)
+            except IOError:
+                logger.warning('Could not read {:s} to compute the data version'.format(fname))
+    return version
+
 ## DataController class's job is to fetch data for an iono reqest and package it to a common format for ROAM
 #
 class DataController:
 
-    __slots__ = ['config', 'noaaManager', 'giroManager', 'lpiManager', 'localSensorManager']
+    __slots__ = ['config', 'noaaManager', 'giroManager', 'lpiManager', 'localSensorManager', 'singleFlight']
 
     ## Default constructor
     #
@@ -53,6 +80,9 @@ class DataController:
         self.giroManager = None
         self.lpiManager = None
         self.localSensorManager = None
+        # Requests for the same data window arriving while it is processed wait for it instead of
+        # downloading and translating the same files again
+        self.singleFlight = SingleFlight()
 
         # Create the specific data manager that was requested in config
         if 'noaa' in self.config.sources:
@@ -60,21 +90,67 @@ class DataController:
         if 'giro' in self.config.sources:
             self.giroManager = GIRODataManager(self.config.giroConfig, pharlapHandle)
 
+        # In real time the managers stage the data in the background and requests only use what is on disk
+        if self.config.realTime:
+            for manager in [self.noaaManager, self.giroManager]:
+                if manager:
+                    manager.start()
+
+    ## Stop the background staging of the data managers
+    #
+    def shutdown(self):
+        for manager in [self.noaaManager, self.giroManager]:
+            if manager and manager.running:
+                manager.shutdown()
+
     ## Process the request by downloading + translate the data from whatever format into one that roam can use
     #
+    #  With config.windowStep the request is processed at the start of its data window, see
+    #  dataWindow, so the requests of the same window share one download and get the same files
+    #  whichever of them came first.
+    #
     #  @param requestDateTime - Python datetime format - the datetime of the request
     #
     def process(self, requestDateTime):
+        window = self.dataWindow(requestDateTime)
+        outputFileList = self.singleFlight.do(window, self.processOnce, window)
+        # Each caller gets its own lists since the same result can be handed to several callers
+        return {source: list(files or []) for source, files in outputFileList.items()}
+
+    ## The data window of a request
+    #
+    #  @param requestDateTime - Python datetime format - the datetime of the request
+    #
+    #  @retval window - the start of the window of config.windowStep holding the request, the
+    #                   request itself without a step
+    #
+    def dataWindow(self, requestDateTime):
+        windowStep = getattr(self.config, 'windowStep', None)
+        if not windowStep:
+            return requestDateTime
+        return floorDateTime(requestDateTime, windowStep)
+
+    ## Do the work of process(), only one call per data window at a time
+    #
+    #  @param requestDateTime - Python datetime format - the datetime of the data window
+    #
+    @timed('dataController')
+    def processOnce(self, requestDateTime):
         outputFileList = {}
         outputFileList['noaa'] = []
         outputFileList['giro'] = []
         outputFileList['localSounder'] = []
 
         # Get the data or return None
+        # Each data manager owns its connection and its local store, so only one request at a time
+        # is allowed to download and translate. The background staging downloads without the lock
+        # and only takes it to translate, so real time requests never wait on the servers
         if self.noaaManager:
-            outputFileList['noaa'] = self.noaaManager.process(requestDateTime)
+            with self.noaaManager.lock:
+                outputFileList['noaa'] = self.noaaManager.process(requestDateTime, localOnly=bool(self.config.realTime))
         if self.giroManager:
-            outputFileList['giro'] = self.giroManager.process(requestDateTime)
+            with self.giroManager.lock:
+                outputFileList['giro'] = self.giroManager.process(requestDateTime, localOnly=bool(self.config.realTime))
 
         return outputFileList        
 
@@ -106,6 +182,23 @@ class UnitTest_DataController(unittest.TestCase):
         listOfOutputFiles = dataController.process(datetime(2015, 10, 20))
         self.assertEqual(len(listOfOutputFiles['giro']), 4)  
 
+    def testDataWindow(self):
+        # Setup the configuration for the DataController
+        dataControllerConfig = ConfigValues.DataControllerConfig()
+        dataControllerConfig.sources = []
+        dataControllerConfig.windowStep = 5*60
+        dataController = DataController(dataControllerConfig)
+        processed = []
+        dataController.singleFlight.do = lambda key, fcn, *args: processed.append((key,) + args) or {}
+        # Requests in the same window are processed once at the start of the window
+        dataController.process(datetime(2015, 10, 20, 1, 1))
+        dataController.process(datetime(2015, 10, 20, 1, 4, 50))
+        self.assertEqual(processed, [(datetime(2015, 10, 20, 1, 0),) * 2] * 2)
+        # Without a step every request time is processed
+        dataControllerConfig.windowStep = None
+        dataController.process(datetime(2015, 10, 20, 1, 1))
+        self.assertEqual(processed[-1], (datetime(2015, 10, 20, 1, 1),) * 2)
+
 if __name__ == '__main__':
     logger.setLevel('INFO')
     unittest.main()
@@ -29,6 +29,7 @@ import requests
 import warnings
 import threading
 import Shared.Utils.HfgeoLogger as Logger
+from Shared.Utils.Timing import timed
 from IonoModelEngine.Config import ConfigDef, ConfigValues
 import Shared.IonoPyIface.Pharlap as IonoPyIface
 
@@ -55,13 +56,12 @@ class GIRODataManager(threading.Thread):
         self.localPath = None
         # Check internal in seconds
         self.checkInterval = 5*60
+        # Wakes the background thread up when it is told to stop
+        self.wakeUp = threading.Event()
         # GIRO information
         self.url = config.giroURL
-        # Directory structure for local storage
+        # Directory structure for local storage, created when the first file is written
         self.giroStore = config.giroStore
-        os.makedirs(self.giroStore, exist_ok=True)
-        # Variable to keep track of which file were downloaded during process()
-        self.downloadedFiles = []
         # Check internal in seconds
         self.checkInterval = 5*60
         # Handle to Pharlap interface
@@ -70,40 +70,77 @@ class GIRODataManager(threading.Thread):
         self.username = 'HFGeo'
         self.password = 'Phase3'
     
-    ## Start the thread
+    ## Start staging the coefficients of the current and next 15 minute slots in the background
     #
     def start(self):
-        self.runing = True
-        self.run()
+        self.running = True
+        super().start()
 
     ## Shutdown 
     #
     def shutdown(self):
         self.running = False
-        self.ftp.quit()
+        self.wakeUp.set()
+        if self.is_alive():
+            self.join()
 
-    ## Check if we have supporting data for the request
+    ## Name of the local coefficient file of a parameter for the 15 minute slot of a date
+    #
+    #  @param date - datetime object - The request time
+    #  @param iono_param - string - 'foF2', 'hmF2', 'B0' or 'B1'
+    #
+    #  @retval fileName - string - full path of the file in the GIRO store
     #
-    def process(self, date):
+    def coefficientFile(self, date, iono_param):
+
+        int15min = round((date.hour * 3600 + date.minute * 60 + date.second ) / 900)
+
+        if int15min < 96:
+            time_label = date.strftime('%Y%m%d') + "_{:02.0f}{:02.0f}".format(numpy.floor(int15min/4),(int15min/4 - numpy.floor(int15min/4)) * 60) 
+        else:  
+            time_label = ( date + timedelta(days=1) ).strftime('%Y%m%d') + '_0000'
 
-        self.downloadedFiles = []
+        return self.giroStore + '/IRTAM_' + iono_param + '_COEFFS_' + time_label + '.ASC'
 
+    ## The coefficient files of a date that are already in the local store
+    #
+    #  Does not go to the server and does not need the lock, so it can be used while process() runs.
+    #
+    #  @param date - datetime object - The request time
+    #
+    #  @retval localFiles - list of string - The coefficient files found, all four when IRTAM can be used
+    #
+    def localFiles(self, date):
+        localFiles = []
         for iono_param in ['foF2', 'hmF2', 'B0', 'B1']:
+            fileName = self.coefficientFile(date, iono_param)
+            if os.path.isfile(fileName):
+                localFiles.append(fileName)
+        return localFiles
 
-#             time_str = date.strftime('%Y/%m/%dT%H:%M:%S')       
+    ## Check if we have supporting data for the request
+    #
+    #  @param date - datetime object - The request time
+    #  @param localOnly - Boolean - Only use the files already downloaded, never go to the server
+    #
+    #  @retval downloadedFiles - list of string - The coefficient files IRTAM needs
+    #
+    @timed('giro.fetch')
+    def process(self, date, localOnly=False):
 
-             int15min = round((date.hour * 3600 + date.minute * 60 + date.second ) / 900)
+        downloadedFiles = []
 
-             if int15min < 96:
-                time_label = date.strftime('%Y%m%d') + "_{:02.0f}{:02.0f}".format(numpy.floor(int15min/4),(int15min/4 - numpy.floor(int15min/4)) * 60) 
-             else:  
-                time_label = ( date + timedelta(days=1) ).strftime('%Y%m%d') + '_0000'
+        for iono_param in ['foF2', 'hmF2', 'B0', 'B1']:
 
-             fileName = self.giroStore + '/IRTAM_' + iono_param + '_COEFFS_' + time_label + '.ASC'
+             fileName = self.coefficientFile(date, iono_param)
 
              # if file exists, do not download
              if os.path.isfile(fileName):
-                self.downloadedFiles.append(fileName)
+                downloadedFiles.append(fileName)
+                continue
+
+             if localOnly:
+                logger.warning('{:s} is not staged yet'.format(os.path.basename(fileName)))
                 continue
 
              irtam_url = self.url + date.strftime('%Y/%m/%dT%H:%M:%S') + '&charName=' + iono_param + '&n=' + self.username + '&w=' + self.password
@@ -120,21 +157,34 @@ class GIRODataManager(threading.Thread):
 
              # round up time to 15 min increment to match GIRO convention
 
-             giro_file = open(fileName, 'wb')
+             # Written next to the store and renamed once complete, so that the requests
+             # checking the store never see a partial file
+             os.makedirs(self.giroStore, exist_ok=True)
+             partName = fileName + '.part'
+             giro_file = open(partName, 'wb')
              giro_file.write(request.content)
              giro_file.close() 
-             self.downloadedFiles.append(fileName)
+             os.replace(partName, fileName)
+             downloadedFiles.append(fileName)
  
-        return self.downloadedFiles
+        return downloadedFiles
 
+    ## Run the thread. Keeps the coefficients of the current and next 15 minute slots on disk
+    #
     def run(self):
         while self.running:
-            if time.now() - self.lastUpdateTime > self.checkInterval:
-                data = self.fetchData(datetime.now())
-                if data:
-                    self.lastUpdateTime = datetime.now()
-            else:
-                time.sleep(self.checkInterval)
+            now = datetime.utcnow()
+            for date in [now, now + timedelta(minutes=15)]:
+                if not self.running:
+                    break
+                # The files are renamed into the store once complete, so the lock is not held
+                # while the server is queried and the requests never wait for it
+                try:
+                    self.process(date)
+                except Exception as e:
+                    logger.error('Staging GIRO data failed. Most likely a connection error.')
+                    logger.error('{}'.format(e))
+            self.wakeUp.wait(self.checkInterval)
 
 class UnitTest_GIRODataManager(unittest.TestCase):
 
@@ -152,6 +202,27 @@ class UnitTest_GIRODataManager(unittest.TestCase):
         listOfOutputFiles = giroManager.process(datetime(2015, 10, 20))
         self.assertEqual(len(listOfOutputFiles),4)
 
+    def testStagingDoesNotHoldLock(self):
+        config = ConfigValues.GIROConfig()
+        giroManager = GIRODataManager(config, None)
+        downloading = threading.Event()
+        release = threading.Event()
+        # A download stuck on the server
+        def process(date, localOnly=False):
+            downloading.set()
+            release.wait(10)
+            return []
+        giroManager.process = process
+        giroManager.start()
+        try:
+            self.assertTrue(downloading.wait(10))
+            # The requests checking the store are not held up by the download
+            self.assertTrue(giroManager.lock.acquire(timeout=1))
+            giroManager.lock.release()
+        finally:
+            release.set()
+            giroManager.shutdown()
+
 if __name__ == '__main__':
     logger.setLevel('INFO')
     unittest.main()
@@ -28,7 +28,9 @@ import errno
 import unittest
 import warnings
 import threading
+from datetime import timedelta
 import Shared.Utils.HfgeoLogger as Logger
+from Shared.Utils.Timing import timed
 from IonoModelEngine.Config import ConfigDef, ConfigValues
 import IonoModelEngine.Fit.GetProfileParameters as GetProfileParameters
 from Shared.IonoPyIface.Pharlap import Pharlap
@@ -57,6 +59,8 @@ class NOAADataManager(threading.Thread):
         self.localPath = None
         # Check internal in seconds
         self.checkInterval = 5*60
+        # Wakes the background thread up when it is told to stop
+        self.wakeUp = threading.Event()
 
         # NOAA information
         self.url = 'ftp.ngdc.noaa.gov'
@@ -66,22 +70,12 @@ class NOAADataManager(threading.Thread):
         self.stationList = config.stationList
         self.fitB0B1 = config.fitB0B1
 
-        # We can log in at this moment in time
+        # We log in the first time we need the server, see connect()
         self.ftp = None
-        try:
-            self.ftp = ftplib.FTP(host='ftp.ngdc.noaa.gov', 
-                                user='anonymous',
-                                passwd='123',
-                                timeout=10)
-        except Exception as e:
-            logger.error('Establishing connection to NOAA failed. Most likely a connection error.')
-            logger.error('{}'.format(e))
 
-        # Directory structure for local storage
+        # Directory structure for local storage, created when the first file is written
         self.saoStore = config.saoStore
         self.ripeStore = config.ripeStore
-        os.makedirs(self.saoStore, exist_ok=True)
-        os.makedirs(self.ripeStore, exist_ok=True)
 
         # Handle to the cpp sao parser
         self.saoReaderHandle = saoReaderHandle
@@ -107,11 +101,36 @@ class NOAADataManager(threading.Thread):
                 logger.error('{}'.format(e))
             self.ftp = None
 
-    ## Start this thread
+    ## Start staging the data of the current and next download windows in the background
     #
     def start(self):
-        self.runing = True
-        self.run()
+        self.running = True
+        super().start()
+
+    ## Stop the background staging
+    #
+    def shutdown(self):
+        self.running = False
+        self.wakeUp.set()
+        if self.is_alive():
+            self.join()
+
+    ## Log in to the NOAA server unless we already are
+    #
+    #  @retval True if we have a connection
+    #
+    def connect(self):
+        if self.ftp:
+            return True
+        try:
+            self.ftp = ftplib.FTP(host=self.url, 
+                                user=self.username,
+                                passwd=self.password,
+                                timeout=10)
+        except Exception as e:
+            logger.error('Establishing connection to NOAA failed. Most likely a connection error.')
+            logger.error('{}'.format(e))
+        return self.ftp is not None
 
     ## Go to noaa and fetch the data from the provided directory at the time given
     #
@@ -122,6 +141,7 @@ class NOAADataManager(threading.Thread):
     #  @param fileList - list of strings - The list of SAO files on NOAA server for specific station and day
     #  @return downloadedFileList - list of string - list of full path downloaded files
     #
+    @timed('noaa.download')
     def fetchData(self, noaaDir, ursi, dateDir, requestTime, fileList):
         # These are the files that we downloaded to disk
         downloadedFiles = []
@@ -142,17 +162,23 @@ class NOAADataManager(threading.Thread):
                 fileName = os.path.join(outputDir, baseFileName)
                 # If we already have the file do not download however we do want to add it to the list 
                 # so that the next steps can be taken
-                downloadedFiles.append(fileName)
                 if os.path.isfile(fileName):
+                    downloadedFiles.append(fileName)
                     continue
-                # Create the local file
-                with open(fileName, 'wb') as fileHandle:
-                    try:
+                # Download next to the local file and rename it once complete, so that the
+                # requests reading the store without the lock never see a partial file
+                partName = fileName + '.part'
+                try:
+                    with open(partName, 'wb') as fileHandle:
                         self.ftp.retrbinary('RETR ' + f, fileHandle.write)
-                    except Exception as e:
-                        logger.error('Fetching SAO from NOAA failed. Most likely a connection error.')
-                        logger.error('{}'.format(e))
-                        break
+                    os.replace(partName, fileName)
+                except Exception as e:
+                    logger.error('Fetching SAO from NOAA failed. Most likely a connection error.')
+                    logger.error('{}'.format(e))
+                    if os.path.exists(partName):
+                        os.remove(partName)
+                    break
+                downloadedFiles.append(fileName)
 
         return downloadedFiles
 
@@ -164,6 +190,7 @@ class NOAADataManager(threading.Thread):
     #
     #  @retval translatedFileLIst - list of string - list of full path to ripe input files
     #
+    @timed('noaa.translate')
     def translate(self, downloadedFileList):
         translatedFileList = []        
         for fname in downloadedFileList:
@@ -192,9 +219,12 @@ class NOAADataManager(threading.Thread):
     #
     #  @return processedFileList - list of string - list of full path to the concatinated ripe input files
     #
+    @timed('noaa.concatenate')
     def copyToSAOStore(self, translatedFileList):
         
         processedFileList = []
+        if translatedFileList:
+            os.makedirs(self.ripeStore, exist_ok=True)
         # Go through all our stations
         for ursi in self.stationList:
             currentListOfFilesToCat = ''
@@ -213,31 +243,76 @@ class NOAADataManager(threading.Thread):
             processedFileList.append(outputFileName)
         return processedFileList
 
-    ## Check if we have supporting data for the request
+    ## List the SAO files of one station and one day
+    #
+    #  @param noaaFtpDir - string - The directory of the files on the NOAA server
+    #  @param ursi - string - The ursi station name
+    #  @param dateDir - string - The yyyy/ddd directory of the day
+    #  @param performRefresh - Boolean - Ask the server again even if we already have the list
+    #  @param localOnly - Boolean - Only list the files already downloaded, do not go to the server
+    #
+    #  @retval fileList - list of strings - The SAO files, None if the server could not be reached
+    #
+    @timed('noaa.list')
+    def listFiles(self, noaaFtpDir, ursi, dateDir, performRefresh, localOnly):
+        if localOnly:
+            # Name the local files like the server does so that fetchData picks them up without downloading
+            localDir = os.path.join(self.saoStore, ursi, dateDir)
+            if not os.path.isdir(localDir):
+                return []
+            return [noaaFtpDir + f for f in sorted(os.listdir(localDir)) if f.endswith('.SAO')]
+
+        list_key = ursi + '/' + dateDir
+
+        # If we don't have the list of file for the requested data on hand then get the list of file from NOAA
+        # If we want to refresh to get a new file list then aslo fetch the list
+        if list_key not in self.fileList or performRefresh:
+            try:
+                self.fileList[list_key] = None
+                self.fileList[list_key] = self.ftp.nlst(noaaFtpDir + "*.SAO")
+            except Exception as e:
+                logger.error('Fetching file list from NOAA failed. Most likely a connection error.')
+                logger.error('{}'.format(e))
+                return None
+            finally:
+                self.lastCheckTime = datetime.now()
+
+        return self.fileList[list_key]
+
+    ## Download and translate the data of the window around the request
     #
     #  @param requestTime - datetime object - The request time
+    #  @param refresh - Boolean - Ask the server for new files even if we already have a list for the day
+    #  @param localOnly - Boolean - Only use the files already downloaded, never go to the server
     #
-    #  @retval processedFileList - list of string - The list of files ripe need to ingest
+    #  @retval translatedFileList - list of string - list of full path to ripe input files
     #
-    def process(self, requestTime):
+    def stage(self, requestTime, refresh=False, localOnly=False):
+        return self.translate(self.download(requestTime, refresh, localOnly))
+
+    ## List and download the SAO files of the window around the request
+    #
+    #  Only writes complete files to the SAO store, see fetchData, so the background staging
+    #  calls it without the lock.
+    #
+    #  @param requestTime - datetime object - The request time
+    #  @param refresh - Boolean - Ask the server for new files even if we already have a list for the day
+    #  @param localOnly - Boolean - Only use the files already downloaded, never go to the server
+    #
+    #  @retval downloadedFileList - list of string - list of full path to the SAO files,
+    #          empty if the server could not be reached
+    #
+    def download(self, requestTime, refresh=False, localOnly=False):
 
         # Peform a refetch of the NOAA list or not. Boolean
-        performRefresh = self.recheckForNewData and abs(self.lastCheckTime - datetime.now()).total_seconds() > self.recheckInterval
+        performRefresh = refresh or \
+            (self.recheckForNewData and abs(self.lastCheckTime - datetime.now()).total_seconds() > self.recheckInterval)
 
-        # If we failed to estabish connection at the constructor level try to do it now.
-        if not self.ftp:
-            try:
-                self.ftp = ftplib.FTP(host='ftp.ngdc.noaa.gov', 
-                                user='anonymous',
-                                passwd='123',
-                                timeout=10)
-            except Exception as e:
-                logger.error('Establishing connection to NOAA failed. Most likely a connection error.')
-                logger.error('{}'.format(e))
+        # Log in the first time we go to the server, or again if the last attempt failed
+        if not localOnly:
+            self.connect()
               
         downloadedFileList = []
-        translatedFileList = []
-        processedFileList = []
 
         # Loop through the stations and get the files
         for ursi in self.stationList:
@@ -249,86 +324,74 @@ class NOAADataManager(threading.Thread):
             if (requestTime.hour * 3600 + requestTime.minute * 60) < self.downloadWindow:  
                 dayBefore = str(year) + "/" + str(dayOfYear - 1).zfill(3)
                 noaaFtpDir = "/ionosonde/data/" + ursi + "/individual/" + dayBefore + "/scaled/"
-                list_key = ursi + '0'
- 
-                # If we don't have the list of file for the requested data on hand then get the list of file from NOAA
-                # If we want to refresh to get a new file list then aslo fetch the list
+
                 # In the case the communication goes down return imediately with whatever we got
-                if list_key not in self.fileList or performRefresh:
-                    try:
-                        self.fileList[list_key] = None
-                        self.fileList[list_key] = self.ftp.nlst(noaaFtpDir + "*.SAO")
-                    except Exception as e:
-                        logger.error('Fetching file list from NOAA failed. Most likely a connection error.')
-                        logger.error('{}'.format(e))
-                        return processedFileList                
-                    finally:
-                        self.lastCheckTime = datetime.now()
-
-                tmpList = self.fetchData(noaaFtpDir, ursi, dayBefore, requestTime, self.fileList[list_key])                    
+                fileList = self.listFiles(noaaFtpDir, ursi, dayBefore, performRefresh, localOnly)
+                if fileList is None:
+                    return []
+
+                tmpList = self.fetchData(noaaFtpDir, ursi, dayBefore, requestTime, fileList)
                 downloadedFileList.extend(tmpList)
 
             # this is the day
             today = str(year) + "/" + str(dayOfYear).zfill(3)
             noaaFtpDir = "/ionosonde/data/" + ursi + "/individual/" + today + "/scaled/"
-            list_key = ursi + '1'
 
-            # If we don't have the list of file for the requested data on hand then get the list of file from NOAA
-            # If we want to refresh to get a new file list then aslo fetch the list
             # In the case the communication goes down return imediately with whatever we got
-            if list_key not in self.fileList or performRefresh:
-                try:
-                    self.fileList[list_key] = None
-                    self.fileList[list_key] = self.ftp.nlst(noaaFtpDir + "*.SAO")
-                except Exception as e:
-                    logger.error('Fetching file list from NOAA failed. Most likely a connection error.')
-                    logger.error('{}'.format(e))
-                    return processedFileList
-                finally:
-                    self.lastCheckTime = datetime.now()
+            fileList = self.listFiles(noaaFtpDir, ursi, today, performRefresh, localOnly)
+            if fileList is None:
+                return []
 
-            tmpList = self.fetchData(noaaFtpDir, ursi, today, requestTime, self.fileList[list_key])
+            tmpList = self.fetchData(noaaFtpDir, ursi, today, requestTime, fileList)
             downloadedFileList.extend(tmpList)
 
             # this is the day after
             if (86400 - (requestTime.hour * 3600 + requestTime.minute * 60)) < self.downloadWindow: 
                 dayAfter = str(year) + "/" + str(dayOfYear + 1).zfill(3)
                 noaaFtpDir = "/ionosonde/data/" + ursi + "/individual/" + dayAfter + "/scaled/"
-                list_key = ursi + '2'
 
-                # If we don't have the list of file for the requested data on hand then get the list of file from NOAA
-                # If we want to refresh to get a new file list then aslo fetch the list
-                # In the case the communication goes down return imediately with whatever we got
-                if list_key not in self.fileList or performRefresh:
-                    try:
-                        self.fileList[list_key] = None
-                        self.fileList[list_key] = self.ftp.nlst(noaaFtpDir + "*.SAO")                    
-                    except Exception as e:
-                        logger.error('Fetching file list from NOAA failed. Most likely a connection error.')
-                        logger.error('{}'.format(e)) 
-                    finally:
-                        self.lastCheckTime = datetime.now()
-
-                tmpList = self.fetchData(noaaFtpDir, ursi, dayAfter, requestTime, self.fileList[list_key])
+                fileList = self.listFiles(noaaFtpDir, ursi, dayAfter, performRefresh, localOnly)
+
+                tmpList = self.fetchData(noaaFtpDir, ursi, dayAfter, requestTime, fileList)
                 downloadedFileList.extend(tmpList)
 
-        # Do the translation from sao to ripe format
-        translatedFileList = self.translate(downloadedFileList)
+        return downloadedFileList
+
+    ## Check if we have supporting data for the request
+    #
+    #  @param requestTime - datetime object - The request time
+    #  @param localOnly - Boolean - Only use the files already downloaded, never go to the server
+    #
+    #  @retval processedFileList - list of string - The list of files ripe need to ingest
+    #
+    def process(self, requestTime, localOnly=False):
+
+        translatedFileList = self.stage(requestTime, localOnly=localOnly)
         # Copy the files into a directory that Charlie wants
         processedFileList = self.copyToSAOStore(translatedFileList)
 
         return processedFileList
 
-    ## Run the thread
+    ## Run the thread. Keeps the current and the next download windows staged ahead of the wall clock
     #
     def run(self):
         while self.running:
-            if time.now() - self.lastUpdateTime > self.checkInterval:
-                data = self.fetchData(datetime.now())
-                if data:
-                    self.lastUpdateTime = datetime.now()
-            else:
-                time.sleep(self.checkInterval)
+            now = datetime.utcnow()
+            try:
+                # Ask the server for the files that came in since the last check. The network is
+                # used without the lock, the lock is only held to translate into the store
+                downloadedFileList = self.download(now, refresh=True)
+                with self.lock:
+                    self.translate(downloadedFileList)
+                # The next window only needs a listing if it starts a new day
+                if self.running:
+                    downloadedFileList = self.download(now + timedelta(seconds=self.checkInterval))
+                    with self.lock:
+                        self.translate(downloadedFileList)
+            except Exception as e:
+                logger.error('Staging NOAA data failed.')
+                logger.error('{}'.format(e))
+            self.wakeUp.wait(self.checkInterval)
 
 class UnitTest_NOAADataManager(unittest.TestCase):
 
@@ -352,6 +415,27 @@ class UnitTest_NOAADataManager(unittest.TestCase):
 
         self.assertEqual(len(listOfOutputFiles), 4)
 
+    def testStagingDoesNotHoldLock(self):
+        config = ConfigValues.NOAAConfig()
+        noaaManager = NOAADataManager(config, None, None)
+        downloading = threading.Event()
+        release = threading.Event()
+        # A download stuck on the server
+        def download(requestTime, refresh=False, localOnly=False):
+            downloading.set()
+            release.wait(10)
+            return []
+        noaaManager.download = download
+        noaaManager.start()
+        try:
+            self.assertTrue(downloading.wait(10))
+            # The requests reading the store are not held up by the download
+            self.assertTrue(noaaManager.lock.acquire(timeout=1))
+            noaaManager.lock.release()
+        finally:
+            release.set()
+            noaaManager.shutdown()
+
 if __name__ == '__main__':
     logger.setLevel('INFO')
     unittest.main()
@@ -29,6 +29,7 @@ import unittest
 import threading
 #import urllib.request
 import Shared.Utils.HfgeoLogger as Logger
+from Shared.Utils.Timing import timed
 #from IonoModelEngine.Config import ConfigDef, ConfigValues
 from IonoModelEngine.IRTAM.IrtamPyIface import IrtamPyIface
 from Shared.IonoPyIface.Pharlap import Pharlap
@@ -39,98 +40,95 @@ logger = Logger.getLogger()
 ## package IonoModelEngine.DataControl.GIRODataManager
 #  Data manager for GIRO data
 
-class IRTAM(threading.Thread):
+## Parsed coefficient files, keyed by file name and guarded by coefficientLock
+coefficientCache = {}
+coefficientLock = threading.Lock()
+
+## Read the coefficients and the time of validity from an IRTAM coefficient file
+#
+#  A file is only parsed again when its modification time or size changed, since RIPE
+#  and ROAM evaluate IRTAM at many locations from the same handful of files.
+#
+#  @param inputFile - full path to the IRTAM coefficient file
+#
+#  @retval (param, irtam_tov) - the 1064 coefficients and the datetime of validity
+#
+def readCoefficients(inputFile):
+
+    stat = os.stat(inputFile)
+    key = (stat.st_mtime, stat.st_size)
+
+    with coefficientLock:
+        cached = coefficientCache.get(inputFile)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    datain = numpy.genfromtxt( inputFile ) 
+    irtam_tov = None
+    with open(inputFile) as openFile:
+        for line in openFile.readlines():
+            if 'Validity' in str(line):
+                irtam_tov = datetime.strptime(line[19:35], '%Y-%m-%dT%H:%M')
+                break
+
+    coefficients = (numpy.reshape(datain,1064), irtam_tov)
+
+    with coefficientLock:
+        coefficientCache[inputFile] = (key, coefficients)
+
+    return coefficients
+
+## Evaluates IRTAM from the GIRO coefficient files staged by the GIRODataManager
+#
+#  There is no background work: the coefficient files are parsed on first use and kept in the
+#  coefficient cache until they change, see readCoefficients.
+#
+class IRTAM:
 
     def __init__(self, irtamPyToCHandle, ionoPyToCHandle):
 
-        super().__init__()
-        # Kill this thread when the main thread exist
-        self.daemon = True
-        # Wait until start is called
-        self.running = False
-        # Locking mechanism
-        self.lock = threading.Lock()
-        # The last time we fetch something
-        self.lastUpdateTime = None
-        # Where do we store the data locally
-        self.localPath = None
-        # Check internal in seconds
-        self.checkInterval = 5*60
-        # Variable to keep track of which file were downloaded during process()
-        self.downloadedFiles = []
-        # Check internal in seconds
-        self.checkInterval = 5*60
         # Handle to Pharlap interface
         self.ionoPyToCHandle = ionoPyToCHandle
         # Handle to irtamProcess interface
         self.irtamPyToCHandle = irtamPyToCHandle
 
-    ## Start the thread
-    #
-    def start(self):
-        self.runing = True
-        self.run()
-
-    ## Shutdown 
-    #
-    def shutdown(self):
-        self.running = False
-        self.ftp.quit()
-
     ## Calculate iono parameters for specific location using GIRO coefficients 
     #
+    @timed('irtam.translate')
     def translate(self, lat, lon, date, downloadedFiles):
        
         processedData = numpy.zeros(4)       
-        n = 0
-
-        for inputFile in downloadedFiles:
 
-           datain = numpy.genfromtxt( inputFile ) 
-           openFile = open(inputFile) 
-           for line in openFile.readlines():
-             if 'Validity' in str(line):
-                irtam_tov = datetime.strptime(line[19:35], '%Y-%m-%dT%H:%M')
-                break
-           openFile.close()
+        # Call igrf to calculate modip angle
+        # formula is 
+        #   asin{dip/sqrt[dip^2+cos(LATI)]} 
+        #   
+        #  ( from igrf_dip subroutine )
+        # 
+        # The angle only depends on the location and time so it is the same for every coefficient file
+        UT = [date.year, date.month, date.day, date.hour, date.minute] 
+        mag_field = self.ionoPyToCHandle.igrf2016(lat, lon, UT, 0.)
+        dip = numpy.radians( mag_field[7])
+        xmodip = numpy.degrees( numpy.arcsin(dip / numpy.sqrt(dip*dip + numpy.cos(numpy.radians(lat))) ))
+
+        for n, inputFile in enumerate(downloadedFiles):
+
+           (param, irtam_tov) = readCoefficients(inputFile)
    
            irtamInput = self.irtamPyToCHandle.getIrtamInput()
            irtamInput.alati = lat
            irtamInput.along = lon
-
-           # Call igrf to calculate modip angle
-           # formula is 
-           #   asin{dip/sqrt[dip^2+cos(LATI)]} 
-           #   
-           #  ( from igrf_dip subroutine )
-           # 
-  
-           UT = [date.year, date.month, date.day, date.hour, date.minute] 
-           mag_field = self.ionoPyToCHandle.igrf2016(lat, lon, UT, 0.)
-           dip = numpy.radians( mag_field[7])
-           irtamInput.xmodip = numpy.degrees( numpy.arcsin(dip / numpy.sqrt(dip*dip + numpy.cos(numpy.radians(lat))) ))
+           irtamInput.xmodip = xmodip
 
            irtamInput.hourut = date.hour + (date.minute * 60 + date.second ) / 3600
-           irtamInput.param = numpy.zeros(1064)
            irtamInput.param_local  = numpy.zeros(1)
    
-           irtamInput.param = numpy.reshape(datain,1064)
+           irtamInput.param = param
            irtamInput.tov = irtam_tov.hour + (irtam_tov.minute * 60 + irtam_tov.second ) / 3600
            processedData[n] = self.irtamPyToCHandle.processirtam(irtamInput)
 
-           n = n + 1
-  
         return processedData
 
-    def run(self):
-        while self.running:
-            if time.now() - self.lastUpdateTime > self.checkInterval:
-                data = self.fetchData(datetime.now())
-                if data:
-                    self.lastUpdateTime = datetime.now()
-            else:
-                time.sleep(self.checkInterval)
-
     ## Obtain the parameters foF2, hmF2, B0, B1 using the IRTAM model
     #
     #  @param lat    - latitude where the state is desired (degrees)
@@ -142,21 +140,79 @@ class IRTAM(threading.Thread):
     #
     def CalcParameters(self, lat, lon, DT, listOfFiles):
 
+        irtamFiles = self.SelectFiles(listOfFiles)
+
+        # if we have all four coefficient files, query IRTAM for the parameters
+        if len(irtamFiles) == 4:
+            #irtamProcessor = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
+            #data = irtamProcessor.translate(lat, lon, DT, listOfFiles)
+            data = self.translate(lat, lon, DT, irtamFiles)
+            #data = self.irtam.translate(lat, lon, DT, irtamFiles)
+
+            logger.info("IRTAM data: foF2={:.4f} hmF2={:.4f} B0={:.4f} B1={:.4f}". \
+                        format(data[0], data[1], data[2], data[3]))
+            foF2 = data[0]
+            hmF2 = data[1]
+            B0 = data[2]
+            B1 = data[3]
+        else:
+            logger.warning("IRTAM could not find all its files, returning 0")
+            foF2 = 0
+            hmF2 = 0
+            B0   = 0
+            B1   = 0
+
+        return (foF2, hmF2, B0, B1)
+
+    ## Obtain the parameters foF2, hmF2, B0, B1 using the IRTAM model at many locations
+    #
+    #  The coefficient files are selected and parsed once for all the locations.
+    #
+    #  @param lats   - array of latitudes where the state is desired (degrees)
+    #  @param lons   - array of longitudes where the state is desired (degrees)
+    #  @param DT     - python datetime struct specifying when the state is desired
+    #  @param listOfFiles - list of full path to IRTAM coefficient files
+    #
+    #  @retval (foF2, hmF2, B0, B1) - arrays with one value per location
+    #
+    def CalcParametersBatch(self, lats, lons, DT, listOfFiles):
+
+        lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))
+
+        data = numpy.zeros((4, len(lats)))
+
+        irtamFiles = self.SelectFiles(listOfFiles)
+
+        if len(irtamFiles) == 4:
+            for n in range(0, len(lats)):
+                data[:, n] = self.translate(lats[n], lons[n], DT, irtamFiles)
+        else:
+            logger.warning("IRTAM could not find all its files, returning 0")
+
+        return (data[0], data[1], data[2], data[3])
+
+    ## Pick the foF2, hmF2, B0 and B1 coefficient files out of a list of files
+    #
+    #  @param listOfFiles - list of full path to files
+    #
+    #  @retval irtamFiles - list of full path to IRTAM coefficient files
+    #
+    def SelectFiles(self, listOfFiles):
+
         from pathlib import Path
 
         irtamFiles = []
 
-        have_irtam_files = 0
-
         for file in listOfFiles:
             my_file = Path(file)
 
+            fname = my_file.name
+
             if not my_file.is_file():
                 logger.debug('IRTAM file {:s} not found, skipping'.format(fname))
                 continue
 
-            fname = my_file.name
-
             #logger.info("Testing {:s}".format(file))
 
             # check that filename is the right length
@@ -169,51 +225,13 @@ class IRTAM(threading.Thread):
                 logger.debug(" {:s} filename is missing IRTAM prefix, skipping".format(fname))
                 continue
 
-            # test if this is the IRTAM coefficient file for foF2
-            if fname[0:10] == 'IRTAM_foF2':
-                have_irtam_files = have_irtam_files + 1
-                irtamFiles.append(file)
-                logger.info("IRTAM file {:s}".format(file))
-
-            # test if this is the IRTAM coefficient file for hmF2
-            if fname[0:10] == 'IRTAM_hmF2':
-                have_irtam_files = have_irtam_files + 1
+            # test if this is the IRTAM coefficient file for foF2, hmF2, B0 or B1
+            if fname[0:10] == 'IRTAM_foF2' or fname[0:10] == 'IRTAM_hmF2' or \
+               fname[0:8] == 'IRTAM_B0' or fname[0:8] == 'IRTAM_B1':
                 irtamFiles.append(file)
                 logger.info("IRTAM file {:s}".format(file))
 
-            # test if this is the IRTAM coefficient file for B0
-            if fname[0:8] == 'IRTAM_B0':
-                have_irtam_files = have_irtam_files + 1
-                irtamFiles.append(file)
-                logger.info("IRTAM file {:s}".format(file))
-
-            # test if this is the IRTAM coefficient file for B1
-            if fname[0:8] == 'IRTAM_B1':
-                have_irtam_files = have_irtam_files + 1
-                irtamFiles.append(file)
-                logger.info("IRTAM file {:s}".format(file))
-
-        # if we have all four coefficient files, query IRTAM for the parameters
-        if have_irtam_files == 4:
-            #irtamProcessor = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
-            #data = irtamProcessor.translate(lat, lon, DT, listOfFiles)
-            data = self.translate(lat, lon, DT, irtamFiles)
-            #data = self.irtam.translate(lat, lon, DT, irtamFiles)
-
-            logger.info("IRTAM data: foF2={:.4f} hmF2={:.4f} B0={:.4f} B1={:.4f}". \
-                        format(data[0], data[1], data[2], data[3]))
-            foF2 = data[0]
-            hmF2 = data[1]
-            B0 = data[2]
-            B1 = data[3]
-        else:
-            logger.warning("IRTAM could not find all its files, returning 0".format(fname))
-            foF2 = 0
-            hmF2 = 0
-            B0   = 0
-            B1   = 0
-
-        return (foF2, hmF2, B0, B1)
+        return irtamFiles
 
 class UnitTest_IRTAM(unittest.TestCase):
 
@@ -20,9 +20,11 @@
 
 from datetime import timedelta
 from datetime import datetime
-from copy import copy
+from copy import copy, deepcopy
 import os
+import zlib
 import unittest
+import numpy
 from numpy import median
 from numpy import mean
 from numpy import asscalar
@@ -30,6 +32,8 @@ from numpy import array
 from scipy.interpolate import griddata
 from Shared.IonoPyIface.Pharlap import Pharlap
 import Shared.Utils.HfgeoLogger as Logger
+from Shared.Utils.Timing import timed
+from Shared.Utils.Cache import LRUCache
 from IonoModelEngine.DataControl.Stations import getStationLatLon
 
 from IonoModelEngine.IRTAM import IRTAM
@@ -40,6 +44,29 @@ logger = Logger.getLogger()
 ## @package IonoModelEngine.RIPE
 # Python implementation of the Robust Initial Profile Estimator (RIPE)
 
+## Station ratios already computed, see RIPE.GetRIPE5sfs
+sfsCache = LRUCache(16)
+
+## Key of the station ratios of a target time
+#
+#  The NOAA data manager rewrites the station files on every request, so the files are
+#  identified by their content rather than their modification time.
+#
+#  @param TargetTime - the time of interest (a python datetime structure)
+#  @param listOfFiles - a list of full paths to the RIPE input files for all stations
+#
+#  @retval key - tuple, equal for equal inputs
+#
+def sfsKey(TargetTime, listOfFiles):
+    signatures = []
+    for fname in listOfFiles:
+        try:
+            with open(fname, 'rb') as fd:
+                signatures.append((fname, zlib.crc32(fd.read())))
+        except IOError:
+            signatures.append((fname, None))
+    return (TargetTime, tuple(signatures))
+
 class RIPE:
     ## Constructor requests the python interface
     #
@@ -63,6 +90,23 @@ class RIPE:
         else:
             self.interpolatingModel = interpolatingModel
 
+    ## Same as ReadRIPE5sfs, the ratios are only computed once for a target time and its input files
+    #
+    #  All the locations of a request, and the requests for the same epoch, share the
+    #  same station ratios, so the station files are parsed and the interpolating model is
+    #  evaluated at the stations once.
+    #
+    @timed('ripe.sfs')
+    def GetRIPE5sfs(self, TargetTime, listOfFiles):
+
+        key = sfsKey(TargetTime, listOfFiles) + (self.refreshIRI, self.interpolatingModel)
+        ratios = sfsCache.get(key)
+        if ratios is None:
+            ratios = self.ReadRIPE5sfs(TargetTime, listOfFiles)
+            sfsCache.put(key, ratios)
+        # The callers shift the longitudes in place
+        return deepcopy(ratios)
+
     ## Calculates RIPE5 scale factors from all sounders for a given target time
     #
     #  @param TargetTime - the time of interest (a python datetime structure)
@@ -84,7 +128,7 @@ class RIPE:
     #    2018/02/05 - read input files in same format as the Matlab version of RIPE
     #    2018/10/31 - added foEs, hmEs. fixed nan handling 
 
-    def GetRIPE5sfs(self, TargetTime, listOfFiles):
+    def ReadRIPE5sfs(self, TargetTime, listOfFiles):
 
         logger.info("RIPE TargetTime {:4d}-{:2d}-{:2d} {:2d}:{:2d}:{:2d}".\
                     format(TargetTime.year,TargetTime.month,TargetTime.day,
@@ -318,9 +362,10 @@ class RIPE:
            hmEs_median_value = -1
 
         # write the median info this station to logger
-        logger.info("Median ratios for {:s} {:8.1f} {:8.1f} {:8.4f} {:8.4f} {:8.4f} {:8.4f}".\
-                   format(stationName, stationLat, stationLon, \
-                          fof2_rats_median[-1],hmf2_rats_median[-1],b0_rats_median[-1],b1_rats_median[-1]))
+        if len(fof2_rats_median):
+            logger.info("Median ratios for {:s} {:8.1f} {:8.1f} {:8.4f} {:8.4f} {:8.4f} {:8.4f}".\
+                       format(stationName, stationLat, stationLon, \
+                              fof2_rats_median[-1],hmf2_rats_median[-1],b0_rats_median[-1],b1_rats_median[-1]))
 
         
         return (stlats_median, stlons_median, fof2_rats_median, hmf2_rats_median, b0_rats_median, b1_rats_median,\
@@ -444,6 +489,77 @@ class RIPE:
 
         return(value)
 
+    ## Interpolate a value to many target locations given its values at the stations
+    #
+    #  Same as InterpRIPE5 but the triangulation of the stations is done once for all the
+    #  targets. Like InterpRIPE5, Lons is shifted in place when the stations straddle the
+    #  prime meridian so that consecutive calls give the same answers as the scalar version.
+    #
+    #  @param Lats   - list of station latitudes (deg)
+    #  @param Lons   - list of station longitudes (deg)
+    #  @param Values - list of station values (some quantity that we wished to interpolate)
+    #  @param TLats  - array of target latitudes (deg)
+    #  @param TLons  - array of target longitudes (deg)
+    #
+    #  @retval values - array of the values interpolated to the target lats and lons
+    #
+    def InterpRIPE5Batch(self, Lats, Lons, Values, TLats, TLonsIn):
+
+        TLats = numpy.atleast_1d(numpy.asarray(TLats, dtype=float))
+
+        # keep the longitude positive for now
+        #
+        TLons = numpy.atleast_1d(numpy.array(TLonsIn, dtype=float))
+        TLons[TLons < 0.0] += 360.0
+
+        nin=len(Lats)
+
+        # send back ones if there are no valid ratios
+        #
+        if nin == 0:
+          return numpy.ones(len(TLats))
+
+        # and send back the single value if there's only one ratio
+        #
+        if nin == 1:
+          return numpy.full(len(TLats), float(Values[0]))
+
+        # take an average for outside the grid
+        #
+        ValAve=sum(Values)/float(nin)
+
+        Lats1=copy(Lats)
+        Lons1=copy(Lons)
+        Vals1=copy(Values)
+
+        # stations on both sides of the prime meridian, see InterpRIPE5
+        #
+        LonDel=max(Lons1)-min(Lons1)
+
+        if LonDel > 180.0:
+            for i in range(0,nin):
+                if Lons[i] > 180.0:
+                    Lons[i]=Lons[i]-360.0
+
+        # modulate the target longitudes to the hemisphere of the stations
+        #
+        MidLon=sum(Lons1)/float(nin)
+
+        TLons[TLons-MidLon > 180.0] -= 360.0
+        TLons[MidLon-TLons > 180.0] += 360.0
+
+        # the corners of the theater get the average value
+        #
+        Lats1.extend([min(Lats1)-45.0, min(Lats1)-45.0, max(Lats1)+45.0, max(Lats1)+45.0])
+        Lons1.extend([min(Lons1)-90.0, max(Lons1)+90.0, max(Lons1)+90.0, min(Lons1)-90.0])
+        Vals1.extend([ValAve, ValAve, ValAve, ValAve])
+
+        # interpolate to all the locations
+        #
+        values=griddata((Lats1,Lons1),Vals1,(TLats,TLons),fill_value=ValAve,method='linear')
+
+        return numpy.asarray(values, dtype=float)
+
     ## Call InterpRIPE5 to interpolate the four scale factors
     #
     #  @param Tlat - target latitude where RIPE ratios are desired (deg)
@@ -455,6 +571,7 @@ class RIPE:
     #  @param b0_rats - list of sounder B0 / IRI B0 values
     #  @param b1_rats - list of sounder B1 / IRI B1 values
     #
+    @timed('ripe.interp')
     def InterpRIPE5sfs(self, TLat, TLonIn, lats, lons, fof2_rats, hmf2_rats, b0_rats, b1_rats):
 
         # keep the input longitude on [0,360]
@@ -476,6 +593,35 @@ class RIPE:
 
         return (fof2_rat,hmf2_rat,b0_rat,b1_rat)
 
+    ## Call InterpRIPE5Batch to interpolate the four scale factors to many locations
+    #
+    #  @param TLats - array of target latitudes where RIPE ratios are desired (deg)
+    #  @param TLons - array of target longitudes where RIPE ratios are desired (deg)
+    #  @param lats - list of station latitudes (deg)
+    #  @param lons - list of station longitudes (deg)
+    #  @param fof2_rats - list of sounder foF2 / IRI foF2 values
+    #  @param hmf2_rats - list of sounder hmF2 / IRI hmF2 values
+    #  @param b0_rats - list of sounder B0 / IRI B0 values
+    #  @param b1_rats - list of sounder B1 / IRI B1 values
+    #
+    #  @retval (fof2_rat, hmf2_rat, b0_rat, b1_rat) - arrays with one ratio per location
+    #
+    @timed('ripe.interp')
+    def InterpRIPE5sfsBatch(self, TLats, TLons, lats, lons, fof2_rats, hmf2_rats, b0_rats, b1_rats):
+
+        fof2_rat = self.InterpRIPE5Batch(lats,lons,fof2_rats,TLats,TLons)
+
+        hmf2_rat = self.InterpRIPE5Batch(lats,lons,hmf2_rats,TLats,TLons)
+
+        b0_rat   = self.InterpRIPE5Batch(lats,lons,b0_rats,TLats,TLons)
+
+        b1_rat   = self.InterpRIPE5Batch(lats,lons,b1_rats,TLats,TLons)
+
+        if numpy.all(fof2_rat==1) and numpy.all(hmf2_rat==1) and numpy.all(b0_rat==1) and numpy.all(b1_rat==1):
+            logger.warning("All ratios are unity, result will be IRI")
+
+        return (fof2_rat,hmf2_rat,b0_rat,b1_rat)
+
     ## Obtain the parameters foF2, hmF2, B0, B1 using the RIPE model
     #
     #  @param lat    - latitude where the state is desired (degrees)
@@ -536,6 +682,99 @@ class RIPE:
 
         return (foF2, hmF2, B0, B1, foEs, hmEs)
 
+    ## Obtain the parameters foF2, hmF2, B0, B1 using the RIPE model at many locations
+    #
+    #  The station files are parsed once and the station ratios are interpolated to all the
+    #  locations at once, so this is much cheaper than calling CalcParameters for each location.
+    #
+    #  @param lats   - array of latitudes where the state is desired (degrees)
+    #  @param lons   - array of longitudes where the state is desired (degrees)
+    #  @param DT     - python datetime struct specifying when the state is desired
+    #  @param listOfFiles - list of full path to station files
+    #  @param backgroundParameters (optional) - (foF2, hmF2, B0, B1) arrays of the interpolating
+    #                                           model at the locations, if the caller already has them
+    #
+    #  @retval (foF2, hmF2, B0, B1, foEs, hmEs) - arrays with one value per location, foEs and hmEs are scalars
+    #
+    def CalcParametersBatch(self, lats, lons, DT, listOfFiles, backgroundParameters=None):
+
+        lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))
+
+        if backgroundParameters is not None:
+
+            (foF2, hmF2, B0, B1) = [numpy.array(x, dtype=float) for x in backgroundParameters]
+
+        elif self.interpolatingModel == 0:
+
+            UT = array([DT.year, DT.month, DT.day, DT.hour, DT.minute])
+
+            R12 = -1 # a placeholder for now (consider passing this as input?)
+
+            layer_parameters = numpy.zeros((len(lats), 7))
+            for n in range(0, len(lats)):
+                (iono_pf, iono_extra) = self.pharlapHandle.iri2016(lats[n], lons[n], R12, UT)
+                layer_parameters[n] = self.pharlapHandle.iono_extra_to_layer_parameters(iono_extra)
+
+            foF2 = layer_parameters[:, 0]
+            hmF2 = layer_parameters[:, 1]
+            B0   = layer_parameters[:, 5]
+            B1   = layer_parameters[:, 6]
+
+        else:
+
+            # Get the interface to IRTAM
+            irtam = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
+
+            # Calculate IRTAM parameters
+            (foF2, hmF2, B0, B1) = irtam.CalcParametersBatch(lats, lons, DT, listOfFiles)
+
+        (ripe_scale_factors, foEs, hmEs) = self.CalcScaleFactorsBatch(lats, lons, DT, listOfFiles)
+
+        if ripe_scale_factors is None:
+            return (foF2, hmF2, B0, B1, foEs, hmEs)
+
+        # adjust bottomside  parameters for consistency with sounder data
+        foF2 = foF2 * ripe_scale_factors[0]
+        hmF2 = hmF2 * ripe_scale_factors[1]
+        B0   = B0   * ripe_scale_factors[2]
+        B1   = B1   * ripe_scale_factors[3]
+
+        return (foF2, hmF2, B0, B1, foEs, hmEs)
+
+    ## Interpolate the RIPE scale factors of the stations to many locations
+    #
+    #  The scale factors only depend on the station files, not on the interpolating model
+    #  values at the locations, so the caller can apply them to any background.
+    #
+    #  @param lats   - array of latitudes where the scale factors are desired (degrees)
+    #  @param lons   - array of longitudes where the scale factors are desired (degrees)
+    #  @param DT     - python datetime struct specifying when the scale factors are desired
+    #  @param listOfFiles - list of full path to station files
+    #
+    #  @retval (scaleFactors, foEs, hmEs) - scaleFactors is (fof2_rat, hmf2_rat, b0_rat, b1_rat), arrays
+    #          with one ratio per location, or None if no station has ratios. foEs and hmEs are scalars
+    #
+    def CalcScaleFactorsBatch(self, lats, lons, DT, listOfFiles):
+
+        lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))
+
+        (lat_all, lon_all, \
+        foF2_ratio_all, hmF2_ratio_all, \
+        B0_ratio_all, B1_ratio_all, foEs, hmEs) = self.GetRIPE5sfs(DT, listOfFiles)
+
+        nratios = len(foF2_ratio_all)
+        if nratios == 0:
+            logger.warning('No ratios found, returning parameters from the interpolating model')
+            return (None, foEs, hmEs)
+
+        ripe_scale_factors = self.InterpRIPE5sfsBatch(lats, lons, lat_all, lon_all, \
+                                                      foF2_ratio_all, hmF2_ratio_all, \
+                                                      B0_ratio_all, B1_ratio_all)
+
+        return (ripe_scale_factors, foEs, hmEs)
+
 class UnitTest_RIPE(unittest.TestCase):
 
     def setUp(self):
@@ -735,6 +974,28 @@ class UnitTest_RIPE(unittest.TestCase):
         #assert_approx_equal(B0,    56.4682, significant=1)
         #assert_approx_equal(B1,     2.1456, significant=2)
 
+    ##   Test that the ratios of an epoch are only computed once
+    #
+    def test_GetRIPE5sfsCached(self):
+        logger.info("test_GetRIPE5sfsCached")
+
+        TargetTime = datetime(2015, 10, 20, 0, 0, 0)
+
+        directory = os.path.dirname(os.path.realpath(__file__)) + "/"
+
+        listOfFiles = [directory + '/TestFiles/AU930_NOAA.TXT', \
+                       directory + '/TestFiles/BC840_NOAA.TXT', \
+                       directory + '/TestFiles/EG931_NOAA.TXT']
+
+        sfsCache.clear()
+        hits = sfsCache.stats()['hits']
+        first = self.ripe.GetRIPE5sfs(TargetTime, listOfFiles)
+        # The callers modify the lists they get
+        first[1][0] = 1000.0
+        second = self.ripe.GetRIPE5sfs(TargetTime, listOfFiles)
+        self.assertEqual(second, self.ripe.ReadRIPE5sfs(TargetTime, listOfFiles))
+        self.assertEqual(sfsCache.stats()['hits'], hits + 1)
+
 if __name__ == "__main__":
     logger.setLevel('INFO')
     unittest.main()
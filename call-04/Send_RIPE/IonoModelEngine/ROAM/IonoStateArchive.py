@@ -0,0 +1,300 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+
+import os
+import unittest
+import numpy
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package IonoModelEngine.ROAM.IonoStateArchive
+#  Binary archive of ionoStates, the columns of the ROAM_ionoState.txt files as fixed size records
+#
+#  An archive is a fixed size header followed by one record per row. The UT is kept as integers and
+#  the 19 values as integers in units of the 4th decimal, which is the precision of the text files, so
+#  reading an archive gives the same numbers as reading the text file it was converted from, and a
+#  converted file converts back to the same text. Records are only ever appended, an archive is read
+#  by mapping the file.
+
+## Header line of the ionoState text files
+ionoStateHeader = "YEAR MON DAY  HR MIN       foF2      hmF2      foF1       foE        " + \
+                  "B0        B1   gradLat   gradLon         a         C    lambda     gamma     "  + \
+                  "omega       psi       Vh       Vaz   Ref_lat   Ref_lon    AoAErr\n"
+## Format of one row of an ionoState text file
+ionoStateRowFormat = "%04d  %02d  %02d  %02d  %02d " + "%10.4f" * 19
+## Names of the columns
+ionoStateNames = ionoStateHeader.split()
+
+## Columns of one row of an ionoState file
+#
+#  @param replyState - the 11 parameter ionoState returned by Manager.queryIonoState
+#  @param date       - python datetime of the state
+#  @param lat        - latitude of the state (degrees)
+#  @param lon        - longitude of the state (degrees)
+#
+#  @retval row - list of the 24 numbers of the row
+#
+def ionoStateRow(replyState, date, lat, lon):
+    row = [date.year, date.month, date.day, date.hour, date.minute]
+    for n in range(0, 11):
+        if n == 4 or n == 7 or n == 8:
+            continue
+        row.append(replyState[n])
+
+    row += [0] * 8
+    row += [lat, lon, 0]
+    return row
+
+## Marks the files written by ArchiveWriter, with the version of the layout
+archiveMagic = b'IONOARC1'
+## Bytes of the header, the records start at this offset
+archiveHeaderBytes = 256
+## Values are stored as round(value * archiveScale)
+archiveScale = 10000
+## Stored for NaN
+archiveNaN = numpy.iinfo(numpy.int32).min
+## Stored for -0.0, printed as -0.0000 in the text files
+archiveNegativeZero = archiveNaN + 1
+## Layout of the header: magic, scale of the values, number of values and size of a record, column names
+archiveHeaderDtype = numpy.dtype([('magic', 'S8'), ('scale', '<i4'), ('numValues', '<i4'), ('recordBytes', '<i4'),
+                                  ('names', 'S232'), ('pad', 'V4')])
+## Layout of a record: UT [year month day hour minute] and the values of the other columns
+archiveRecordDtype = numpy.dtype([('UT', '<i2', (5,)), ('values', '<i4', (len(ionoStateNames) - 5,))])
+
+## Whether a file is an archive rather than a text file
+#
+def isArchive(fname):
+    with open(fname, 'rb') as f:
+        return f.read(len(archiveMagic)) == archiveMagic
+
+## Check the header of an archive
+#
+#  @param header - bytes at the start of the file
+#
+def checkHeader(header, fname):
+    header = numpy.frombuffer(header, dtype=archiveHeaderDtype, count=1) if len(header) >= archiveHeaderBytes else []
+    if len(header) != 1 or header['magic'][0] != archiveMagic:
+        raise ValueError('{} is not an ionoState archive'.format(fname))
+    if header['scale'][0] != archiveScale or header['numValues'][0] != archiveRecordDtype['values'].shape[0] or \
+       header['recordBytes'][0] != archiveRecordDtype.itemsize:
+        raise ValueError('{} is an ionoState archive of another layout'.format(fname))
+
+## Records of an archive memory-mapped read only
+#
+#  A record left partially written at the end of the file is not returned.
+#
+#  @param fname - file written by ArchiveWriter
+#
+#  @retval numpy.memmap of archiveRecordDtype records, an empty array for an archive without records
+#
+def loadArchive(fname):
+    with open(fname, 'rb') as f:
+        checkHeader(f.read(archiveHeaderBytes), fname)
+    numRecords = (os.path.getsize(fname) - archiveHeaderBytes) // archiveRecordDtype.itemsize
+    if numRecords == 0:
+        return numpy.zeros(0, dtype=archiveRecordDtype)
+    return numpy.memmap(fname, dtype=archiveRecordDtype, mode='r', offset=archiveHeaderBytes, shape=(numRecords,))
+
+## Rows of records, as numpy.loadtxt returns them from the text file
+#
+#  @param records - array of archiveRecordDtype records
+#
+#  @retval (N, 24) array
+#
+def recordsToRows(records):
+    rows = numpy.empty((len(records), len(ionoStateNames)))
+    rows[:, 0:5] = records['UT']
+    values = records['values']
+    # An integer divided by the scale is the double nearest to the decimal of the text file
+    rows[:, 5:] = values / archiveScale
+    rows[:, 5:][values == archiveNaN] = numpy.nan
+    rows[:, 5:][values == archiveNegativeZero] = -0.0
+    return rows
+
+## Records of rows, the values rounded to the 4th decimal
+#
+#  @param rows - (N, 24) array, the UT in the first 5 columns
+#
+#  @retval array of archiveRecordDtype records
+#
+def rowsToRecords(rows):
+    rows = numpy.asarray(rows, dtype=float).reshape(-1, len(ionoStateNames))
+    records = numpy.zeros(len(rows), dtype=archiveRecordDtype)
+    records['UT'] = rows[:, 0:5]
+    values = numpy.rint(rows[:, 5:] * archiveScale)
+    nan = numpy.isnan(values)
+    if numpy.any(numpy.abs(values[~nan]) > numpy.iinfo(numpy.int32).max - 2):
+        raise ValueError('ionoState values out of the range of an archive')
+    negativeZero = (values == 0) & numpy.signbit(values)
+    values[nan] = archiveNaN
+    values[negativeZero] = archiveNegativeZero
+    records['values'] = values
+    return records
+
+## Rows of an archive
+#
+#  @param fname - file written by ArchiveWriter
+#
+#  @retval (N, 24) array
+#
+def readArchive(fname):
+    return recordsToRows(loadArchive(fname))
+
+## Appends records to an archive, the file is opened once for all the rows
+#
+class ArchiveWriter:
+
+    ## Constructor, opens the archive for appending and writes the header if the file is new
+    #
+    #  A record left partially written at the end of an existing archive is dropped.
+    #
+    #  @param fname      - the archive
+    #  @param bufferSize - size in bytes of the write buffer
+    #
+    def __init__(self, fname, bufferSize=1024*1024):
+        if os.path.exists(fname) and os.path.getsize(fname) > 0:
+            with open(fname, 'r+b') as f:
+                checkHeader(f.read(archiveHeaderBytes), fname)
+                numRecords = (os.path.getsize(fname) - archiveHeaderBytes) // archiveRecordDtype.itemsize
+                f.truncate(archiveHeaderBytes + numRecords * archiveRecordDtype.itemsize)
+            self.outFile = open(fname, 'ab', buffering=bufferSize)
+        else:
+            header = numpy.zeros(1, dtype=archiveHeaderDtype)
+            header['magic'] = archiveMagic
+            header['scale'] = archiveScale
+            header['numValues'] = archiveRecordDtype['values'].shape[0]
+            header['recordBytes'] = archiveRecordDtype.itemsize
+            header['names'] = ' '.join(ionoStateNames).encode()
+            self.outFile = open(fname, 'ab', buffering=bufferSize)
+            self.outFile.write(header.tobytes())
+            # Readers can open the archive before the first rows are flushed
+            self.outFile.flush()
+
+    ## Append rows
+    #
+    #  @param rows - (N, 24) array, or one row of 24 values
+    #
+    def writeRows(self, rows):
+        self.outFile.write(rowsToRecords(rows).tobytes())
+
+    ## Flush the buffer and close the file
+    #
+    def close(self):
+        self.outFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+## Convert a text file to an archive, the archive is replaced atomically
+#
+#  @param textName    - ROAM_ionoState.txt file
+#  @param archiveName - the archive written
+#
+#  @retval number of rows
+#
+def textToArchive(textName, archiveName):
+    rows = numpy.loadtxt(textName, skiprows=1, ndmin=2)
+    tmpName = '{}.{:d}.tmp'.format(archiveName, os.getpid())
+    with ArchiveWriter(tmpName) as writer:
+        writer.writeRows(rows)
+    os.replace(tmpName, archiveName)
+    logger.debug('Converted {:d} rows of {} to {}'.format(len(rows), textName, archiveName))
+    return len(rows)
+
+## Convert an archive to a text file in the format of ROAM_ionoState.txt
+#
+#  @param archiveName - file written by ArchiveWriter
+#  @param textName    - the text file written
+#
+#  @retval number of rows
+#
+def archiveToText(archiveName, textName):
+    rows = readArchive(archiveName)
+    numpy.savetxt(textName, rows, fmt=ionoStateRowFormat, header=ionoStateHeader.rstrip('\n'), comments='')
+    logger.debug('Converted {:d} rows of {} to {}'.format(len(rows), archiveName, textName))
+    return len(rows)
+
+class UnitTest_IonoStateArchive(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        dataDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'UnitTestData')
+        self.fnames = [os.path.join(dataDir, testDir, name)
+                       for testDir in ['output_test1_itp1_20160620', 'output_test1_itp4_20160620']
+                       for name in ['ROAM_IonoState.txt', 'ROAM_IonoState_Es.txt']]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_convert(self):
+        from numpy.testing import assert_array_equal
+        archiveName = os.path.join(self.directory.name, 'ionoState.arc')
+        textName = os.path.join(self.directory.name, 'ionoState.txt')
+        for fname in self.fnames:
+            numRows = textToArchive(fname, archiveName)
+            self.assertTrue(isArchive(archiveName))
+            self.assertFalse(isArchive(fname))
+            # The same numbers as the text file, and back to the same text
+            assert_array_equal(readArchive(archiveName), numpy.loadtxt(fname, skiprows=1))
+            self.assertEqual(archiveToText(archiveName, textName), numRows)
+            with open(fname) as original, open(textName) as converted:
+                self.assertEqual(converted.read(), original.read())
+            self.assertLess(os.path.getsize(archiveName), 0.5 * os.path.getsize(fname))
+
+    def test_append(self):
+        from numpy.testing import assert_array_equal
+        archiveName = os.path.join(self.directory.name, 'ionoState.arc')
+        rows = numpy.loadtxt(self.fnames[0], skiprows=1)
+        with ArchiveWriter(archiveName) as writer:
+            self.assertEqual(len(readArchive(archiveName)), 0)
+            writer.writeRows(rows[0:10])
+        # An interrupted write leaves part of a record
+        with open(archiveName, 'ab') as f:
+            f.write(rowsToRecords(rows[10]).tobytes()[0:30])
+        assert_array_equal(readArchive(archiveName), rows[0:10])
+        with ArchiveWriter(archiveName) as writer:
+            for row in rows[10:]:
+                writer.writeRows(row)
+        assert_array_equal(readArchive(archiveName), rows)
+        self.assertIsInstance(loadArchive(archiveName), numpy.memmap)
+
+    def test_values(self):
+        rows = numpy.zeros((1, len(ionoStateNames)))
+        rows[0, 0:5] = [2016, 6, 20, 4, 45]
+        rows[0, 5:9] = [numpy.nan, -0.0, 123.45678, -1.0]
+        converted = recordsToRows(rowsToRecords(rows))
+        self.assertTrue(numpy.isnan(converted[0, 5]))
+        self.assertTrue(numpy.signbit(converted[0, 6]))
+        self.assertEqual(list(converted[0, 7:9]), [123.4568, -1.0])
+        rows[0, 9] = 1.e6
+        with self.assertRaises(ValueError):
+            rowsToRecords(rows)
+        with self.assertRaises(ValueError):
+            loadArchive(self.fnames[0])
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
@@ -0,0 +1,160 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import os
+import unittest
+import numpy
+import Shared.Utils.HfgeoLogger as Logger
+from Shared.Utils.Cache import LRUCache
+from IonoModelEngine.ROAM.IonoStateArchive import isArchive, readArchive
+
+logger = Logger.getLogger()
+
+## @package IonoModelEngine.ROAM.IonoStateTable
+#  ROAM_ionoState.txt files parsed once and interpolated in time
+#
+#  Geolocation queries the same ionoState file over and over. The file is parsed once into a
+#  table of its columns, kept until the modification time or the size of the file changes, and
+#  every column is interpolated at once. Text files and their binary archives, see IonoStateArchive,
+#  are read alike.
+
+## Columns of a ROAM_ionoState.txt file
+ionoStateColumns = slice(5, 13)  # 8 element ionoState, slice(5, 19) for the 14 element ionoState
+VhColumn = 19
+VazColumn = 20
+RefLatColumn = 21
+RefLonColumn = 22
+AoAErrColumn = 23
+
+## Tables of the files read last, keyed by file name, see readTable
+tableCache = LRUCache(8)
+
+## The table of a file, parsed again only if the file changed since it was last read
+#
+#  @param fname - ROAM_ionoState.txt file
+#
+#  @retval table - IonoStateTable
+#
+def readTable(fname):
+    stat = os.stat(fname)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = tableCache.get(fname)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    table = IonoStateTable.fromFile(fname)
+    tableCache.put(fname, (version, table))
+    logger.debug('Read {:d} rows of {}'.format(len(table.uth), fname))
+    return table
+
+## Rows of a ROAM_ionoState.txt file ordered by UT hour
+#
+class IonoStateTable:
+
+    ## Constructor
+    #
+    #  @param data - (N, M) array of the rows of the file, the UT in the first 5 columns
+    #
+    def __init__(self, data):
+        data = numpy.asarray(data, dtype=float)
+        uth = data[:, 3] + data[:, 4] / 60
+        order = numpy.argsort(uth, kind='stable')
+        self.uth = uth[order]
+        self.data = data[order]
+        self.uth.setflags(write=False)
+        self.data.setflags(write=False)
+
+    ## Table of a text file, skipping its header line, or of an archive
+    #
+    @classmethod
+    def fromFile(cls, fname):
+        if isArchive(fname):
+            return cls(readArchive(fname))
+        return cls(numpy.loadtxt(fname, skiprows=1, ndmin=2))
+
+    ## Every column linearly interpolated in UT hour
+    #
+    #  Times before the first row or after the last row get the first or the last row.
+    #
+    #  @param uth - UT hour, or array of UT hours
+    #
+    #  @retval (M,) row, or (len(uth), M) rows
+    #
+    def at(self, uth):
+        times = numpy.atleast_1d(numpy.asarray(uth, dtype=float))
+        if len(self.uth) == 1:
+            rows = numpy.repeat(self.data, len(times), axis=0)
+        else:
+            lower = numpy.clip(numpy.searchsorted(self.uth, times, side='right') - 1, 0, len(self.uth) - 2)
+            span = self.uth[lower + 1] - self.uth[lower]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                weight = numpy.clip(numpy.where(span > 0, (times - self.uth[lower]) / span, 1.0), 0.0, 1.0)
+            rows = self.data[lower] * (1 - weight)[:, None] + self.data[lower + 1] * weight[:, None]
+        return rows if numpy.ndim(uth) else rows[0]
+
+class UnitTest_IonoStateTable(unittest.TestCase):
+
+    def setUp(self):
+        self.fname = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                  'UnitTestData/output_test1_itp1_20160620/ROAM_IonoState.txt')
+
+    def test_at(self):
+        from scipy import interpolate
+        from numpy.testing import assert_allclose
+        table = readTable(self.fname)
+        data = numpy.loadtxt(self.fname, skiprows=1)
+        uth = data[:, 3] + data[:, 4] / 60
+        times = numpy.linspace(uth[0], uth[-1], 17)
+        assert_allclose(table.at(times), interpolate.interp1d(uth, data, axis=0)(times), rtol=1e-12, atol=1e-12)
+        assert_allclose(table.at(times[3]), table.at(times)[3])
+        # Persistence outside of the file
+        assert_allclose(table.at([uth[0] - 1, uth[-1] + 1]), data[[0, -1]])
+
+    def test_readTable(self):
+        import tempfile
+        import shutil
+        self.assertIs(readTable(self.fname), readTable(self.fname))
+        with tempfile.TemporaryDirectory() as directory:
+            fname = os.path.join(directory, 'ROAM_IonoState.txt')
+            shutil.copy(self.fname, fname)
+            table = readTable(fname)
+            # Rewritten with one row, the table follows the file
+            with open(self.fname) as f:
+                lines = f.readlines()
+            with open(fname, 'w') as f:
+                f.writelines(lines[0:2])
+            single = readTable(fname)
+            self.assertIsNot(single, table)
+            self.assertEqual(single.data.shape, (1, 24))
+            self.assertEqual(single.at(12.0)[5], table.data[0, 5])
+
+    def test_archive(self):
+        import tempfile
+        from numpy.testing import assert_array_equal
+        from IonoModelEngine.ROAM.IonoStateArchive import textToArchive
+        with tempfile.TemporaryDirectory() as directory:
+            archiveName = os.path.join(directory, 'ROAM_IonoState.arc')
+            textToArchive(self.fname, archiveName)
+            table = readTable(self.fname)
+            assert_array_equal(readTable(archiveName).data, table.data)
+            assert_array_equal(readTable(archiveName).at(table.uth + 0.01), table.at(table.uth + 0.01))
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
@@ -21,17 +21,25 @@
 import os
 import numpy
 import unittest
-from scipy import interpolate
-from datetime import datetime
+from datetime import datetime, timedelta
 import Shared.Utils.Constants as Constants
 from Shared.IonoPyIface.Pharlap import Pharlap
-from IonoModelEngine.RIPE.RIPE import RIPE
+from IonoModelEngine.RIPE.RIPE import RIPE, sfsKey
+from IonoModelEngine.ROAM.TiltField import TiltField, latticeAxes, stencilStep
+from IonoModelEngine.ROAM.IonoStateTable import readTable, ionoStateColumns, VhColumn, VazColumn, RefLatColumn, \
+    RefLonColumn, AoAErrColumn
 from IonoModelEngine.IRTAM import IRTAM
 from IonoModelEngine.IRTAM.IrtamPyIface import IrtamPyIface
 from Shared.Utils.Geodesy import greatCircleBearingAndDistance
 #import matplotlib.pyplot as plt
 import Shared.Utils.HfgeoLogger as Logger
-from Shared.GridGeneration import pfProfileToEnGrid
+from Shared.GridGeneration.SeparableEnGrid import SeparableEnGrid
+from Shared.GridGeneration.GridStore import GridStore, stateHash
+from Shared.GridGeneration import pfToEn
+from Shared.Utils.Timing import stage, timed
+from Shared.Utils.Cache import LRUCache
+from Shared.Utils.SingleFlight import SingleFlight
+from Shared.Utils.DateTime import floorDateTime
 #import IonoModelEngine.DataControl.Stations
 #from IonoModelEngine.DataControl.Stations import Station
 
@@ -41,6 +49,23 @@ logger.setLevel('INFO')
 ## @package IonoModelEngine.ROAM
 # Python implementation of the Regional Optimium Ionospheric Model (ROAM)
 
+## Models evaluated by ROAM.CalcIonoStateEnsemble unless told otherwise
+ensembleModels = ['iri', 'irtam', 'ripe', 'ripe-irtam']
+
+## Latitude / longitude spacing for nodes of central difference approximation,
+#  the last node is the location itself
+stencilLat = stencilStep * numpy.array([1, 0, -1, 0, 0])
+stencilLon = stencilStep * numpy.array([0, 1, 0, -1, 0])
+
+## Profiles already computed by ROAM.IonoStateToGrid, see ROAM.IRIProfile
+profileCache = LRUCache(64)
+
+## Heights interpolated at a time by ROAM.IonoStatesToColumnGrid
+columnHeightBlock = 32
+
+## Spacing (degrees) of the column lattice of ROAM.IonoStatesToColumnGrid when columnSpacing is not configured
+defaultColumnSpacing = 2.0
+
 # This class contains an instance of the Pharlap interface
 
 class ROAM:
@@ -82,6 +107,21 @@ class ROAM:
         else:
             logger.info("ROAM will use IRI as the background model")
 
+        # RIPE of each RIPE model, the one of the configured model and the others created when needed, see GetRIPE
+        self.ripes = {}
+        if self.config.backgroundModel in ['ripe', 'ripe-irtam']:
+            self.ripes[self.config.backgroundModel] = self.ripe
+
+        # Regional foF2 fields of the last epochs, only if configured, see GetTiltField
+        self.tiltFieldConfig = getattr(self.config, 'tiltFieldConfig', None)
+        if self.tiltFieldConfig:
+            self.tiltFields = LRUCache(self.tiltFieldConfig.maxEpochs)
+            self.tiltFieldFlight = SingleFlight()
+
+        # Electron density grids kept on disk, only if configured, see genElectronDensityGridROAM
+        gridStoreConfig = getattr(self.config, 'gridStoreConfig', None)
+        self.gridStore = GridStore(gridStoreConfig.directory, gridStoreConfig.dtype) if gridStoreConfig else None
+
     ## Obtain the ionospheric state from the ROAM model
     #
     #  @param   lat    - latitude where the state is desired (degrees)
@@ -92,191 +132,436 @@ class ROAM:
     #
     def CalcIonoState(self, lat, lon, DT, listOfFiles):
 
+        # The location and the nodes of its tilt stencil are evaluated together, so the
+        # RIPE station ratios and the IRTAM coefficients are only read once
+        IonoState = self.CalcIonoStateBatch([lat], [lon], DT, listOfFiles)[0]
+
+        logger.debug(
+            "ionoState: foF2={:.4f} hmF2={:.4f} foF1={:.4f} foE={:.4f} hmE={:.4f}, B0={:.4f} B1={:.4f},foEs={:.4f} hmEs={:.4f}, beta_lat={:.4f}  beta_lon={:.4f}". \
+                format(IonoState[0], IonoState[1], IonoState[2], IonoState[3], IonoState[4], IonoState[5], \
+                       IonoState[6], IonoState[7], IonoState[8], IonoState[9], IonoState[10]))
+        return IonoState
+
+    ## The RIPE evaluating a RIPE model, with the same settings as a ROAM configured with that model
+    #
+    #  @param backgroundModel - 'ripe' or 'ripe-irtam'
+    #
+    def GetRIPE(self, backgroundModel):
+
+        ripe = self.ripes.get(backgroundModel)
+        if ripe is None:
+            if backgroundModel == 'ripe':
+                ripe = RIPE(pharlapHandle=self.pharlapHandle, \
+                            refreshIRI=self.config.refreshIRI, interpolatingModel=0)
+            else:
+                ripe = RIPE(pharlapHandle=self.pharlapHandle, irtamHandle=self.irtamHandle, \
+                            refreshIRI=1, interpolatingModel=1)
+            self.ripes[backgroundModel] = ripe
+        return ripe
+
+    ## Split the files provided by the DataController between RIPE and IRTAM
+    #
+    #  The background model needs its input files, when they are missing the
+    #  request is answered with IRI instead.
+    #
+    #  @param listOfFiles - dictionary of file lists keyed by data source ('noaa', 'giro')
+    #  @param model (optional) - the model wanted, the configured one by default
+    #
+    #  @retval (backgroundModel, listOfFilesRIPE, listOfFilesIRTAM) - the model actually used,
+    #          'ripe', 'ripe-irtam', 'irtam' or 'iri', and copies of the lists of files it needs
+    #
+    def SelectInputFiles(self, listOfFiles, model=None):
+
+        if model is None:
+            model = self.config.backgroundModel
+
+        backgroundModel  = 'iri'
         listOfFilesRIPE  = []
         listOfFilesIRTAM = []
 
+        noaaFiles = listOfFiles.get('noaa') if listOfFiles else None
+        giroFiles = listOfFiles.get('giro') if listOfFiles else None
+
         # assemble the list of files for RIPE
-        if self.config.backgroundModel == 'ripe':
-            if listOfFiles['noaa']:
-                listOfFilesRIPE = listOfFiles['noaa']
+        if model == 'ripe':
+            if noaaFiles:
+                backgroundModel = 'ripe'
+                listOfFilesRIPE = list(noaaFiles)
             else:
                 logger.warning('Cannot find NOAA input files needed for RIPE, will call IRI instead')
-                self.config.backgroundModel == 'iri'
 
         # assemble the list of files for RIPE-IRTAM
-        if self.config.backgroundModel == 'ripe-irtam':
-            if listOfFiles['noaa']:
-                listOfFilesRIPE = listOfFiles['noaa']
-            else:
+        if model == 'ripe-irtam':
+            if not noaaFiles:
                 logger.warning('Cannot find NOAA input files needed for RIPE-IRTAM, will call IRI instead')
-                self.config.backgroundModel == 'iri'
-            if listOfFiles['giro']:
-                listOfFilesRIPE.extend(listOfFiles['giro'])
-            else:
+            elif not giroFiles:
                 logger.warning('Cannot find GIRO input files needed for RIPE-IRTAM, will call IRI instead')
-                self.config.backgroundModel == 'iri'
+            else:
+                backgroundModel = 'ripe-irtam'
+                listOfFilesRIPE = list(noaaFiles) + list(giroFiles)
 
         # assemble the list of files for IRTAM
-        if self.config.backgroundModel == 'irtam':
-            if listOfFiles['giro']:
-                listOfFilesIRTAM = listOfFiles['giro']
+        if model == 'irtam':
+            if giroFiles:
+                backgroundModel = 'irtam'
+                listOfFilesIRTAM = list(giroFiles)
             else:
                 logger.warning('Cannot find GIRO input files needed for IRTAM, will call IRI instead')
-                self.config.backgroundModel == 'iri'
 
+        return (backgroundModel, listOfFilesRIPE, listOfFilesIRTAM)
+
+    ## Obtain the IRI layer parameters at many locations
+    #
+    #  @param   lats   - array of latitudes (degrees)
+    #  @param   lons   - array of longitudes (degrees)
+    #  @param   DT     - python datetime struct specifying when the state is desired
+    #
+    #  @retval  parameters - (N, 9) array of [foF2, hmF2, foF1, foE, hmE, B0, B1, foEs, hmEs],
+    #                        without sporadic-E
+    #
+    def CalcIRIParametersBatch(self, lats, lons, DT):
 
         UT = numpy.array([DT.year, DT.month, DT.day, DT.hour, DT.minute])
 
         R12 = -1 # a placeholder for now (consider passing this as input?)
 
+        parameters = numpy.zeros((len(lats), 9))
+
+        for n in range(0, len(lats)):
+
+            (iono_pf, iono_extra) = self.pharlapHandle.iri2016(lats[n], lons[n], R12, UT)
+
+            parameters[n, 0:7] = self.pharlapHandle.iono_extra_to_layer_parameters(iono_extra)
+
         # no sporadic-E unless we are using RIPE
-        foEs = 0.0
-        hmEs = 110.0
-
-        # latitude / longitude spacing for nodes of forward difference approximation
-        #dlat = 0.5 * numpy.array([1, 0, 0])
-        #dlon = 0.5 * numpy.array([0, 1, 0])
-
-        # latitude / longitude spacing for nodes of central difference approximation
-        dlat = 0.5 * numpy.array([1, 0, -1, 0, 0])
-        dlon = 0.5 * numpy.array([0, 1, 0, -1, 0])
-
-        dnum = len(dlat)
-
-        foF2_list = []
-
-        for j in range(0, dnum):
-
-            (iono_pf, iono_extra) = self.pharlapHandle.iri2016(lat+dlat[j], lon+dlon[j], R12, UT)
-
-            layer_parameters = self.pharlapHandle.iono_extra_to_layer_parameters(iono_extra)
-
-            foF2 = layer_parameters[0]
-            hmF2 = layer_parameters[1]
-            foF1 = layer_parameters[2]
-            foE  = layer_parameters[3]
-            hmE  = layer_parameters[4]
-            B0   = layer_parameters[5]
-            B1   = layer_parameters[6]
-
-            if self.config.backgroundModel == 'ripe' or self.config.backgroundModel == 'ripe-irtam':
-            #if 'ripe' in self.config.backgroundModel or 'ripe-irtam' in self.config.backgroundModel:
-                #print('taking ripe branch in roam', self.config.backgroundModel)
-
-                # Calculate RIPE parameters
-                (foF2_ripe, hmF2_ripe, B0_ripe, B1_ripe, foEs_ripe, hmEs_ripe) = \
-                    self.ripe.CalcParameters(lat+dlat[j], lon+dlon[j], DT, listOfFilesRIPE)
-
-                # adjust IRI bottomside  parameters for consistency with sounder data
-                if self.apply_RIPE_scaling[0]:
-                    foF2 = foF2_ripe
-                if self.apply_RIPE_scaling[1]:
-                    hmF2 = hmF2_ripe
-                if self.apply_RIPE_scaling[2]:
-                    B0 = B0_ripe
-                if self.apply_RIPE_scaling[3]:
-                    B1 = B1_ripe
-
-                foEs = foEs_ripe
-                hmEs = hmEs_ripe
-
-            if self.config.backgroundModel == 'irtam':
-            #if 'irtam' in self.config.backgroundModel:
-                #print('taking irtam branch in roam', self.config.backgroundModel)
-
-                # Get the interface to IRTAM
-                irtam = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
-
-                # Calculate IRTAM parameters
-                (foF2, hmF2, B0, B1) = irtam.CalcParameters(lat+dlat[j], lon+dlon[j], DT, listOfFilesIRTAM)
-                #logger.info("IRTAM data: foF2={:.4f} hmF2={:.4f} B0={:.4f} B1={:.4f}". \
-                #                            format(foF2, hmF2, B0, B1))
-
-
-            #if 'irtam' in self.config.backgroundModel:
-            #
-            #    # check that these files exist, else skip call to IRTAM and return IRI results
-            #    print(listOfFiles)
-            #
-            #    from pathlib import Path
-            #
-            #    have_all_files = 1
-            #    for file in listOfFiles:
-            #        my_file = Path(file)
-            #        if not my_file.is_file():
-            #            have_all_files = 0
-            #            logger.warning('IRTAM file not found, will return IRI state!')
-            #
-            #        fname = my_file.name
-            #        #logger.info(" Testing for {:s}".format(fname))
-            #
-            #        # check that filename is the right length
-            #        if len(fname) < 5:
-            #            have_all_files = 0
-            #            logger.warning("{:s} filename is too short, skipping".format(fname))
-            #            continue
-            #
-            #        # check that filename has the right prefix
-            #        #print(fname[0:5])
-            #        if fname[0:5] != 'IRTAM':
-            #            have_all_files = 0
-            #            logger.info(" {:s} filename is missing IRTAM prefix, skipping".format(fname))
-            #            continue
-            #
-            #    if have_all_files:
-            #
-            #        irtamProcessor = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
-            #        data = irtamProcessor.translate(lat+dlat[j], lon+dlon[j], DT, listOfFiles)
-            #        logger.info("IRTAM data: foF2={:.4f} hmF2={:.4f} B0={:.4f} B1={:.4f}".\
-            #                    format(data[0], data[1], data[2], data[3]))
-            #        foF2 = data[0]
-            #        hmF2 = data[1]
-            #        B0   = data[2]
-            #        B1   = data[3]
-
-            foF2_list.append(foF2)
+        parameters[:, 7] = 0.0
+        parameters[:, 8] = 110.0
+
+        return parameters
+
+    ## Obtain the background layer parameters at many locations
+    #
+    #  IRI is evaluated at every location, then RIPE or IRTAM are evaluated for all the
+    #  locations at once so that their input files are only parsed once.
+    #
+    #  @param   lats   - array of latitudes (degrees)
+    #  @param   lons   - array of longitudes (degrees)
+    #  @param   DT     - python datetime struct specifying when the state is desired
+    #  @param   listOfFilesRIPE  - list of files for RIPE, see SelectInputFiles
+    #  @param   listOfFilesIRTAM - list of files for IRTAM, see SelectInputFiles
+    #  @param   backgroundModel (optional) - the model to use, see SelectInputFiles, the configured one by default
+    #
+    #  @retval  parameters - (N, 9) array of [foF2, hmF2, foF1, foE, hmE, B0, B1, foEs, hmEs]
+    #
+    def CalcLayerParametersBatch(self, lats, lons, DT, listOfFilesRIPE, listOfFilesIRTAM, backgroundModel=None):
+
+        if backgroundModel is None:
+            backgroundModel = self.config.backgroundModel
+
+        parameters = self.CalcIRIParametersBatch(lats, lons, DT)
+
+        if backgroundModel == 'ripe' or backgroundModel == 'ripe-irtam':
+
+            ripe = self.GetRIPE(backgroundModel)
+
+            # RIPE would call IRI at the same locations again, reuse what we have
+            if ripe.interpolatingModel == 0:
+                backgroundParameters = (parameters[:, 0], parameters[:, 1], parameters[:, 5], parameters[:, 6])
+            else:
+                backgroundParameters = None
+
+            # Calculate RIPE parameters
+            (foF2_ripe, hmF2_ripe, B0_ripe, B1_ripe, foEs_ripe, hmEs_ripe) = \
+                ripe.CalcParametersBatch(lats, lons, DT, listOfFilesRIPE, backgroundParameters)
+
+            # adjust IRI bottomside  parameters for consistency with sounder data
+            if self.apply_RIPE_scaling[0]:
+                parameters[:, 0] = foF2_ripe
+            if self.apply_RIPE_scaling[1]:
+                parameters[:, 1] = hmF2_ripe
+            if self.apply_RIPE_scaling[2]:
+                parameters[:, 5] = B0_ripe
+            if self.apply_RIPE_scaling[3]:
+                parameters[:, 6] = B1_ripe
+
+            parameters[:, 7] = foEs_ripe
+            parameters[:, 8] = hmEs_ripe
+
+        if backgroundModel == 'irtam':
+
+            # Get the interface to IRTAM
+            irtam = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
+
+            # Calculate IRTAM parameters
+            (parameters[:, 0], parameters[:, 1], parameters[:, 5], parameters[:, 6]) = \
+                irtam.CalcParametersBatch(lats, lons, DT, listOfFilesIRTAM)
+
+        return parameters
+
+    ## Obtain the ionospheric state from the ROAM model at many locations for one epoch
+    #
+    #  Gives the same answers as calling CalcIonoState for each location. The stencil points
+    #  of all the locations are evaluated together and points shared by several locations
+    #  are only evaluated once.
+    #
+    #  @param   lats   - array of latitudes where the state is desired (degrees)
+    #  @param   lons   - array of longitudes where the state is desired (degrees)
+    #  @param   DT     - python datetime struct specifying when the state is desired
+    #  @param   listOfFiles - dictionary of file lists returned by DataController.process
+    #
+    #  @retval  ionoStates - (N, 11) array, each row is
+    #                        [foF2, hmF2, foF1, foE, hmE, B0, B1, foEs, hmEs, beta_lat, beta_lon]
+    #
+    @timed('roam')
+    def CalcIonoStateBatch(self, lats, lons, DT, listOfFiles):
+
+        lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))
+
+        (backgroundModel, listOfFilesRIPE, listOfFilesIRTAM) = self.SelectInputFiles(listOfFiles)
+
+        # Locations whose tilt comes from the regional foF2 field, if configured
+        field = None
+        inField = numpy.zeros(len(lats), dtype=bool)
+        if self.config.synopticTilt and self.tiltFieldConfig:
+            field = self.GetTiltField(DT, backgroundModel, listOfFilesRIPE, listOfFilesIRTAM)
+            inField = field.Contains(lats, lons)
+
+        # the other nodes are only needed by the locations whose tilt is computed from their stencil
+        if self.config.synopticTilt:
+            stencil = numpy.flatnonzero(~inField)
+        else:
+            stencil = numpy.zeros(0, dtype=int)
+
+        (uniqueNodes, inverse) = self.StencilNodes(lats, lons, stencil)
+
+        parameters = self.CalcLayerParametersBatch(uniqueNodes[:, 0], uniqueNodes[:, 1], DT,
+                                                   listOfFilesRIPE, listOfFilesIRTAM, backgroundModel)
+
+        ionoStates = self.StencilToIonoStates(parameters[inverse], len(lats), stencil)
 
         if not self.config.synopticTilt:
             # return no tilt
-            beta_lat = 0.0
-            beta_lon = 0.0
             logger.info('NO TILT COMPUTED')
+        elif inField.any():
+            with stage('roam.tilt'):
+                # same differences, interpolated from the field
+                (ionoStates[inField, 9], ionoStates[inField, 10]) = \
+                    field.Tilt(lats[inField], lons[inField], ionoStates[inField, 0])
+
+        return ionoStates
+
+    ## The nodes to evaluate for locations and the tilt stencils of some of them
+    #
+    #  @param   lats    - array of latitudes (degrees)
+    #  @param   lons    - array of longitudes (degrees)
+    #  @param   stencil - indices of the locations whose stencil nodes are needed
+    #
+    #  @retval  (uniqueNodes, inverse) - (M, 2) array of distinct [lat, lon] nodes, and the index in
+    #           uniqueNodes of every location followed by the 4 stencil nodes of each stencil location
+    #
+    def StencilNodes(self, lats, lons, stencil):
+
+        # every location, then the stencil nodes of the locations that need them, one row each
+        nodes = numpy.vstack((numpy.column_stack((lats, lons)),
+                              numpy.column_stack(((lats[stencil, None] + stencilLat[None, 0:4]).ravel(),
+                                                  (lons[stencil, None] + stencilLon[None, 0:4]).ravel()))))
+
+        (uniqueNodes, inverse) = numpy.unique(nodes, axis=0, return_inverse=True)
+
+        return (uniqueNodes, inverse.ravel())
+
+    ## Assemble the ionoStates from the layer parameters at the nodes, see StencilNodes
+    #
+    #  @param   parameters   - (N + 4 len(stencil), 9) layer parameters of every location then of every stencil node
+    #  @param   numLocations - N
+    #  @param   stencil      - indices of the locations whose tilt is computed from their stencil
+    #
+    #  @retval  ionoStates - (N, 11) array, the tilt of the locations not in stencil is 0
+    #
+    def StencilToIonoStates(self, parameters, numLocations, stencil):
+
+        ionoStates = numpy.zeros((numLocations, 11))
+        ionoStates[:, 0:9] = parameters[0:numLocations]
+
+        if len(stencil):
+            with stage('roam.tilt'):
+                pval = parameters[numLocations:, 0].reshape(len(stencil), 4)
+
+                # central difference gradient at Ref_hgt, dlat = [1 0 -1 0 0]; dlon = [0 1 0 -1 0];
+                grad_lat = (pval[:, 0] - pval[:, 2]) / (stencilLat[0] - stencilLat[2])
+                grad_lon = (pval[:, 1] - pval[:, 3]) / (stencilLon[1] - stencilLon[3])
+
+                # convert from absolute horizontal gradient to relative horizontal gradient
+                ionoStates[stencil, 9]  = grad_lat / ionoStates[stencil, 0]
+                ionoStates[stencil, 10] = grad_lon / ionoStates[stencil, 0]
+
+        return ionoStates
+
+    ## Obtain the ionospheric state of several background models at many locations for one epoch
+    #
+    #  Each model gives the same answers as CalcIonoStateBatch of a ROAM configured with it, but
+    #  the models share the work: IRI is evaluated once at the nodes of every location, IRTAM
+    #  once for 'irtam' and 'ripe-irtam', and each RIPE model only adds its station scale factors.
+    #  The tilts are always computed from the stencil of the locations, not from the tilt field.
+    #
+    #  The IRI, IRTAM and RIPE branches are independent. With submitFcn they are submitted at
+    #  once, e.g. to the worker processes of the Manager, see WorkerPool.SubmitEnsembleBranch,
+    #  otherwise they are evaluated one after the other in this process.
+    #
+    #  @param   lats   - array of latitudes where the state is desired (degrees)
+    #  @param   lons   - array of longitudes where the state is desired (degrees)
+    #  @param   DT     - python datetime struct specifying when the state is desired
+    #  @param   listOfFiles - dictionary of file lists returned by DataController.process
+    #  @param   models (optional) - list of models, see ensembleModels
+    #  @param   submitFcn (optional) - submitFcn(branch, lats, lons, DT, listOfFiles) returns a
+    #                                  concurrent.futures.Future of CalcEnsembleBranch
+    #
+    #  @retval  ionoStates - dictionary model -> (N, 11) array, the models missing their input files are left out
+    #
+    @timed('roam.ensemble')
+    def CalcIonoStateEnsemble(self, lats, lons, DT, listOfFiles, models=None, submitFcn=None):
+
+        if models is None:
+            models = ensembleModels
+
+        lats = numpy.atleast_1d(numpy.asarray(lats, dtype=float))
+        lons = numpy.atleast_1d(numpy.asarray(lons, dtype=float))
+
+        # IRI needs no files, the other models are evaluated if their files are there
+        available = [model for model in models if self.SelectInputFiles(listOfFiles, model)[0] == model]
+
+        # IRI gives the layers the other models leave alone
+        branches = ['iri']
+        if 'irtam' in available or 'ripe-irtam' in available:
+            branches.append('irtam')
+        branches += [model for model in available if model in ['ripe', 'ripe-irtam']]
+
+        if self.config.synopticTilt:
+            stencil = numpy.arange(len(lats))
         else:
+            stencil = numpy.zeros(0, dtype=int)
 
-            pval = foF2_list
+        (uniqueNodes, inverse) = self.StencilNodes(lats, lons, stencil)
 
-            # forward difference gradient at Ref_hgt, dlat = [1 0 0]; dlon = [0 1 0];
-            #grad_lat = (pval[0] - pval[2]) / dlat[0]
-            #grad_lon = (pval[1] - pval[2]) / dlon[1]
+        if submitFcn is None:
+            results = {branch: self.CalcEnsembleBranch(branch, uniqueNodes[:, 0], uniqueNodes[:, 1], DT, listOfFiles)
+                       for branch in branches}
+        else:
+            futures = {branch: submitFcn(branch, uniqueNodes[:, 0], uniqueNodes[:, 1], DT, listOfFiles)
+                       for branch in branches}
+            results = {branch: future.result() for branch, future in futures.items()}
+
+        # columns of foF2, hmF2, B0 and B1 in the layer parameters
+        bottomside = [0, 1, 5, 6]
+
+        ionoStates = {}
+        for model in available:
+            parameters = results['iri'].copy()
+            if model in ['irtam', 'ripe-irtam']:
+                parameters[:, bottomside] = results['irtam']
+            if model in ['ripe', 'ripe-irtam']:
+                (scaleFactors, foEs, hmEs) = results[model]
+                if scaleFactors is not None:
+                    parameters[:, bottomside] = parameters[:, bottomside] * numpy.column_stack(scaleFactors)
+                parameters[:, 7] = foEs
+                parameters[:, 8] = hmEs
+            ionoStates[model] = self.StencilToIonoStates(parameters[inverse], len(lats), stencil)
+
+        logger.debug('{:d} models at {:d} locations, {:d} nodes'.format(len(ionoStates), len(lats), len(uniqueNodes)))
+
+        return ionoStates
+
+    ## One independent branch of CalcIonoStateEnsemble
+    #
+    #  @param   branch - 'iri', 'irtam', 'ripe' or 'ripe-irtam'
+    #  @param   lats   - array of latitudes of the nodes (degrees)
+    #  @param   lons   - array of longitudes of the nodes (degrees)
+    #  @param   DT     - python datetime struct specifying when the state is desired
+    #  @param   listOfFiles - dictionary of file lists returned by DataController.process
+    #
+    #  @retval  'iri': (N, 9) array of layer parameters, see CalcIRIParametersBatch
+    #           'irtam': (N, 4) array of [foF2, hmF2, B0, B1]
+    #           'ripe', 'ripe-irtam': (scaleFactors, foEs, hmEs), see RIPE.CalcScaleFactorsBatch
+    #
+    def CalcEnsembleBranch(self, branch, lats, lons, DT, listOfFiles):
 
-            # convert from absolute horizontal gradient to relative horizontal gradient
-            #beta_lat = grad_lat / pval[2]
-            #beta_lon = grad_lon / pval[2]
+        if branch == 'iri':
+            return self.CalcIRIParametersBatch(lats, lons, DT)
 
-            # central difference gradient at Ref_hgt, dlat = [1 0 -1 0 0]; dlon = [0 1 0 -1 0];
-            grad_lat = (pval[0] - pval[2]) / (dlat[0] - dlat[2])
-            grad_lon = (pval[1] - pval[3]) / (dlon[1] - dlon[3])
+        (backgroundModel, listOfFilesRIPE, listOfFilesIRTAM) = self.SelectInputFiles(listOfFiles, branch)
 
-            # convert from absolute horizontal gradient to relative horizontal gradient
-            beta_lat = grad_lat / pval[4]
-            beta_lon = grad_lon / pval[4]
+        if branch == 'irtam':
+            # Get the interface to IRTAM
+            irtam = IRTAM.IRTAM(self.irtamHandle, self.pharlapHandle)
+            return numpy.column_stack(irtam.CalcParametersBatch(lats, lons, DT, listOfFilesIRTAM))
 
-            # Note that we used central differences to compute the gradient, but beta_lat, beta_lon
-            # are actually defined in terms of forward differences. Maybe we should use forward
-            # difference here to be fully consistent?
+        return self.GetRIPE(branch).CalcScaleFactorsBatch(lats, lons, DT, listOfFilesRIPE)
 
-        # no sporadic-E for now
-        #foEs = 0.0
-        #hmEs = 110.0
+    ## Regional foF2 field of a request time
+    #
+    #  The fields are computed once for each epoch of tiltFieldConfig.epochStep and their input
+    #  files, the field of a request is interpolated in time between the epochs around it.
+    #
+    #  @param   DT               - python datetime struct specifying when the field is desired
+    #  @param   backgroundModel  - the model to use, see SelectInputFiles
+    #  @param   listOfFilesRIPE  - list of files for RIPE, see SelectInputFiles
+    #  @param   listOfFilesIRTAM - list of files for IRTAM, see SelectInputFiles
+    #
+    #  @retval  field - TiltField
+    #
+    def GetTiltField(self, DT, backgroundModel, listOfFilesRIPE, listOfFilesIRTAM):
 
-        # Return 11-parameter IonoState vector
-        IonoState = numpy.array([foF2, hmF2, foF1, foE, hmE, B0, B1, foEs, hmEs, beta_lat, beta_lon])
+        (ignored, signatures) = sfsKey(DT, listOfFilesRIPE + listOfFilesIRTAM)
 
-        logger.debug(
-            "ionoState: foF2={:.4f} hmF2={:.4f} foF1={:.4f} foE={:.4f} hmE={:.4f}, B0={:.4f} B1={:.4f},foEs={:.4f} hmEs={:.4f}, beta_lat={:.4f}  beta_lon={:.4f}". \
-                format(IonoState[0], IonoState[1], IonoState[2], IonoState[3], IonoState[4], IonoState[5], \
-                       IonoState[6], IonoState[7], IonoState[8], IonoState[9], IonoState[10]))
-        return IonoState
+        epochStep = self.tiltFieldConfig.epochStep
+        if not epochStep:
+            return self.GetEpochTiltField(DT, signatures, backgroundModel, listOfFilesRIPE, listOfFilesIRTAM)
+
+        epoch = floorDateTime(DT, epochStep)
+        field = self.GetEpochTiltField(epoch, signatures, backgroundModel, listOfFilesRIPE, listOfFilesIRTAM)
+        weight = (DT - epoch).total_seconds() / epochStep
+        if weight > 0:
+            later = self.GetEpochTiltField(epoch + timedelta(seconds=epochStep), signatures, backgroundModel,
+                                           listOfFilesRIPE, listOfFilesIRTAM)
+            field = field.Interpolate(later, weight)
+        return field
+
+    ## Regional foF2 field of an epoch, computed once for the epoch and its input files
+    #
+    #  @param   epoch      - python datetime struct of the epoch
+    #  @param   signatures - signatures of the input files, see RIPE.sfsKey
+    #
+    #  @retval  field - TiltField
+    #
+    def GetEpochTiltField(self, epoch, signatures, backgroundModel, listOfFilesRIPE, listOfFilesIRTAM):
+
+        key = (backgroundModel, epoch, signatures)
+
+        field = self.tiltFields.get(key)
+        if field is None:
+            # Locations of the same epoch arriving together wait for one field
+            field = self.tiltFieldFlight.do(key, self.BuildTiltField, key, epoch, backgroundModel,
+                                            listOfFilesRIPE, listOfFilesIRTAM)
+        return field
+
+    ## Evaluate the background model on the lattice of the field, see GetEpochTiltField
+    #
+    @timed('roam.tiltField')
+    def BuildTiltField(self, key, DT, backgroundModel, listOfFilesRIPE, listOfFilesIRTAM):
+
+        (latAxis, lonAxis) = latticeAxes(self.tiltFieldConfig)
+        (gridLats, gridLons) = numpy.meshgrid(latAxis, lonAxis, indexing='ij')
+
+        parameters = self.CalcLayerParametersBatch(gridLats.ravel(), gridLons.ravel(), DT,
+                                                   listOfFilesRIPE, listOfFilesIRTAM, backgroundModel)
+
+        field = TiltField(latAxis, lonAxis, parameters[:, 0].reshape(gridLats.shape))
+        self.tiltFields.put(key, field)
+
+        logger.info("foF2 field of {:d} x {:d} nodes for {}".format(len(latAxis), len(lonAxis), DT))
+
+        return field
 
     ## Plasma frequency grid generator for ROAM and JIGSE
     #
@@ -299,11 +584,26 @@ class ROAM:
     #  @param  R12             - yearly averaged sunspot number (pass -1 to use model)
     #  @param SporadicE (optional) - if 11 parameter ionoState is passed, setting this flag tells routine to
     #                              construct grid with sporadic E (using foEs and hmEs in place of foE and hmE)
+    #  @param out (optional)       - (hgt_num, lon_num, lat_num) array the grid is written to, see
+    #                              Shared.GridGeneration.pfProfileToEnGrid
     #
     #  @retval  iono_pf_grid - 3D grid of plasma frequencies (MHz)
     #
     # To do: add some optional keywords for various types of plots to be generated?
-    def IonoStateToGrid(self, ionoState, iono_grid_parms, Ref_lat, Ref_lon, DT, R12, SporadicE=True):
+    def IonoStateToGrid(self, ionoState, iono_grid_parms, Ref_lat, Ref_lon, DT, R12, SporadicE=True, out=None):
+
+        grid = self.IonoStateToSeparableGrid(ionoState, iono_grid_parms, Ref_lat, Ref_lon, DT, R12, SporadicE)
+
+        return grid.materialize(out=out, numThreads=getattr(self.config, 'gridThreads', None))
+
+    ## Same as IonoStateToGrid, the grid is kept as the profile, the window and the tilts it is made of
+    #
+    #  Slicing, comparing or saving the grid then costs O(hgt_num + lat_num + lon_num), the voxels
+    #  are computed when asked for, see Shared.GridGeneration.SeparableEnGrid
+    #
+    #  @retval  grid - SeparableEnGrid
+    #
+    def IonoStateToSeparableGrid(self, ionoState, iono_grid_parms, Ref_lat, Ref_lon, DT, R12, SporadicE=True):
 
         # extract the ionospheric grid
 
@@ -325,6 +625,52 @@ class ROAM:
         lon_arr = numpy.arange(0,lon_num) * lon_inc + lon_start
        
 
+        lat_total = lat_inc * (lat_num - 1)
+        lon_total = lon_inc * (lon_num - 1)
+
+        (iono_layer_parms, tilt_lat, tilt_lon) = self.LayerParameters(ionoState, SporadicE)
+
+        UT = numpy.array([DT.year, DT.month, DT.day, DT.hour, DT.minute])
+
+        (iono_pf_profile, winfun) = self.IRIProfile(Ref_lat, Ref_lon, R12, UT, hgt_start, hgt_inc, hgt_num,
+                                                    iono_layer_parms)
+
+
+        # tilt_factor = 1 + tilt_lat * winfun * (numpy.tile(lat_arr.reshape(lat_num, 1, 1), (1, lon_num, hgt_num)) - Ref_lat) + \
+        #                   tilt_lon * winfun * (numpy.tile(lon_arr.reshape(1, lon_num, 1), (lat_num, 1, hgt_num)) - Ref_lon)
+
+        # iono_pf_grid = tilt_factor * iono_pf_profile
+
+        # # allocate space for iono_pf_grid
+        # iono_pf_grid = numpy.zeros((lat_num, lon_num, hgt_num))
+
+        # for lonidx in range(0,lon_num):
+        #     rlon1 = lon_arr[lonidx]
+
+        #     for latidx in range(0,lat_num):
+        #         rlat1 = lat_arr[latidx]
+
+        #         # Additive model
+        #         tilt_factor = 1 + tilt_lat * winfun * (rlat1 - Ref_lat) + \
+        #                           tilt_lon * winfun * (rlon1 - Ref_lon)
+
+        #         # apply modulation
+        #         iono_pf_grid[latidx, lonidx,:]     = iono_pf_profile * tilt_factor
+
+
+
+        return SeparableEnGrid(iono_pf_profile, winfun, tilt_lat, tilt_lon, Ref_lat, Ref_lon,
+                               lat_arr, lon_arr, hgt_arr)
+
+    ## The layer parameters IRI builds the profile of an ionoState from, and its tilts, see IonoStateToGrid
+    #
+    #  @param  ionoState - ionoState vector with 8, 9 or 11 parameters, see IonoStateToGrid
+    #  @param  SporadicE - use foEs and hmEs of an 11 parameter ionoState in place of foE and hmE
+    #
+    #  @retval (iono_layer_parms, tilt_lat, tilt_lon) - [foF2, hmF2, foF1, foE, hmE, B0, B1] and the tilts
+    #
+    def LayerParameters(self, ionoState, SporadicE):
+
         if len(ionoState) == 8:
             # old 8 parameter ionoState: [foF2, hmF2, foF1, foE, B0, B1, beta_lat, beta_lon]
             foF2     = ionoState[0]
@@ -369,9 +715,6 @@ class ROAM:
             tilt_lat = ionoState[9]
             tilt_lon = ionoState[10]
 
-        lat_total = lat_inc * (lat_num - 1)
-        lon_total = lon_inc * (lon_num - 1)
-
         # enforce bounds on the layer parameters for non-sporadic E
         if foE > foF2 * 0.95 and not SporadicE:
             foE = foF2 * 0.95
@@ -382,9 +725,33 @@ class ROAM:
         if B0 < B0_threshold and foE>0:
            foF1 = 1.5*foE;
 
-        iono_layer_parms = numpy.array([foF2, hmF2, foF1, foE, hmE, B0, B1])
+        return (numpy.array([foF2, hmF2, foF1, foE, hmE, B0, B1]), tilt_lat, tilt_lon)
 
-        UT = numpy.array([DT.year, DT.month, DT.day, DT.hour, DT.minute])
+    ## Plasma frequency profile at the pivot point and window of the tilt perturbation, see IonoStateToGrid
+    #
+    #  Ray homing builds the grid of the same state over and over, so the profile and the window
+    #  are kept in profileCache, keyed by everything they depend on. The arrays returned are
+    #  shared by the callers and cannot be modified.
+    #
+    #  @param  Ref_lat          - latitude of the pivot point (deg)
+    #  @param  Ref_lon          - longitude of the pivot point (deg)
+    #  @param  R12              - yearly averaged sunspot number (pass -1 to use model)
+    #  @param  UT               - [year, month, day, hour, minute]
+    #  @param  hgt_start        - first height of the profile (km)
+    #  @param  hgt_inc          - height step of the profile (km)
+    #  @param  hgt_num          - number of heights of the profile
+    #  @param  iono_layer_parms - [foF2, hmF2, foF1, foE, hmE, B0, B1] the profile is built from
+    #
+    #  @retval (iono_pf_profile, winfun) - plasma frequency profile (MHz) and gaussian window function
+    #
+    def IRIProfile(self, Ref_lat, Ref_lon, R12, UT, hgt_start, hgt_inc, hgt_num, iono_layer_parms):
+
+        key = (float(Ref_lat), float(Ref_lon), float(R12), tuple(int(x) for x in UT),
+               float(hgt_start), float(hgt_inc), int(hgt_num), tuple(float(x) for x in iono_layer_parms))
+
+        cached = profileCache.get(key)
+        if cached is not None:
+            return cached
 
         [iono_pf_profile, iono_extra] = self.pharlapHandle.iri2016(Ref_lat, Ref_lon, R12, UT, \
             hgt_start, hgt_inc, hgt_num, iono_layer_parms)
@@ -393,39 +760,141 @@ class ROAM:
         #if not isempty(varargin[0])
         #   iono_pf_profile = varargin[0];
 
+        hgt_arr = numpy.arange(0,hgt_num) * hgt_inc + hgt_start
+        hmF2 = iono_layer_parms[1]
+        hmE  = iono_layer_parms[4]
+
         # perturbation to F - region density only
         win_hmE = 0.2 # value of the gaussian window function at hmE
         std2 = -numpy.power((hmE - hmF2),2) / (2 * numpy.log(win_hmE)) # std of the window function
         winfun = numpy.exp(-numpy.power((hgt_arr - hmF2) , 2) / (2 * std2)) # gaussian window function
 
+        profile = (numpy.array(iono_pf_profile), winfun)
+        for array in profile:
+            array.setflags(write=False)
+        profileCache.put(key, profile)
 
-        # tilt_factor = 1 + tilt_lat * winfun * (numpy.tile(lat_arr.reshape(lat_num, 1, 1), (1, lon_num, hgt_num)) - Ref_lat) + \
-        #                   tilt_lon * winfun * (numpy.tile(lon_arr.reshape(1, lon_num, 1), (lat_num, 1, hgt_num)) - Ref_lon)
+        return profile
 
-        # iono_pf_grid = tilt_factor * iono_pf_profile
+    ## Electron density grid whose columns follow the local ionoState of the background model
+    #
+    #  IonoStateToGrid builds the whole grid from the profile of one ionoState and its tilts. Here the
+    #  layer parameters of the background model are computed on a lattice of columns every columnSpacing
+    #  degrees over the grid, IRI gives the profile of each lattice column, and the other columns are
+    #  interpolated bilinearly in plasma frequency between the four lattice columns around them. The cost
+    #  is one IRI profile per lattice column instead of one per grid column.
+    #
+    #  @param  iono_grid_parms - [lat_start,lat_inc,lat_num, lon_start,lon_inc,lon_num, hgt_start,hgt_inc,hgt_num]
+    #  @param  DT              - python datetime struct specifying when the grid is valid
+    #  @param  listOfFiles     - dictionary of file lists returned by DataController.process
+    #  @param  SporadicE (optional)  - build the columns with the sporadic E layer where the model gives one
+    #  @param  out (optional)        - (hgt_num, lon_num, lat_num) array the grid is written to
+    #  @param  profileFcn (optional) - profileFcn(lats, lons, ionoStates, DT, iono_grid_parms, SporadicE) returns
+    #                                  the profiles of CalcColumnProfiles, e.g. WorkerPool.CalcColumnProfiles
+    #                                  evaluating the columns in the worker processes, None to evaluate them here
+    #
+    #  @retval  ionoEnGrid - (hgt_num, lon_num, lat_num) array of electron density (cm^-3), out if given
+    #
+    @timed('roam.columnGrid')
+    def IonoStatesToColumnGrid(self, iono_grid_parms, DT, listOfFiles, SporadicE=True, out=None, profileFcn=None):
+
+        (lat_start, lat_inc, lat_num) = iono_grid_parms[0:3]
+        (lon_start, lon_inc, lon_num) = iono_grid_parms[3:6]
+        hgt_num = int(iono_grid_parms[8])
+        lat_arr = numpy.arange(0, lat_num) * lat_inc + lat_start
+        lon_arr = numpy.arange(0, lon_num) * lon_inc + lon_start
+
+        shape = (hgt_num, len(lon_arr), len(lat_arr))
+        if out is None:
+            out = numpy.empty(shape)
+        elif out.shape != shape:
+            raise ValueError('IonoStatesToColumnGrid needs a {} grid, got {}'.format(shape, out.shape))
+
+        spacing = getattr(self.config, 'columnSpacing', None) or defaultColumnSpacing
+        latAxis = self.ColumnAxis(lat_arr, spacing)
+        lonAxis = self.ColumnAxis(lon_arr, spacing)
+        (nodeLats, nodeLons) = [nodes.ravel() for nodes in numpy.meshgrid(latAxis, lonAxis, indexing='ij')]
+
+        # The columns need no tilt, the horizontal structure comes from the lattice
+        (backgroundModel, listOfFilesRIPE, listOfFilesIRTAM) = self.SelectInputFiles(listOfFiles)
+        parameters = self.CalcLayerParametersBatch(nodeLats, nodeLons, DT, listOfFilesRIPE, listOfFilesIRTAM,
+                                                   backgroundModel)
+        ionoStates = numpy.column_stack((parameters, numpy.zeros((len(parameters), 2))))
+
+        if profileFcn is None:
+            profileFcn = self.CalcColumnProfiles
+        profiles = profileFcn(nodeLats, nodeLons, ionoStates, DT, iono_grid_parms, SporadicE)
+        profiles = numpy.asarray(profiles).reshape(len(latAxis), len(lonAxis), hgt_num)
+
+        logger.debug('Column grid of {:d} x {:d} lattice columns for {:d} x {:d} grid columns'.format(
+            len(latAxis), len(lonAxis), len(lat_arr), len(lon_arr)))
+
+        (lat0, lat1, latWeight) = self.ColumnWeights(latAxis, lat_arr)
+        (lon0, lon1, lonWeight) = self.ColumnWeights(lonAxis, lon_arr)
+
+        # A block of heights at a time, the interpolated plasma frequencies of a block stay small
+        for start in range(0, hgt_num, columnHeightBlock):
+            block = profiles[:, :, start:start + columnHeightBlock]
+            pf = block[lat0] * (1 - latWeight)[:, None, None] + block[lat1] * latWeight[:, None, None]
+            pf = pf[:, lon0] * (1 - lonWeight)[None, :, None] + pf[:, lon1] * lonWeight[None, :, None]
+            numpy.square(pf, out=pf)
+            pf /= pfToEn
+            out[start:start + columnHeightBlock] = pf.transpose(2, 1, 0)
+
+        return out
+
+    ## Plasma frequency profiles of the lattice columns of IonoStatesToColumnGrid
+    #
+    #  @param  lats       - array of latitudes of the columns (degrees)
+    #  @param  lons       - array of longitudes of the columns (degrees)
+    #  @param  ionoStates - (N, 11) array of the ionoStates of the columns
+    #  @param  DT         - python datetime struct specifying when the grid is valid
+    #  @param  iono_grid_parms - see IonoStatesToColumnGrid, the heights of the profiles
+    #  @param  SporadicE  - see IonoStateToGrid
+    #
+    #  @retval profiles - (N, hgt_num) array of plasma frequency (MHz)
+    #
+    def CalcColumnProfiles(self, lats, lons, ionoStates, DT, iono_grid_parms, SporadicE):
 
-        # # allocate space for iono_pf_grid
-        # iono_pf_grid = numpy.zeros((lat_num, lon_num, hgt_num))
+        (hgt_start, hgt_inc, hgt_num) = iono_grid_parms[6:9]
+        UT = numpy.array([DT.year, DT.month, DT.day, DT.hour, DT.minute])
+        R12 = -1
 
-        # for lonidx in range(0,lon_num):
-        #     rlon1 = lon_arr[lonidx]
+        # Not kept in profileCache, each column is used once per grid
+        profiles = numpy.empty((len(lats), int(hgt_num)))
+        for n in range(0, len(lats)):
+            (iono_layer_parms, tilt_lat, tilt_lon) = self.LayerParameters(ionoStates[n], SporadicE)
+            [iono_pf_profile, iono_extra] = self.pharlapHandle.iri2016(lats[n], lons[n], R12, UT, \
+                hgt_start, hgt_inc, hgt_num, iono_layer_parms)
+            profiles[n] = iono_pf_profile
 
-        #     for latidx in range(0,lat_num):
-        #         rlat1 = lat_arr[latidx]
+        return profiles
 
-        #         # Additive model
-        #         tilt_factor = 1 + tilt_lat * winfun * (rlat1 - Ref_lat) + \
-        #                           tilt_lon * winfun * (rlon1 - Ref_lon)
+    ## Lattice axis of IonoStatesToColumnGrid covering the points of a grid axis
+    #
+    #  @param  points  - latitudes or longitudes of the grid (degrees)
+    #  @param  spacing - largest spacing of the lattice (degrees)
+    #
+    #  @retval axis - increasing array from the smallest to the largest point
+    #
+    def ColumnAxis(self, points, spacing):
 
-        #         # apply modulation
-        #         iono_pf_grid[latidx, lonidx,:]     = iono_pf_profile * tilt_factor
+        (first, last) = (numpy.min(points), numpy.max(points))
+        num = int(numpy.ceil(round((last - first) / spacing, 9))) + 1
 
+        return numpy.linspace(first, last, num)
 
+    ## Bilinear interpolation of IonoStatesToColumnGrid along one axis
+    #
+    #  @retval (index0, index1, weight) - the points are (1 - weight) * axis[index0] + weight * axis[index1]
+    #
+    def ColumnWeights(self, axis, points):
 
-        ionoEnGrid = pfProfileToEnGrid(iono_pf_profile, winfun, tilt_lat, tilt_lon, Ref_lat, Ref_lon,
-                                       lat_arr, lon_arr, hgt_arr)
+        position = numpy.interp(points, axis, numpy.arange(len(axis)))
+        index0 = numpy.minimum(numpy.floor(position).astype(int), max(len(axis) - 2, 0))
+        index1 = numpy.minimum(index0 + 1, len(axis) - 1)
 
-        return ionoEnGrid
+        return (index0, index1, position - index0)
 
     # ============================================================
     #       Interface to legacy MATLAB / ROAM routines below
@@ -473,20 +942,8 @@ class ROAM:
 
     def read_ionoState(self, ionoStateFile, desired_UT, *varargin):
 
-        # read the ionoState data, skipping the first header line
-        data = numpy.loadtxt(ionoStateFile,skiprows=1)
-
-        # Code block below may have a problem if file has only one row of data
-        UT        = data[:,0:5]
-        ionoState = data[:,5:13]  # use this for 8 element ionoState
-        #ionoState = data[:,5:19] # use this for 14 element ionoState
-        Vh        = data[:,19]
-        Vaz       = data[:,20]
-        Ref_lat   = data[:,21]
-        Ref_lon   = data[:,22]
-        AoAErr    = data[:,23]
-
-        uth = UT[:,3]+ UT[:,4]/60
+        # the ionoState data, the file is only parsed again when it changes, see IonoStateTable
+        table = readTable(ionoStateFile)
 
         # if present, compute the latitude and longitude where the state will be applied
         if len(varargin)>0:
@@ -503,14 +960,11 @@ class ROAM:
         #y_new = y[np.isfinite(y)]
 
         # Matlab version used nearest neighbor interpolation, here we used linear
-        interpolating_function = interpolate.interp1d(uth,Ref_lat)
-        Ref_lati = interpolating_function(desired_uth)
-        interpolating_function = interpolate.interp1d(uth, Ref_lon)
-        Ref_loni = interpolating_function(desired_uth)
-        interpolating_function = interpolate.interp1d(uth, Vh)
-        Vhi = interpolating_function(desired_uth)
-        interpolating_function = interpolate.interp1d(uth, Vaz)
-        Vazi = interpolating_function(desired_uth)
+        row = table.at(desired_uth)
+        Ref_lati = row[RefLatColumn]
+        Ref_loni = row[RefLonColumn]
+        Vhi = row[VhColumn]
+        Vazi = row[VazColumn]
 
         LocAssimilated = numpy.array([Ref_lati, Ref_loni]);
 
@@ -533,28 +987,15 @@ class ROAM:
             Veast  = Vhi*numpy.sin(Vazi*numpy.pi/180)    # m/s
 
             dt = (Rnorth * Vnorth + Reast * Veast)/numpy.power(Vhi,2)  # sec
-            dth = dt/3600  # hours
+            dth = numpy.asarray(dt).item()/3600  # hours, dt is an array of one element
             #print('dth: ',dth)
 
         #logger.info("dth={:10.6f}".format(dth))
 
-        # use linear interpolation to obtain ionoState, returning 0 if extrapolating
-        ns = len(ionoState[0,:])
-        ionoStatei = numpy.zeros(ns)
-        for i in range(0,ns):
-           interpolating_function = interpolate.interp1d(uth, ionoState[:,i], fill_value=0)
-           ionoStatei[i] = interpolating_function(desired_uth + dth)
-
-        interpolating_function = interpolate.interp1d(uth, AoAErr, fill_value=0)
-        AoAErri = interpolating_function(desired_uth + dth)
-
-        # replace extrapolated values with persistence
-        if desired_uth + dth < uth[0]:
-            ionoStatei = ionoState[0,:]
-            AoAErri    = AoAErr[0,:]
-        if desired_uth + dth > uth[-1]:  # last element
-            ionoStatei = ionoState[-1,:] # last element
-            AoAErri    = AoAErr[-1,:]    # last element
+        # use linear interpolation to obtain ionoState, with persistence before the first and after the last row
+        row = table.at(desired_uth + dth)
+        ionoStatei = row[ionoStateColumns]
+        AoAErri = row[AoAErrColumn]
 
         if ( max(ionoStatei)!=0) and ((AoAErri < 3) or (AoAErri == 999) ):
             success = True
@@ -610,6 +1051,67 @@ class ROAM:
 
         return (ionoStateJIGSE, lonLatRadAssimilated, success)
 
+    ## Same as queryROAM for many times and application points at once
+    #
+    # The file is read once, see IonoStateTable, and the TID propagation and the conversion to
+    # JIGSE format are computed for every point together.
+    #
+    # @param UTs                         - (N, 5) array of UTC times [year month day hour minute]
+    # @param ionoStateFile               - Name of the ROAM_ionoState.txt file produced by ROAM
+    # @param lonLatRadApplied (optional) - (N, 2) array of [longitude, latitude] in rad where the ionoStates are
+    #                                      to be applied, None to not propagate the states
+    # @retval ionoStatesJIGSE            - (N, 8) array of IonoStates used by JIGSE, see queryROAM
+    # @retval lonLatRadAssimilated       - (N, 2) array of [longitude, latitude] in rad where the states were assimilated
+    # @retval success                    - (N,) boolean array (quality flag)
+    #
+    def queryROAMBatch(self, UTs, ionoStateFile, lonLatRadApplied=None):
+
+        UTs = numpy.atleast_2d(numpy.asarray(UTs, dtype=float))
+        table = readTable(ionoStateFile)
+
+        # ut hours of the requested times
+        desired_uth = UTs[:, 3] + UTs[:, 4] / 60
+
+        rows = table.at(desired_uth)
+        Ref_lat = rows[:, RefLatColumn]
+        Ref_lon = rows[:, RefLonColumn]
+        Vh = rows[:, VhColumn]
+        Vaz = rows[:, VazColumn]
+
+        # propagation time shift due to TID motion, dt = R dot V/|V|^2, where the velocity is known
+        dth = numpy.zeros(len(UTs))
+        if lonLatRadApplied is not None:
+            lonLatRadApplied = numpy.atleast_2d(numpy.asarray(lonLatRadApplied, dtype=float))
+            moving = numpy.flatnonzero((Vh != -1) & (Vh != 0))
+            if len(moving) > 0:
+                LatLonDesired = numpy.vstack((lonLatRadApplied[moving, 1], lonLatRadApplied[moving, 0]))
+                LatLonAssimilated = numpy.vstack((Ref_lat[moving], Ref_lon[moving])) * numpy.pi / 180
+
+                (raz, _, rrange) = greatCircleBearingAndDistance(LatLonDesired, LatLonAssimilated, algo=1)
+
+                Rnorth = rrange * numpy.cos(raz * numpy.pi / 180)  # m
+                Reast  = rrange * numpy.sin(raz * numpy.pi / 180)  # m
+
+                Vnorth = Vh[moving] * numpy.cos(Vaz[moving] * numpy.pi / 180)  # m/s
+                Veast  = Vh[moving] * numpy.sin(Vaz[moving] * numpy.pi / 180)  # m/s
+
+                dth[moving] = (Rnorth * Vnorth + Reast * Veast) / numpy.power(Vh[moving], 2) / 3600  # hours
+
+        rows = table.at(desired_uth + dth)
+        ionoStatesROAM = rows[:, ionoStateColumns]
+        AoAErr = rows[:, AoAErrColumn]
+
+        success = (ionoStatesROAM.max(axis=1) != 0) & ((AoAErr < 3) | (AoAErr == 999))
+
+        # from ROAM format [foF2(MHz), hmF2(km), foF1(MHz), foE(MHz), B0(km), B1, BetaLon(1/deg), BetaLat(1/deg)]
+        # to JIGSE format [foE(Hz), foF1(Hz), foF2(Hz), hmF2(m), B0(m), B1, BetaLon(1/deg), BetaLat(1/deg)]
+        ionoStatesJIGSE = ionoStatesROAM[:, [3, 2, 0, 1, 4, 5, 6, 7]] * \
+            numpy.array([1.e6, 1.e6, 1.e6, 1000, 1000, 1, 1, 1])
+
+        lonLatRadAssimilated = numpy.column_stack((Ref_lon, Ref_lat)) * numpy.pi / 180
+
+        return (ionoStatesJIGSE, lonLatRadAssimilated, success)
+
     ## Create electron density grid from a IonoState state vector in JIGSE format
     #
     # @param ionoGridParams  - Parameters of the voxel grid in PHaRLAP convention:
@@ -631,9 +1133,93 @@ class ROAM:
     #                        where delta lat and delta lon are zero when imposing the linear gradient perturbation
     #
     # @retval ionoEnGrid      - voxel grid of electron density in PHaRLAP convention. The unit is num / cm ^ 3
+    #                          With a gridStoreConfig the grid is a read only numpy.memmap of its file in the
+    #                          configured dtype, mapped instead of built when the same grid is asked again
 
     def genElectronDensityGridROAM(self, ionoGridParams, UT, ionoStateJIGSE, lonLatRadApplied, SporadicE=False):
 
+        # A grid built before is mapped from its file
+        if self.gridStore is not None:
+            gridHash = stateHash(ionoStateJIGSE, lonLatRadApplied, SporadicE)
+            ionoEnGrid = self.gridStore.get(ionoGridParams, UT, gridHash)
+            if ionoEnGrid is not None:
+                return ionoEnGrid
+
+        DT = datetime(UT[0],UT[1],UT[2],UT[3],UT[4],0)
+        grid = self.JIGSEStateToSeparableGrid(ionoGridParams, DT, ionoStateJIGSE, lonLatRadApplied, SporadicE)
+        ionoEnGrid = grid.materialize(numThreads=getattr(self.config, 'gridThreads', None))
+        if self.gridStore is not None:
+            ionoEnGrid = self.gridStore.put(ionoGridParams, UT, gridHash, ionoEnGrid)
+
+        # # convert from plasma freq (MHz) to electron density in cm ^ -3
+        # pftoden = 80.6164e-6
+        # ionoEnGrid = numpy.power(ionoPfGrid,2) / pftoden # cm ^ -3
+        # return ionoEnGrid.transpose()
+        return ionoEnGrid
+
+    ## The eN and eN_5 grids of raytrace_3d, the grids of UT and of 5 minutes later, in one pass
+    #
+    #  Same as two calls of genElectronDensityGridROAM, the axes of the grids are parsed once and both grids
+    #  are filled in a single pass of the compiled builder. With out and out_5 the arrays returned by
+    #  Pharlap.setIonosphereGrids, the grids are written straight into the IONOSPHERE_STRUCT and
+    #  raytrace_3d is then called without the grid arguments:
+    #
+    #      (eN, eN_5, colFreq) = pharlap.setIonosphereGrids(ionoGridParams, collision_freq=colFreq)
+    #      roam.genElectronDensityGridPairROAM(ionoGridParams, UT, ionoStateJIGSE, lonLatRadApplied, out=eN, out_5=eN_5)
+    #
+    #  With a gridStoreConfig the grids stored before are copied instead of built.
+    #
+    # @param ionoGridParams, UT, ionoStateJIGSE, lonLatRadApplied, SporadicE - see genElectronDensityGridROAM
+    # @param ionoStateJIGSE_5 (optional) - ionospheric state vector 5 minutes after UT, None for ionoStateJIGSE
+    # @param out, out_5 (optional)       - arrays the grids are written to, at least (numHt, numLon, numLat), see
+    #                                      Shared.GridGeneration.pfProfilePairToEnGrids
+    #
+    # @retval (ionoEnGrid, ionoEnGrid_5) - voxel grids of electron density at UT and 5 minutes later (num / cm ^ 3),
+    #                                      out and out_5 if given
+    #
+    @timed('roam.gridPair')
+    def genElectronDensityGridPairROAM(self, ionoGridParams, UT, ionoStateJIGSE, lonLatRadApplied, SporadicE=False,
+                                       ionoStateJIGSE_5=None, out=None, out_5=None):
+
+        DT = datetime(UT[0],UT[1],UT[2],UT[3],UT[4],0)
+        DT_5 = DT + timedelta(minutes=5)
+        if ionoStateJIGSE_5 is None:
+            ionoStateJIGSE_5 = ionoStateJIGSE
+
+        # Grids built before are copied from their files
+        if self.gridStore is not None:
+            UT_5 = [DT_5.year, DT_5.month, DT_5.day, DT_5.hour, DT_5.minute]
+            gridHash = stateHash(ionoStateJIGSE, lonLatRadApplied, SporadicE)
+            gridHash_5 = stateHash(ionoStateJIGSE_5, lonLatRadApplied, SporadicE)
+            stored = self.gridStore.get(ionoGridParams, UT, gridHash)
+            stored_5 = self.gridStore.get(ionoGridParams, UT_5, gridHash_5)
+            if stored is not None and stored_5 is not None:
+                corner = tuple(slice(0, n) for n in stored.shape)
+                out = numpy.empty(stored.shape) if out is None else out
+                out_5 = numpy.empty(stored.shape) if out_5 is None else out_5
+                out[corner] = stored
+                out_5[corner] = stored_5
+                return (out, out_5)
+
+        grid = self.JIGSEStateToSeparableGrid(ionoGridParams, DT, ionoStateJIGSE, lonLatRadApplied, SporadicE)
+        grid_5 = self.JIGSEStateToSeparableGrid(ionoGridParams, DT_5, ionoStateJIGSE_5, lonLatRadApplied, SporadicE)
+        (out, out_5) = grid.materializePair(grid_5, out, out_5, numThreads=getattr(self.config, 'gridThreads', None))
+
+        if self.gridStore is not None:
+            corner = tuple(slice(0, n) for n in grid.shape)
+            self.gridStore.put(ionoGridParams, UT, gridHash, out[corner])
+            self.gridStore.put(ionoGridParams, UT_5, gridHash_5, out_5[corner])
+
+        return (out, out_5)
+
+    ## The grid of an ionoState in JIGSE format, as a SeparableEnGrid, see genElectronDensityGridROAM
+    #
+    # @param DT - python datetime struct specifying when the state is valid
+    #
+    # @retval grid - SeparableEnGrid
+    #
+    def JIGSEStateToSeparableGrid(self, ionoGridParams, DT, ionoStateJIGSE, lonLatRadApplied, SporadicE):
+
         # [ionoStateROAM] = [foF2, hmF2, foF1, foE, B0, B1, beta_lat, beta_lon], 8 element form,
         #                or [foF2, hmF2, foF1, foE, hmE, B0, B1, beta_lat, beta_lon], 9 element form
         #                or [foF2, hmF2, foF1, foE, hmE, B0, B1, foEs, hmEs, beta_lat, beta_lon], 11 element form
@@ -673,14 +1259,7 @@ class ROAM:
         Ref_lon = lonLatRadApplied[0] * 180 / numpy.pi # longitude in degrees
 
         R12 = -1
-        DT = datetime(UT[0],UT[1],UT[2],UT[3],UT[4],0)
-        ionoEnGrid = self.IonoStateToGrid(ionoStateROAM, ionoGridParams, Ref_lat, Ref_lon, DT, R12, SporadicE=SporadicE)
-
-        # # convert from plasma freq (MHz) to electron density in cm ^ -3
-        # pftoden = 80.6164e-6
-        # ionoEnGrid = numpy.power(ionoPfGrid,2) / pftoden # cm ^ -3
-        # return ionoEnGrid.transpose()
-        return ionoEnGrid
+        return self.IonoStateToSeparableGrid(ionoStateROAM, ionoGridParams, Ref_lat, Ref_lon, DT, R12, SporadicE=SporadicE)
 
 #
 # Unit tests
@@ -873,6 +1452,389 @@ class UnitTest_ROAM(unittest.TestCase):
 
         return
 
+    def test_CalcIonoStateBatch_RIPE(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        logger.info("test_CalcIonoStateBatch_RIPE")
+
+        # Location of test files
+        directory = os.path.dirname(os.path.realpath(__file__)) + "/../RIPE"
+
+        # Setup the input into ROAM
+        listOfFiles = {}
+        listOfFiles['noaa'] = [directory + '/TestFiles/AU930_NOAA.TXT', \
+                               directory + '/TestFiles/BC840_NOAA.TXT', \
+                               directory + '/TestFiles/EG931_NOAA.TXT']
+        listOfFiles['giro'] = []
+        listOfFiles['localDigisonde'] = []
+
+        self.config = ConfigValues.ROAMConfig()
+        self.config.backgroundModel = 'ripe'
+
+        self.roam = ROAM(self.config, self.irtamHandle, self.pharlapHandle)
+
+        # G10 receiver location, a point sharing stencil nodes with it and one east of the prime meridian
+        lats = numpy.array([32.4824, 32.9824, 51.5])
+        lons = numpy.array([-106.3809, -106.3809, 0.1])
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+
+        states = self.roam.CalcIonoStateBatch(lats, lons, DT, listOfFiles)
+
+        self.assertEqual(states.shape, (3, 11))
+        for n in range(0, len(lats)):
+            state = self.roam.CalcIonoState(lats[n], lons[n], DT, listOfFiles)
+            assert_allclose(states[n], state, rtol=1e-10)
+
+        return
+
+    def test_TiltField(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        logger.info("test_TiltField")
+
+        # Location of test files
+        directory = os.path.dirname(os.path.realpath(__file__)) + "/../RIPE"
+
+        # Setup the input into ROAM
+        listOfFiles = {}
+        listOfFiles['noaa'] = [directory + '/TestFiles/AU930_NOAA.TXT', \
+                               directory + '/TestFiles/BC840_NOAA.TXT', \
+                               directory + '/TestFiles/EG931_NOAA.TXT']
+        listOfFiles['giro'] = []
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'ripe'
+        stencilRoam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'ripe'
+        config.tiltFieldConfig = ConfigValues.TiltFieldConfig()
+        config.tiltFieldConfig.latMin = 30.0
+        config.tiltFieldConfig.latMax = 35.0
+        config.tiltFieldConfig.lonMin = 250.0
+        config.tiltFieldConfig.lonMax = 256.0
+        fieldRoam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        # Two lattice points, one of them given west of Greenwich, and one point out of the field
+        lats = numpy.array([32.5, 33.0, 40.0])
+        lons = numpy.array([254.0, -106.5, 254.0])
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+
+        states = fieldRoam.CalcIonoStateBatch(lats, lons, DT, listOfFiles)
+        assert_allclose(states, stencilRoam.CalcIonoStateBatch(lats, lons, DT, listOfFiles), rtol=1e-10)
+        self.assertEqual(len(fieldRoam.tiltFields), 1)
+
+        # Requests of the same epoch share its field and the field of the next epoch
+        fieldRoam.CalcIonoStateBatch(lats, lons, datetime(2015, 10, 20, 0, 1, 10), listOfFiles)
+        fieldRoam.CalcIonoStateBatch(lats, lons, datetime(2015, 10, 20, 0, 3, 45), listOfFiles)
+        self.assertEqual(len(fieldRoam.tiltFields), 2)
+        self.assertEqual(fieldRoam.tiltFields.stats()['misses'], 2)
+
+        return
+
+    def test_MissingFilesFallBackToIRI(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        logger.info("test_MissingFilesFallBackToIRI")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        iri = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+        listOfFiles = {'noaa': [], 'giro': []}
+
+        for backgroundModel in ['ripe', 'irtam', 'ripe-irtam']:
+            config = ConfigValues.ROAMConfig()
+            config.backgroundModel = backgroundModel
+            roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+            self.assertEqual(roam.SelectInputFiles(listOfFiles), ('iri', [], []))
+            assert_allclose(roam.CalcIonoState(32.4824, -106.3809, DT, listOfFiles),
+                            iri.CalcIonoState(32.4824, -106.3809, DT, listOfFiles))
+            # The configuration is left alone
+            self.assertEqual(config.backgroundModel, backgroundModel)
+
+        return
+
+    def test_Ensemble(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        logger.info("test_Ensemble")
+
+        # Location of test files
+        directory = os.path.dirname(os.path.realpath(__file__)) + '/'
+
+        # Setup the input into ROAM
+        listOfFiles = {}
+        listOfFiles['noaa'] = [directory + '../RIPE/TestFiles/AU930_NOAA.TXT', \
+                               directory + '../RIPE/TestFiles/BC840_NOAA.TXT', \
+                               directory + '../RIPE/TestFiles/EG931_NOAA.TXT']
+        listOfFiles['giro'] = [directory + '../IRTAM/UnitTestData/IRTAM_foF2_COEFFS_20151020_0000.ASC', \
+                               directory + '../IRTAM/UnitTestData/IRTAM_hmF2_COEFFS_20151020_0000.ASC', \
+                               directory + '../IRTAM/UnitTestData/IRTAM_B0_COEFFS_20151020_0000.ASC', \
+                               directory + '../IRTAM/UnitTestData/IRTAM_B1_COEFFS_20151020_0000.ASC']
+
+        lats = numpy.array([32.4824, 37.2321])
+        lons = numpy.array([-106.3809, 256.2323])
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        ensemble = ROAM(config, self.irtamHandle, self.pharlapHandle).CalcIonoStateEnsemble(lats, lons, DT, listOfFiles)
+        self.assertEqual(sorted(ensemble), sorted(ensembleModels))
+
+        # Each model is the same as a ROAM configured with it
+        for backgroundModel in ensembleModels:
+            config = ConfigValues.ROAMConfig()
+            config.backgroundModel = backgroundModel
+            roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+            assert_allclose(ensemble[backgroundModel], roam.CalcIonoStateBatch(lats, lons, DT, listOfFiles), rtol=1e-10)
+
+        # Without the GIRO files only the models that do not need them
+        ensemble = roam.CalcIonoStateEnsemble(lats, lons, DT, {'noaa': listOfFiles['noaa'], 'giro': []})
+        self.assertEqual(sorted(ensemble), ['iri', 'ripe'])
+
+        return
+
+    def test_IonoStateToGridCached(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_array_equal
+        logger.info("test_IonoStateToGridCached")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+        ionoState = roam.CalcIonoState(32.5, 254.0, DT, {})
+        iono_grid_parms = [30.0, 1.0, 5, 252.0, 1.0, 5, 60.0, 2.0, 200]
+
+        profileCache.clear()
+        stats = profileCache.stats()
+        first = roam.IonoStateToGrid(ionoState, iono_grid_parms, 32.5, 254.0, DT, -1)
+        second = roam.IonoStateToGrid(ionoState, iono_grid_parms, 32.5, 254.0, DT, -1)
+        assert_array_equal(first, second)
+        self.assertEqual(profileCache.stats()['hits'], stats['hits'] + 1)
+
+        # Another state needs another profile
+        ionoState[0] = 1.1 * ionoState[0]
+        roam.IonoStateToGrid(ionoState, iono_grid_parms, 32.5, 254.0, DT, -1)
+        self.assertEqual(profileCache.stats()['misses'], stats['misses'] + 2)
+        self.assertEqual(len(profileCache), 2)
+
+        return
+
+    def test_IonoStateToGridInPlace(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        from Shared.GridGeneration import pfProfileToEnGridNumpy
+        logger.info("test_IonoStateToGridInPlace")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        config.gridThreads = 2
+        roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+        ionoState = roam.CalcIonoState(32.5, 254.0, DT, {})
+        iono_grid_parms = [30.0, 1.0, 5, 252.0, 1.0, 6, 60.0, 2.0, 201]
+
+        grid = roam.IonoStateToGrid(ionoState, iono_grid_parms, 32.5, 254.0, DT, -1)
+        self.assertEqual(grid.shape, (201, 6, 5))
+
+        # Written into the buffer of the caller, the layout of raytrace_3d
+        out = numpy.zeros((201, 6, 5))
+        self.assertIs(roam.IonoStateToGrid(ionoState, iono_grid_parms, 32.5, 254.0, DT, -1, out=out), out)
+        assert_allclose(out, grid, rtol=1e-12)
+
+        # Same grid without the compiled builder
+        (iono_pf_profile, winfun) = profileCache.get(list(profileCache.keys())[-1])
+        hgt_arr = numpy.arange(0, 201) * 2.0 + 60.0
+        numpyGrid = pfProfileToEnGridNumpy(iono_pf_profile, winfun, ionoState[9], ionoState[10], 32.5, 254.0,
+                                           numpy.arange(0, 5) + 30.0, numpy.arange(0, 6) + 252.0, hgt_arr,
+                                           numpy.zeros((201, 6, 5)))
+        assert_allclose(numpyGrid, grid, rtol=1e-12)
+
+        # The grid kept as its terms gives the same voxels
+        separable = roam.IonoStateToSeparableGrid(ionoState, iono_grid_parms, 32.5, 254.0, DT, -1)
+        assert_allclose(separable[:], grid, rtol=1e-12)
+        assert_allclose(separable[100], grid[100], rtol=1e-12)
+
+        return
+
+    def test_GridPair(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        logger.info("test_GridPair")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        ionoState = roam.CalcIonoState(32.5, 254.0, datetime(2015, 10, 20, 0, 0, 0), {})
+        # [foE, foF1, foF2, hmE, hmF2, B0, B1, beta_lat, beta_lon] in the JIGSE units
+        ionoStateJIGSE = numpy.array([ionoState[3] * 1.e6, ionoState[2] * 1.e6, ionoState[0] * 1.e6, ionoState[4] * 1000,
+                                      ionoState[1] * 1000, ionoState[5] * 1000, ionoState[6], ionoState[9], ionoState[10]])
+        ionoStateJIGSE_5 = ionoStateJIGSE * [1, 1, 1.05, 1, 1, 1, 1, 1, 0.5]
+        lonLatRadApplied = numpy.array([254.0, 32.5]) * numpy.pi / 180
+        iono_grid_parms = [30.0, 1.0, 5, 252.0, 1.0, 6, 60.0, 2.0, 201]
+
+        eN = roam.genElectronDensityGridROAM(iono_grid_parms, [2015, 10, 20, 0, 0], ionoStateJIGSE, lonLatRadApplied)
+        eN_5 = roam.genElectronDensityGridROAM(iono_grid_parms, [2015, 10, 20, 0, 5], ionoStateJIGSE_5, lonLatRadApplied)
+        pair = roam.genElectronDensityGridPairROAM(iono_grid_parms, [2015, 10, 20, 0, 0], ionoStateJIGSE, lonLatRadApplied,
+                                                   ionoStateJIGSE_5=ionoStateJIGSE_5)
+        assert_allclose(pair[0], eN, rtol=1e-12)
+        assert_allclose(pair[1], eN_5, rtol=1e-12)
+
+        # Written into the corner of arrays laid out as the grids of IONOSPHERE_STRUCT
+        out = numpy.zeros((250, 10, 10))
+        out_5 = numpy.zeros((250, 10, 10))
+        roam.genElectronDensityGridPairROAM(iono_grid_parms, [2015, 10, 20, 0, 0], ionoStateJIGSE, lonLatRadApplied,
+                                            ionoStateJIGSE_5=ionoStateJIGSE_5, out=out, out_5=out_5)
+        assert_allclose(out[0:201, 0:6, 0:5], eN, rtol=1e-12)
+        assert_allclose(out_5[0:201, 0:6, 0:5], eN_5, rtol=1e-12)
+        self.assertFalse(out_5[201:].any())
+
+        return
+
+    def test_GridStore(self):
+        import tempfile
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_array_equal
+        logger.info("test_GridStore")
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = ConfigValues.ROAMConfig()
+            config.backgroundModel = 'iri'
+            config.gridStoreConfig = ConfigValues.GridStoreConfig()
+            config.gridStoreConfig.directory = directory
+            config.gridStoreConfig.dtype = 'float64'
+            roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+            config = ConfigValues.ROAMConfig()
+            config.backgroundModel = 'iri'
+            reference = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+            ionoStateJIGSE = numpy.array([3.e6, 4.5e6, 8.e6, 110., 300., 100., 2., 0.01, -0.005])
+            lonLatRadApplied = numpy.array([254.0, 32.5]) * numpy.pi / 180
+            iono_grid_parms = [30.0, 1.0, 5, 252.0, 1.0, 6, 60.0, 2.0, 201]
+            UT = [2015, 10, 20, 0, 0]
+
+            eN = reference.genElectronDensityGridROAM(iono_grid_parms, UT, ionoStateJIGSE, lonLatRadApplied)
+            assert_array_equal(roam.genElectronDensityGridROAM(iono_grid_parms, UT, ionoStateJIGSE, lonLatRadApplied), eN)
+            stored = roam.genElectronDensityGridROAM(iono_grid_parms, UT, ionoStateJIGSE, lonLatRadApplied)
+            self.assertIsInstance(stored, numpy.memmap)
+            assert_array_equal(stored, eN)
+            self.assertEqual((roam.gridStore.hits, roam.gridStore.misses), (1, 1))
+
+            # The pair finds the grid of UT and stores the one of 5 minutes later, then finds both
+            pair = reference.genElectronDensityGridPairROAM(iono_grid_parms, UT, ionoStateJIGSE, lonLatRadApplied)
+            for n in range(2):
+                (eN, eN_5) = roam.genElectronDensityGridPairROAM(iono_grid_parms, UT, ionoStateJIGSE, lonLatRadApplied)
+                assert_array_equal(eN, pair[0])
+                assert_array_equal(eN_5, pair[1])
+            self.assertEqual((roam.gridStore.hits, roam.gridStore.misses), (4, 2))
+
+        return
+
+    def test_ColumnGrid(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        from Shared.GridGeneration import pfToEn
+        logger.info("test_ColumnGrid")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        config.columnSpacing = 1.0
+        roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+
+        DT = datetime(2015, 10, 20, 0, 0, 0)
+        iono_grid_parms = [30.0, 0.5, 9, 252.0, 0.5, 7, 60.0, 2.0, 201]
+        profiles = []
+        grid = roam.IonoStatesToColumnGrid(iono_grid_parms, DT, {},
+                                           profileFcn=lambda *args: profiles.append(roam.CalcColumnProfiles(*args)) or profiles[-1])
+        self.assertEqual(grid.shape, (201, 7, 9))
+        # One profile per lattice column, every other grid column
+        profiles = profiles[0].reshape(5, 4, 201)
+        pf = numpy.sqrt(grid * pfToEn)
+
+        # The lattice columns are their profile, the others are interpolated between them
+        assert_allclose(pf[:, 0::2, 0::2], profiles[:, :, :].transpose(2, 1, 0), rtol=1e-10)
+        assert_allclose(pf[:, 2, 1], (profiles[0, 1] + profiles[1, 1]) / 2, rtol=1e-10)
+        assert_allclose(pf[:, 1, 1], profiles[0:2, 0:2].mean(axis=(0, 1)), rtol=1e-10)
+
+        # Each column follows its own layer parameters
+        states = roam.CalcIonoStateBatch([30.0, 34.0], [252.0, 255.0], DT, {})
+        self.assertNotEqual(states[0, 0], states[1, 0])
+        self.assertNotAlmostEqual(pf[:, 0, 0].max(), pf[:, -1, -1].max())
+
+        out = numpy.zeros((201, 7, 9))
+        self.assertIs(roam.IonoStatesToColumnGrid(iono_grid_parms, DT, {}, out=out), out)
+        assert_allclose(out, grid, rtol=1e-12)
+
+        return
+
+    def test_QueryROAM(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose
+        logger.info("test_QueryROAM")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+        ionoStateFile = os.path.dirname(os.path.realpath(__file__)) + \
+            "/UnitTestData/output_test1_itp4_20160620/ROAM_IonoState.txt"
+        data = numpy.loadtxt(ionoStateFile, skiprows=1)
+
+        # At the time of a row, the state assimilated then
+        (ionoState, LocAssimilated, success) = roam.read_ionoState(ionoStateFile, [2016, 6, 20, 5, 0])
+        row = data[(data[:, 3] == 5) & (data[:, 4] == 0)][0]
+        assert_allclose(ionoState, row[5:13])
+        assert_allclose(LocAssimilated, row[21:23])
+        self.assertEqual(success, row[23] < 3)
+
+        # Propagated along the TID velocity to another location
+        lonLatRadApplied = numpy.array([-106.0, 32.0]) * numpy.pi / 180
+        (ionoStateJIGSE, lonLatRadAssimilated, success) = roam.queryROAM([2016, 6, 20, 5, 10], ionoStateFile, lonLatRadApplied)
+        self.assertEqual(ionoStateJIGSE.shape, (8,))
+        assert_allclose(lonLatRadAssimilated, numpy.array([row[22], row[21]]) * numpy.pi / 180)
+
+        # Persistence before the first row
+        (ionoState, LocAssimilated, success) = roam.read_ionoState(ionoStateFile, [2016, 6, 20, 4, 0])
+        assert_allclose(ionoState, data[0, 5:13])
+
+        return
+
+    def test_QueryROAMBatch(self):
+        import IonoModelEngine.Config.ConfigValues as ConfigValues
+        from numpy.testing import assert_allclose, assert_array_equal
+        logger.info("test_QueryROAMBatch")
+
+        config = ConfigValues.ROAMConfig()
+        config.backgroundModel = 'iri'
+        roam = ROAM(config, self.irtamHandle, self.pharlapHandle)
+        ionoStateFile = os.path.dirname(os.path.realpath(__file__)) + \
+            "/UnitTestData/output_test1_itp4_20160620/ROAM_IonoState.txt"
+
+        UTs = numpy.array([[2016, 6, 20, 4 + m // 60, m % 60] for m in range(50, 95, 4)])
+        lonLatRadApplied = numpy.column_stack((numpy.linspace(-108.0, -104.0, len(UTs)),
+                                               numpy.linspace(31.0, 35.0, len(UTs)))) * numpy.pi / 180
+
+        for applied in [None, lonLatRadApplied]:
+            (states, lonLats, success) = roam.queryROAMBatch(UTs, ionoStateFile, applied)
+            self.assertEqual(states.shape, (len(UTs), 8))
+            for n in range(len(UTs)):
+                args = () if applied is None else (applied[n],)
+                (state, lonLat, ok) = roam.queryROAM(list(UTs[n]), ionoStateFile, *args)
+                assert_allclose(states[n], state, rtol=1e-12)
+                assert_allclose(lonLats[n], lonLat, rtol=1e-12)
+                self.assertEqual(success[n], ok)
+
+        # The propagation moves the states in time
+        self.assertFalse(numpy.array_equal(roam.queryROAMBatch(UTs, ionoStateFile)[0], states))
+        assert_array_equal(roam.queryROAMBatch(UTs[0], ionoStateFile)[0], roam.queryROAMBatch(UTs, ionoStateFile)[0][0:1])
+
+        return
+
 # include tests with / without Sporadic-E, with/without desired location, grid generation using 8 and 11 element states
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import unittest
+import numpy
+from scipy import interpolate
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package IonoModelEngine.ROAM.TiltField
+#  Regional foF2 field the synoptic tilts are computed from
+#
+#  ROAM computes the tilt of a location from foF2 at the nodes of a central difference
+#  stencil around it. With a field the stencil nodes are interpolated from foF2 computed
+#  once per epoch on a lattice over the theater, so the tilt of a location costs no model
+#  call. When the lattice spacing divides the stencil step and the location is on the
+#  lattice, the nodes are lattice points and the tilt is the same as with the stencil.
+
+## Distance (degrees) between a location and the nodes of its tilt stencil, same as ROAM
+stencilStep = 0.5
+
+## The latitude and longitude axes of the lattice of a field
+#
+#  @param config - TiltFieldConfig() - defined in ConfigDef.py
+#
+#  @retval (latAxis, lonAxis) - increasing arrays (degrees) from the min to the max edge
+#
+def latticeAxes(config):
+    numLat = int(round((config.latMax - config.latMin) / config.spacing)) + 1
+    numLon = int(round((config.lonMax - config.lonMin) / config.spacing)) + 1
+    return (numpy.linspace(config.latMin, config.latMax, numLat),
+            numpy.linspace(config.lonMin, config.lonMax, numLon))
+
+## foF2 on the lattice of one epoch
+#
+class TiltField:
+
+    ## Constructor
+    #
+    #  @param latAxis - increasing array of lattice latitudes (degrees)
+    #  @param lonAxis - increasing array of lattice longitudes (degrees)
+    #  @param foF2    - (len(latAxis), len(lonAxis)) array of foF2 (MHz)
+    #
+    def __init__(self, latAxis, lonAxis, foF2):
+        self.latAxis = numpy.asarray(latAxis, dtype=float)
+        self.lonAxis = numpy.asarray(lonAxis, dtype=float)
+        self.foF2 = numpy.asarray(foF2, dtype=float)
+        self.interpolator = interpolate.RegularGridInterpolator((self.latAxis, self.lonAxis), self.foF2)
+
+    ## The field between this epoch and a later one, foF2 linearly interpolated in time
+    #
+    #  @param later  - TiltField of the later epoch, on the same lattice
+    #  @param weight - 0 at this epoch, 1 at the later one
+    #
+    #  @retval TiltField
+    #
+    def Interpolate(self, later, weight):
+        return TiltField(self.latAxis, self.lonAxis, (1 - weight) * self.foF2 + weight * later.foF2)
+
+    ## Bring longitudes in the longitude range of the lattice when they are 360 degrees apart
+    #
+    def wrapLongitudes(self, lons):
+        return self.lonAxis[0] + numpy.mod(numpy.asarray(lons, dtype=float) - self.lonAxis[0], 360.0)
+
+    ## Which locations have their whole stencil in the field
+    #
+    #  @param lats - array of latitudes (degrees)
+    #  @param lons - array of longitudes (degrees)
+    #
+    #  @retval boolean array
+    #
+    def Contains(self, lats, lons):
+        lats = numpy.asarray(lats, dtype=float)
+        lons = self.wrapLongitudes(lons)
+        return (lats - stencilStep >= self.latAxis[0]) & (lats + stencilStep <= self.latAxis[-1]) & \
+               (lons - stencilStep >= self.lonAxis[0]) & (lons + stencilStep <= self.lonAxis[-1])
+
+    ## Relative horizontal gradients of foF2, the same central differences as ROAM
+    #
+    #  @param lats - array of latitudes (degrees), inside the field, see Contains
+    #  @param lons - array of longitudes (degrees), inside the field, see Contains
+    #  @param foF2 - array of foF2 at the locations (MHz), the gradients are relative to it
+    #
+    #  @retval (beta_lat, beta_lon) - arrays
+    #
+    def Tilt(self, lats, lons, foF2):
+        lats = numpy.asarray(lats, dtype=float)
+        lons = self.wrapLongitudes(lons)
+        north = self.interpolator(numpy.column_stack((lats + stencilStep, lons)))
+        south = self.interpolator(numpy.column_stack((lats - stencilStep, lons)))
+        east  = self.interpolator(numpy.column_stack((lats, lons + stencilStep)))
+        west  = self.interpolator(numpy.column_stack((lats, lons - stencilStep)))
+        beta_lat = (north - south) / (2 * stencilStep) / foF2
+        beta_lon = (east - west) / (2 * stencilStep) / foF2
+        return (beta_lat, beta_lon)
+
+class UnitTest_TiltField(unittest.TestCase):
+
+    def test_Tilt(self):
+        from IonoModelEngine.Config import ConfigValues
+        from numpy.testing import assert_allclose
+        config = ConfigValues.TiltFieldConfig()
+        (latAxis, lonAxis) = latticeAxes(config)
+        self.assertEqual(latAxis[1] - latAxis[0], config.spacing)
+        # foF2 linear in latitude and longitude, the interpolated differences are exact
+        foF2 = 8.0 + 0.1 * (latAxis[:, None] - 40.0) - 0.02 * (lonAxis[None, :] - 260.0)
+        field = TiltField(latAxis, lonAxis, foF2)
+        lats = numpy.array([32.4824, 40.0])
+        lons = numpy.array([-106.3809, 260.0])
+        self.assertTrue(field.Contains(lats, lons).all())
+        self.assertFalse(field.Contains([54.8], [260.0])[0])
+        (beta_lat, beta_lon) = field.Tilt(lats, lons, numpy.array([7.0, 8.0]))
+        assert_allclose(beta_lat, [0.1 / 7.0, 0.1 / 8.0])
+        assert_allclose(beta_lon, [-0.02 / 7.0, -0.02 / 8.0])
+        # A quarter of the way to a field 1 MHz higher
+        assert_allclose(field.Interpolate(TiltField(latAxis, lonAxis, foF2 + 1.0), 0.25).foF2, foF2 + 0.25)
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
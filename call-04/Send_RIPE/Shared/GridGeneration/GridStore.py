@@ -0,0 +1,205 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import os
+import hashlib
+import unittest
+import numpy
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package Shared.GridGeneration.GridStore
+#  Electron density grids kept on disk and memory-mapped when they are read back
+#
+#  A grid file is a fixed size header followed by the (numHt, numLon, numLat) grid in C order. The
+#  header holds the grid parameters, the UT and a hash of the ionoState the grid was built from, so
+#  a grid is only returned for the request it was built for. Reading a grid maps the file, a replayed
+#  epoch or a grid handed to another process by its file name costs no computation and no copy.
+
+## Marks the files written by GridStore, with the version of the layout
+gridFileMagic = b'ENGRID01'
+## Bytes of the header, the grid starts at this offset
+gridHeaderBytes = 256
+## Layout of the header: magic, dtype of the grid, grid parameters, UT [year month day hour minute], ionoState hash
+gridHeaderDtype = numpy.dtype([('magic', 'S8'), ('dtype', 'S8'), ('gridParams', '<f8', (9,)), ('UT', '<i4', (5,)),
+                               ('stateHash', 'S40'), ('pad', 'V{:d}'.format(gridHeaderBytes - 148))])
+
+## Hash of the inputs of a grid besides its parameters and its UT
+#
+#  @param ionoState         - ionospheric state vector the grid is built from
+#  @param lonLatRadApplied  - [longitude, latitude] of the pivot point (radians)
+#  @param SporadicE         - whether the grid is built with the sporadic E layer
+#
+#  @retval 40 character hexadecimal string
+#
+def stateHash(ionoState, lonLatRadApplied, SporadicE):
+    digest = hashlib.sha1(numpy.ascontiguousarray(ionoState, dtype='<f8').tobytes())
+    digest.update(numpy.ascontiguousarray(lonLatRadApplied, dtype='<f8').tobytes())
+    digest.update(b'E' if SporadicE else b'-')
+    return digest.hexdigest()
+
+## Grid parameters, UT and ionoState hash of a grid file, and the grid memory-mapped read only
+#
+#  @param fname - file written by GridStore.put
+#
+#  @retval (gridParams, UT, stateHash, grid) - grid is a (numHt, numLon, numLat) numpy.memmap
+#
+def loadGrid(fname):
+    header = numpy.fromfile(fname, dtype=gridHeaderDtype, count=1)
+    if len(header) != 1 or header['magic'][0] != gridFileMagic:
+        raise ValueError('{} is not a grid file'.format(fname))
+    header = header[0]
+    gridParams = header['gridParams']
+    shape = (int(gridParams[8]), int(gridParams[5]), int(gridParams[2]))
+    grid = numpy.memmap(fname, dtype=numpy.dtype(header['dtype'].decode()), mode='r', offset=gridHeaderBytes, shape=shape)
+    return (gridParams.tolist(), header['UT'].tolist(), header['stateHash'].decode(), grid)
+
+## Directory of electron density grid files
+#
+class GridStore:
+
+    ## Constructor
+    #
+    #  @param directory - where the grid files are written, created if missing
+    #  @param dtype     - 'float32' or 'float64', the type the grids are stored and read back as
+    #
+    def __init__(self, directory, dtype='float32'):
+        self.directory = directory
+        self.dtype = numpy.dtype(dtype).newbyteorder('<')
+        if self.dtype not in (numpy.dtype('<f4'), numpy.dtype('<f8')):
+            raise ValueError('GridStore stores float32 or float64 grids, not {}'.format(dtype))
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    ## The file of a grid, stores of another dtype in the same directory use other files
+    #
+    #  @param gridParams - [latStart, latInc, numLat, lonStart, lonInc, numLon, htStart, htInc, numHt]
+    #  @param UT         - [year month day hour minute]
+    #  @param stateHash  - see stateHash
+    #
+    def path(self, gridParams, UT, stateHash):
+        key = hashlib.sha1(numpy.asarray(gridParams, dtype='<f8').tobytes())
+        key.update(stateHash.encode())
+        key.update(self.dtype.str.encode())
+        return os.path.join(self.directory, '{:04d}{:02d}{:02d}_{:02d}{:02d}_{}_{}.grid'.format(
+            *[int(t) for t in UT[0:5]], self.dtype.str[1:], key.hexdigest()[0:20]))
+
+    ## Look up a grid
+    #
+    #  @retval (numHt, numLon, numLat) numpy.memmap, read only, None if the grid is not stored
+    #
+    def get(self, gridParams, UT, stateHash):
+        fname = self.path(gridParams, UT, stateHash)
+        grid = None
+        if os.path.exists(fname):
+            try:
+                (storedParams, storedUT, storedHash, grid) = loadGrid(fname)
+            except Exception as e:
+                logger.error('Reading the grid {} failed.'.format(fname))
+                logger.error('{}'.format(e))
+            else:
+                if storedParams != [float(p) for p in gridParams] or storedUT != [int(t) for t in UT[0:5]] or \
+                   storedHash != stateHash or grid.dtype != self.dtype:
+                    grid = None
+        if grid is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return grid
+
+    ## Store a grid, the file is replaced atomically so that readers never map a partial grid
+    #
+    #  @param grid - (numHt, numLon, numLat) array
+    #
+    #  @retval the stored grid as get returns it, converted to the dtype of the store
+    #
+    def put(self, gridParams, UT, stateHash, grid):
+        fname = self.path(gridParams, UT, stateHash)
+        shape = (int(gridParams[8]), int(gridParams[5]), int(gridParams[2]))
+        if numpy.shape(grid) != shape:
+            raise ValueError('GridStore.put needs a {} grid, got {}'.format(shape, numpy.shape(grid)))
+        header = numpy.zeros(1, dtype=gridHeaderDtype)
+        header['magic'] = gridFileMagic
+        header['dtype'] = self.dtype.str.encode()
+        header['gridParams'] = gridParams
+        header['UT'] = [int(t) for t in UT[0:5]]
+        header['stateHash'] = stateHash.encode()
+        tmpName = '{}.{:d}.tmp'.format(fname, os.getpid())
+        with open(tmpName, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(numpy.ascontiguousarray(grid, dtype=self.dtype).tobytes())
+        os.replace(tmpName, fname)
+        return loadGrid(fname)[3]
+
+class UnitTest_GridStore(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.gridParams = [30.0, 1.0, 5, 252.0, 1.0, 6, 60.0, 2.0, 201]
+        self.UT = [2015, 10, 20, 0, 5]
+        self.grid = numpy.random.default_rng(1).uniform(0.0, 1.e6, (201, 6, 5))
+        self.hash = stateHash(numpy.arange(9.0), [4.4, 0.56], False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put(self):
+        from numpy.testing import assert_array_equal
+        store = GridStore(self.directory.name, 'float64')
+        self.assertIsNone(store.get(self.gridParams, self.UT, self.hash))
+        stored = store.put(self.gridParams, self.UT, self.hash, self.grid)
+        self.assertIsInstance(stored, numpy.memmap)
+        assert_array_equal(stored, self.grid)
+        assert_array_equal(store.get(self.gridParams, self.UT, self.hash), self.grid)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+        # Another state, epoch or grid is another file
+        self.assertIsNone(store.get(self.gridParams, self.UT, stateHash(numpy.arange(9.0), [4.4, 0.56], True)))
+        self.assertIsNone(store.get(self.gridParams, [2015, 10, 20, 0, 0], self.hash))
+        self.assertIsNone(store.get(self.gridParams[0:8] + [200], self.UT, self.hash))
+        # Handed to another process by its file name
+        (gridParams, UT, storedHash, grid) = loadGrid(store.path(self.gridParams, self.UT, self.hash))
+        self.assertEqual((gridParams, UT, storedHash), (self.gridParams, self.UT, self.hash))
+        assert_array_equal(grid, self.grid)
+        with self.assertRaises(ValueError):
+            grid[0, 0, 0] = 0.0
+
+    def test_float32(self):
+        from numpy.testing import assert_allclose
+        store = GridStore(self.directory.name)
+        stored = store.put(self.gridParams, self.UT, self.hash, self.grid)
+        self.assertEqual(stored.dtype, numpy.float32)
+        assert_allclose(stored, self.grid, rtol=1e-7)
+        self.assertEqual(os.path.getsize(store.path(self.gridParams, self.UT, self.hash)), gridHeaderBytes + self.grid.size * 4)
+        # A float64 store in the same directory does not return the float32 grid, nor replace it
+        store64 = GridStore(self.directory.name, 'float64')
+        self.assertIsNone(store64.get(self.gridParams, self.UT, self.hash))
+        self.assertNotEqual(store64.path(self.gridParams, self.UT, self.hash), store.path(self.gridParams, self.UT, self.hash))
+        store64.put(self.gridParams, self.UT, self.hash, self.grid)
+        self.assertEqual(store.get(self.gridParams, self.UT, self.hash).dtype, numpy.float32)
+        self.assertEqual(store64.get(self.gridParams, self.UT, self.hash).dtype, numpy.float64)
+        with self.assertRaises(ValueError):
+            GridStore(self.directory.name, 'int16')
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
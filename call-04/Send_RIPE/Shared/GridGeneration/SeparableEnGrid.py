@@ -0,0 +1,258 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import unittest
+import numpy
+import Shared.Utils.HfgeoLogger as Logger
+from Shared.GridGeneration import pfProfileToEnGrid, pfProfileToEnGridNumpy, pfProfilePairToEnGrids
+
+logger = Logger.getLogger()
+
+## @package Shared.GridGeneration.SeparableEnGrid
+#  Electron density grid of ROAM kept as the terms it is built from
+#
+#  The grid of an ionoState is (pf[h] * (1 + win[h] * (tiltLat * dLat + tiltLon * dLon)))^2 / pfToEn,
+#  so it is defined by the profile and the window over the heights, the latitude and longitude
+#  axes and the two tilts. SeparableEnGrid keeps only those, O(numHt + numLat + numLon) numbers,
+#  and computes the voxels when they are asked for.
+
+## Names of the arrays and of the scalars defining a grid, in the order of the constructor
+gridArrays = ('pfProfile', 'winFun', 'latArr', 'lonArr', 'htArr')
+gridScalars = ('tiltLat', 'tiltLon', 'refLat', 'refLon')
+
+## Electron density grid computed on demand
+#
+#  Indexing follows the (numHt, numLon, numLat) layout of the dense grids of raytrace_3d. Each
+#  axis is indexed on its own: grid[0:10, [1, 3], 5] is the 10 x 2 block of those heights and
+#  longitudes at latitude 5.
+#
+class SeparableEnGrid:
+
+    ## Constructor
+    #
+    #  @param pfProfile - plasma frequency profile at the pivot point (MHz), one per height
+    #  @param winFun    - window function of the tilts, one per height
+    #  @param tiltLat   - relative latitude gradient (1/deg)
+    #  @param tiltLon   - relative longitude gradient (1/deg)
+    #  @param refLat    - latitude of the pivot point where the tilt is zero (deg)
+    #  @param refLon    - longitude of the pivot point where the tilt is zero (deg)
+    #  @param latArr    - latitudes of the grid (deg)
+    #  @param lonArr    - longitudes of the grid (deg)
+    #  @param htArr     - heights of the grid (km)
+    #
+    def __init__(self, pfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr):
+        self.pfProfile = numpy.asarray(pfProfile, dtype=float)
+        self.winFun = numpy.asarray(winFun, dtype=float)
+        self.tiltLat = float(tiltLat)
+        self.tiltLon = float(tiltLon)
+        self.refLat = float(refLat)
+        self.refLon = float(refLon)
+        self.latArr = numpy.asarray(latArr, dtype=float)
+        self.lonArr = numpy.asarray(lonArr, dtype=float)
+        self.htArr = numpy.asarray(htArr, dtype=float)
+        if not (len(self.pfProfile) == len(self.winFun) == len(self.htArr)):
+            raise ValueError('SeparableEnGrid needs a profile and a window value per height')
+
+    ## Shape of the dense grid, (numHt, numLon, numLat)
+    #
+    @property
+    def shape(self):
+        return (len(self.htArr), len(self.lonArr), len(self.latArr))
+
+    ## Bytes held by the grid, the dense grid needs 8 per voxel
+    #
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in gridArrays)
+
+    ## The dense grid, computed by the compiled builder
+    #
+    #  @param out        - (numHt, numLon, numLat) array the grid is written to, None to allocate one
+    #  @param numThreads - threads of the compiled builder, None for every core
+    #
+    #  @retval ionoEnGrid - (numHt, numLon, numLat) array of electron density (cm^-3), out if given
+    #
+    def materialize(self, out=None, numThreads=None):
+        return pfProfileToEnGrid(self.pfProfile, self.winFun, self.tiltLat, self.tiltLon, self.refLat, self.refLon,
+                                 self.latArr, self.lonArr, self.htArr, out=out, numThreads=numThreads)
+
+    ## The dense grids of this grid and of a grid on the same axes in one pass, such as eN and eN_5
+    #
+    #  @param other      - SeparableEnGrid with the axes and the pivot point of this grid
+    #  @param out        - array this grid is written to, see Shared.GridGeneration.pfProfilePairToEnGrids
+    #  @param outOther   - array the other grid is written to
+    #  @param numThreads - threads of the compiled builder, None for every core
+    #
+    #  @retval (ionoEnGrid, ionoEnGridOther) - out and outOther if given
+    #
+    def materializePair(self, other, out=None, outOther=None, numThreads=None):
+        if (self.refLat, self.refLon) != (other.refLat, other.refLon) or \
+           not all(numpy.array_equal(getattr(self, name), getattr(other, name)) for name in ('latArr', 'lonArr', 'htArr')):
+            raise ValueError('SeparableEnGrid.materializePair needs grids with the same axes and pivot point')
+        return pfProfilePairToEnGrids(self.pfProfile, self.winFun, self.tiltLat, self.tiltLon,
+                                      other.pfProfile, other.winFun, other.tiltLat, other.tiltLon, self.refLat, self.refLon,
+                                      self.latArr, self.lonArr, self.htArr, out=out, out5=outOther, numThreads=numThreads)
+
+    ## Voxels of a block of the grid
+    #
+    #  @param key - index of the (height, longitude, latitude) axes, integers, slices or index arrays
+    #
+    #  @retval array of electron density (cm^-3), without the axes indexed by an integer
+    #
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError('SeparableEnGrid has 3 axes, got {:d} indices'.format(len(key)))
+        key = key + (slice(None),) * (3 - len(key))
+        # Integers keep their axis until the block is computed
+        squeeze = tuple(axis for axis, index in enumerate(key) if numpy.ndim(index) == 0 and not isinstance(index, slice))
+        (htKey, lonKey, latKey) = [numpy.atleast_1d(index) if axis in squeeze else index for axis, index in enumerate(key)]
+        htArr = self.htArr[htKey]
+        lonArr = self.lonArr[lonKey]
+        latArr = self.latArr[latKey]
+        block = numpy.empty((len(htArr), len(lonArr), len(latArr)))
+        pfProfileToEnGridNumpy(self.pfProfile[htKey], self.winFun[htKey], self.tiltLat, self.tiltLon,
+                               self.refLat, self.refLon, latArr, lonArr, htArr, block)
+        return block.squeeze(axis=squeeze) if squeeze else block
+
+    ## Blocks of whole heights covering the grid, for callers that cannot hold the dense grid
+    #
+    #  @param numHt - number of heights of each block
+    #
+    #  @retval generator of (heights, block) - the slice of the heights and the (n, numLon, numLat) block
+    #
+    def tiles(self, numHt):
+        for start in range(0, len(self.htArr), numHt):
+            heights = slice(start, min(start + numHt, len(self.htArr)))
+            yield (heights, self[heights])
+
+    ## The terms of the grid, to save or send it
+    #
+    #  @retval dictionary of the arrays and scalars of the constructor
+    #
+    def toDict(self):
+        terms = {name: getattr(self, name) for name in gridArrays}
+        terms.update({name: getattr(self, name) for name in gridScalars})
+        return terms
+
+    ## The grid of terms produced by toDict, or read back from numpy.savez
+    #
+    @classmethod
+    def fromDict(cls, terms):
+        return cls(*[terms[name] for name in ('pfProfile', 'winFun') + gridScalars + ('latArr', 'lonArr', 'htArr')])
+
+    ## Write the terms of the grid to a .npz file
+    #
+    def save(self, fname):
+        numpy.savez(fname, **self.toDict())
+
+    ## Read a grid written by save
+    #
+    @classmethod
+    def load(cls, fname):
+        with numpy.load(fname) as terms:
+            return cls.fromDict({name: terms[name] for name in gridArrays + gridScalars})
+
+    ## Grids are equal when their terms are
+    #
+    def __eq__(self, other):
+        if not isinstance(other, SeparableEnGrid):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in gridScalars) and \
+               all(numpy.array_equal(getattr(self, name), getattr(other, name)) for name in gridArrays)
+
+    __hash__ = None
+
+class UnitTest_SeparableEnGrid(unittest.TestCase):
+
+    def setUp(self):
+        htArr = numpy.arange(0, 201) * 2.0 + 60.0
+        pfProfile = 8.0 * numpy.exp(-((htArr - 300.0) / 120.0) ** 2)
+        winFun = numpy.exp(-(htArr - 300.0) ** 2 / 5000.0)
+        self.grid = SeparableEnGrid(pfProfile, winFun, 0.01, -0.005, 35.0, 255.0,
+                                    numpy.arange(0, 21) * 0.5 + 30.0, numpy.arange(0, 31) * 0.5 + 248.0, htArr)
+        self.dense = pfProfileToEnGridNumpy(pfProfile, winFun, 0.01, -0.005, 35.0, 255.0, self.grid.latArr,
+                                            self.grid.lonArr, htArr, numpy.empty(self.grid.shape))
+
+    def test_getitem(self):
+        from numpy.testing import assert_array_equal
+        self.assertEqual(self.grid.shape, (201, 31, 21))
+        self.assertLess(self.grid.nbytes, self.dense.nbytes / 100)
+        assert_array_equal(self.grid[:], self.dense)
+        assert_array_equal(self.grid[10:20, 3, ::2], self.dense[10:20, 3, ::2])
+        assert_array_equal(self.grid[5, [1, 4], 7], self.dense[5, [1, 4], 7])
+        assert_array_equal(self.grid[-1], self.dense[-1])
+        self.assertEqual(float(self.grid[100, 15, 10]), self.dense[100, 15, 10])
+        # Each axis is indexed on its own
+        self.assertEqual(self.grid[[1, 2], [3, 4], :].shape, (2, 2, 21))
+
+    def test_materialize(self):
+        from numpy.testing import assert_allclose
+        out = numpy.zeros(self.grid.shape)
+        self.assertIs(self.grid.materialize(out=out, numThreads=2), out)
+        assert_allclose(out, self.dense, rtol=1e-12)
+        tiles = list(self.grid.tiles(64))
+        self.assertEqual([heights.stop for (heights, block) in tiles], [64, 128, 192, 201])
+        assert_allclose(numpy.concatenate([block for (heights, block) in tiles]), self.dense, rtol=1e-12)
+
+    def test_materializePair(self):
+        from numpy.testing import assert_allclose
+        other = SeparableEnGrid.fromDict(dict(self.grid.toDict(), pfProfile=self.grid.pfProfile * 1.1, tiltLon=0.003))
+        (eN, eN_5) = self.grid.materializePair(other, numThreads=2)
+        assert_allclose(eN, self.dense, rtol=1e-12)
+        assert_allclose(eN_5, other[:], rtol=1e-12)
+        # Written into the corner of larger buffers, as the grids of IONOSPHERE_STRUCT
+        out = numpy.full((210, 40, 30), -1.0)
+        out5 = numpy.full((210, 40, 30), -1.0)
+        self.assertIs(self.grid.materializePair(other, out, out5)[1], out5)
+        assert_allclose(out[0:201, 0:31, 0:21], self.dense, rtol=1e-12)
+        assert_allclose(out5[0:201, 0:31, 0:21], eN_5, rtol=1e-12)
+        self.assertTrue((out[201:] == -1.0).all() and (out5[:, 31:] == -1.0).all())
+        with self.assertRaises(ValueError):
+            self.grid.materializePair(SeparableEnGrid.fromDict(dict(self.grid.toDict(), refLat=36.0)))
+
+    def test_staleModule(self):
+        from numpy.testing import assert_allclose
+        from types import SimpleNamespace
+        from unittest import mock
+        # A module built before the in place builders only has pfprofiletoengrid, numpy builds the grids
+        stale = SimpleNamespace(pfprofiletoengrid=None)
+        with mock.patch('Shared.GridGeneration.PfProfileToEnGrid', stale):
+            assert_allclose(self.grid.materialize(), self.dense, rtol=1e-12)
+            (eN, eN_5) = self.grid.materializePair(self.grid)
+        assert_allclose(eN, self.dense, rtol=1e-12)
+        assert_allclose(eN_5, self.dense, rtol=1e-12)
+
+    def test_save(self):
+        import tempfile
+        import os
+        import pickle
+        with tempfile.TemporaryDirectory() as directory:
+            fname = os.path.join(directory, 'grid.npz')
+            self.grid.save(fname)
+            self.assertEqual(SeparableEnGrid.load(fname), self.grid)
+        self.assertEqual(pickle.loads(pickle.dumps(self.grid)), self.grid)
+        other = SeparableEnGrid.fromDict(dict(self.grid.toDict(), tiltLat=0.02))
+        self.assertNotEqual(other, self.grid)
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
@@ -1,11 +1,27 @@
+import os
 from datetime import datetime
 import numpy
 import Shared.Utils.DateTime as DateTime
-import igrf12
-import PfProfileToEnGrid
+
+# The f2py modules are built by build.sh, pfProfileToEnGrid falls back to numpy without them
+# or when a stale build lacks the builder it needs
+try:
+    import igrf12
+except ImportError:
+    igrf12 = None
+try:
+    import PfProfileToEnGrid
+except ImportError:
+    PfProfileToEnGrid = None
+
+# Conversion from plasma frequency (MHz) to electron density (cm^-3), same as pfProfileToEnGrid.f90
+pfToEn = 80.6164e-6
 
 def genBNED(latDeg, lonDeg, UT, altKm):
 
+    if igrf12 is None:
+        raise ImportError('igrf12 is not built, run build.sh')
+
     yeardec = DateTime.iso8601ToDecimalYear(datetime(*UT))
     colat = 90.0 - latDeg
     elon = (360.0 + lonDeg) % 360.0
@@ -24,6 +40,9 @@ def genBNED(latDeg, lonDeg, UT, altKm):
 
 def genBXYZ(date, numLat, numLon, numHt, BLatStart, BLatInc, BLonStart, BLonInc, BHtStart, BHtInc):
 
+    if igrf12 is None:
+        raise ImportError('igrf12 is not built, run build.sh')
+
     Bx, By, Bz = igrf12.igrf12gridxyz(date, numLat, numLon, numHt, BLatStart, BLatInc, BLonStart, BLonInc, BHtStart, BHtInc)
 
     return Bx.transpose(), By.transpose(), Bz.transpose()
@@ -33,8 +52,84 @@ def genBXYZ(date, numLat, numLon, numHt, BLatStart, BLatInc, BLonStart, BLonInc,
 
 #     ionoEnGrid = PfProfileToEnGrid.pfprofiletoengrid(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, numLat, numLon, numHt, latArr, lonArr, htArr)
 
-def pfProfileToEnGrid(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr):
+## Electron density grid (cm^-3) from a plasma frequency profile, a window function and tilt factors
+#
+#  The grid is written into out when given, so that a caller building grids over and over
+#  can reuse its buffer. The compiled builder splits the heights between numThreads threads.
+#
+#  @param out        - (numHt, numLon, numLat) float64 array, the layout of the grids of raytrace_3d,
+#                      None to allocate one
+#  @param numThreads - threads of the compiled builder, None for every core
+#
+#  @retval ionoEnGrid - (numHt, numLon, numLat) array, out if given
+#
+def pfProfileToEnGrid(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr, out=None, numThreads=None):
+
+    shape = (len(htArr), len(lonArr), len(latArr))
+    if out is None:
+        out = numpy.empty(shape)
+    elif out.shape != shape:
+        raise ValueError('pfProfileToEnGrid needs a {} grid, got {}'.format(shape, out.shape))
+
+    # The (numLat, numLon, numHt) Fortran grid is the transpose of a C contiguous out
+    if hasattr(PfProfileToEnGrid, 'pfprofiletoengridinplace') and out.dtype == numpy.float64 and out.flags.c_contiguous:
+        PfProfileToEnGrid.pfprofiletoengridinplace(out.T, ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon,
+                                                   latArr, lonArr, htArr, numThreads or os.cpu_count())
+    else:
+        pfProfileToEnGridNumpy(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr, out)
+
+    return out
+
+## Electron density grids (cm^-3) of two epochs on the same axes and pivot point in one pass
+#
+#  The eN and eN_5 grids of raytrace_3d share everything but the profile, the window and the tilts,
+#  the compiled builder computes the offsets from the pivot point once for both grids. The grids
+#  are written into the [0:numHt, 0:numLon, 0:numLat] corner of out and out5, which can be larger
+#  than the grids, such as the eN and eN_5 arrays of IONOSPHERE_STRUCT (see Pharlap.setIonosphereGrids).
+#
+#  @param out, out5  - float64 arrays of the same shape, at least (numHt, numLon, numLat), None to
+#                      allocate (numHt, numLon, numLat) arrays
+#  @param numThreads - threads of the compiled builder, None for every core
+#
+#  @retval (ionoEnGrid, ionoEnGrid5) - out and out5
+#
+def pfProfilePairToEnGrids(ionoPfProfile, winFun, tiltLat, tiltLon, ionoPfProfile5, winFun5, tiltLat5, tiltLon5,
+                           refLat, refLon, latArr, lonArr, htArr, out=None, out5=None, numThreads=None):
+
+    shape = (len(htArr), len(lonArr), len(latArr))
+    if out is None:
+        out = numpy.empty(shape)
+    if out5 is None:
+        out5 = numpy.empty(out.shape)
+    if out.shape != out5.shape or out.ndim != 3 or any(n < m for (n, m) in zip(out.shape, shape)):
+        raise ValueError('pfProfilePairToEnGrids needs two grids of the same shape of at least {}, got {} and {}'.format(
+            shape, out.shape, out5.shape))
+
+    if hasattr(PfProfileToEnGrid, 'pfprofilepairtoengrids') and all(grid.dtype == numpy.float64 and grid.flags.c_contiguous for grid in (out, out5)):
+        PfProfileToEnGrid.pfprofilepairtoengrids(out.T, out5.T, ionoPfProfile, winFun, tiltLat, tiltLon,
+                                                 ionoPfProfile5, winFun5, tiltLat5, tiltLon5, refLat, refLon,
+                                                 latArr, lonArr, htArr, numThreads or os.cpu_count())
+    else:
+        corner = tuple(slice(0, n) for n in shape)
+        pfProfileToEnGridNumpy(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr, out[corner])
+        pfProfileToEnGridNumpy(ionoPfProfile5, winFun5, tiltLat5, tiltLon5, refLat, refLon, latArr, lonArr, htArr, out5[corner])
+
+    return (out, out5)
+
+## Same as pfProfileToEnGrid with numpy, used when the f2py module is not built or out is not contiguous
+#
+def pfProfileToEnGridNumpy(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr, out):
+
+    winFun = numpy.asarray(winFun, dtype=float)
+    dLat = numpy.asarray(latArr, dtype=float) - refLat
+    dLon = numpy.asarray(lonArr, dtype=float) - refLon
 
-    ionoEnGrid = PfProfileToEnGrid.pfprofiletoengrid(ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, latArr, lonArr, htArr)
+    # Same operations as the Fortran, in place in out: (1 + tiltLat*win*dLat + tiltLon*win*dLon) * pf
+    numpy.multiply((tiltLat * winFun)[:, None, None], dLat[None, None, :], out=out)
+    out += 1.0
+    out += (tiltLon * winFun)[:, None, None] * dLon[None, :, None]
+    out *= numpy.asarray(ionoPfProfile, dtype=float)[:, None, None]
+    numpy.square(out, out=out)
+    out /= pfToEn
 
-    return ionoEnGrid.transpose()
\ No newline at end of file
+    return out
@@ -1,13 +1,18 @@
 #!/bin/bash
 
 # Choosing the compiler that avoids proprietary shared libraries.
+# The OpenMP flags and runtime of each compiler, for the parallel grid builder.
 case $OSTYPE in
 "linux-gnu")
     FC=gfortran
+    OMPFLAGS=-fopenmp
+    OMPLIB=-lgomp
 ;;
 "darwin"*)
     FC=intelem
+    OMPFLAGS=-qopenmp
+    OMPLIB=-liomp5
 esac
 
 f2py  -c igrf12grid.f90 igrf12.f  --fcompiler=${FC} -m igrf12 
-f2py  -c pfProfileToEnGrid.f90 --fcompiler=${FC} -m PfProfileToEnGrid
+f2py  -c pfProfileToEnGrid.f90 --fcompiler=${FC} --f90flags="${OMPFLAGS}" ${OMPLIB} -m PfProfileToEnGrid
@@ -12,6 +12,27 @@ subroutine pfProfileToEnGrid(ionoEnGrid, ionoPfProfile, winFun, tiltLat, tiltLon
     real(8), intent(in), dimension(numHt) :: htArr
     real(8), intent(out), dimension(numLat, numLon, numHt) :: ionoEnGrid
 
+    call pfProfileToEnGridInPlace(ionoEnGrid, ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, &
+        numLat, numLon, numHt, latArr, lonArr, htArr, 1)
+
+end subroutine pfProfileToEnGrid
+
+! Same as pfProfileToEnGrid, writing into the grid of the caller with numThreads OpenMP threads.
+! The grid (numLat, numLon, numHt) in Fortran order is the (numHt, numLon, numLat) C order layout of raytrace_3d.
+subroutine pfProfileToEnGridInPlace(ionoEnGrid, ionoPfProfile, winFun, tiltLat, tiltLon, refLat, refLon, &
+    numLat, numLon, numHt, latArr, lonArr, htArr, numThreads)
+
+    implicit none
+    integer, intent(in) :: numLat, numLon, numHt
+    integer, intent(in) :: numThreads
+    real(8), intent(in) :: tiltLat, tiltLon
+    real(8), intent(in) :: refLat, refLon
+    real(8), intent(in), dimension(numHt) :: ionoPfProfile, winFun
+    real(8), intent(in), dimension(numLat) :: latArr
+    real(8), intent(in), dimension(numLon) :: lonArr
+    real(8), intent(in), dimension(numHt) :: htArr
+    real(8), intent(inout), dimension(numLat, numLon, numHt) :: ionoEnGrid
+
     integer :: iLat, iLon, iHt
     real(8) :: dLat, dLon, ht
     real(8) :: pfVal, pfWeighted
@@ -19,7 +40,9 @@ subroutine pfProfileToEnGrid(ionoEnGrid, ionoPfProfile, winFun, tiltLat, tiltLon
     real(8) :: winVal
     real(8), parameter :: pfToEn = 80.6164d-6 ! Conversion from plasma frequency (MHz) to electron density (cm^-3).
 
-    !$OMP DO
+    ! Each thread fills whole heights, which are contiguous in the grid.
+    !$OMP PARALLEL DO NUM_THREADS(max(1, numThreads)) SCHEDULE(STATIC) &
+    !$OMP PRIVATE(iLat, iLon, ht, pfVal, winVal, dLat, dLon, tiltFactor, pfWeighted)
     do iHt = 1, numHt
         ht = htArr(iHt)
         pfVal = ionoPfProfile(iHt)
@@ -36,6 +59,60 @@ subroutine pfProfileToEnGrid(ionoEnGrid, ionoPfProfile, winFun, tiltLat, tiltLon
             end do
         end do
     end do
-    !$OMP END DO
+    !$OMP END PARALLEL DO
+
+end subroutine pfProfileToEnGridInPlace
+
+! The grids of two epochs sharing the axes and the pivot point, such as the eN and eN_5 grids of raytrace_3d,
+! in one pass. The grids are written into the (numLat, numLon, numHt) corner of (maxLat, maxLon, maxHt) arrays,
+! which are the grids of IONOSPHERE_STRUCT in Fortran order.
+subroutine pfProfilePairToEnGrids(ionoEnGrid, ionoEnGrid5, ionoPfProfile, winFun, tiltLat, tiltLon, &
+    ionoPfProfile5, winFun5, tiltLat5, tiltLon5, refLat, refLon, &
+    numLat, numLon, numHt, latArr, lonArr, htArr, maxLat, maxLon, maxHt, numThreads)
+
+    implicit none
+    integer, intent(in) :: numLat, numLon, numHt
+    integer, intent(in) :: maxLat, maxLon, maxHt
+    integer, intent(in) :: numThreads
+    real(8), intent(in) :: tiltLat, tiltLon, tiltLat5, tiltLon5
+    real(8), intent(in) :: refLat, refLon
+    real(8), intent(in), dimension(numHt) :: ionoPfProfile, winFun
+    real(8), intent(in), dimension(numHt) :: ionoPfProfile5, winFun5
+    real(8), intent(in), dimension(numLat) :: latArr
+    real(8), intent(in), dimension(numLon) :: lonArr
+    real(8), intent(in), dimension(numHt) :: htArr
+    real(8), intent(inout), dimension(maxLat, maxLon, maxHt) :: ionoEnGrid, ionoEnGrid5
+
+    integer :: iLat, iLon, iHt
+    real(8) :: dLat, dLon
+    real(8) :: pfVal, pfVal5, pfWeighted
+    real(8) :: tiltFactor
+    real(8) :: winLat, winLon, winLat5, winLon5
+    real(8), parameter :: pfToEn = 80.6164d-6 ! Conversion from plasma frequency (MHz) to electron density (cm^-3).
+
+    ! Each thread fills whole heights of both grids, the offsets from the pivot point are shared.
+    !$OMP PARALLEL DO NUM_THREADS(max(1, numThreads)) SCHEDULE(STATIC) &
+    !$OMP PRIVATE(iLat, iLon, pfVal, pfVal5, winLat, winLon, winLat5, winLon5, dLat, dLon, tiltFactor, pfWeighted)
+    do iHt = 1, numHt
+        pfVal = ionoPfProfile(iHt)
+        pfVal5 = ionoPfProfile5(iHt)
+        winLat = tiltLat*winFun(iHt)
+        winLon = tiltLon*winFun(iHt)
+        winLat5 = tiltLat5*winFun5(iHt)
+        winLon5 = tiltLon5*winFun5(iHt)
+        do iLon = 1, numLon
+            dLon = lonArr(iLon) - refLon
+            do iLat = 1, numLat
+                dLat = latArr(iLat) - refLat
+                tiltFactor = 1.0d0 + (winLat*dLat) + (winLon*dLon)
+                pfWeighted = pfVal * tiltFactor
+                ionoEnGrid(iLat, iLon, iHt) = pfWeighted*pfWeighted/pfToEn
+                tiltFactor = 1.0d0 + (winLat5*dLat) + (winLon5*dLon)
+                pfWeighted = pfVal5 * tiltFactor
+                ionoEnGrid5(iLat, iLon, iHt) = pfWeighted*pfWeighted/pfToEn
+            end do
+        end do
+    end do
+    !$OMP END PARALLEL DO
 
-end subroutine pfProfileToEnGrid
\ No newline at end of file
+end subroutine pfProfilePairToEnGrids
@@ -31,6 +31,7 @@ from Shared.IonoPyIface.PharlapPytoCIface import GEOMAG_FIELD_STRUCT
 from Shared.IonoPyIface.PharlapPytoCIface import max_pts_in_ray
 import Shared.Utils.DateTime as DateTime
 import Shared.Utils.HfgeoLogger as Logger
+from Shared.Utils.Timing import timed
 
 logger = Logger.getLogger()
 ## @package Shared.IonoPyIface.Pharlap
@@ -238,6 +239,7 @@ class Pharlap:
     #
     #def iri2016(self, lat, lon, R12, UT, hgt_start, hgt_inc, hgt_num,
     #            iono_layer_parameters=[-1, -1, -1, -1, -1, -1, -1]):
+    @timed('iri')
     def iri2016(self,lat, lon, R12, UT, *args):
 
         # Verify the number of function arguments
@@ -444,6 +446,114 @@ class Pharlap:
 #        plt.xlim([0, foF2 * 1.1])
 #        plt.show()
 
+    ## Set the electron density and collision frequency grids of the IONOSPHERE_STRUCT of raytrace_3d
+    #
+    #  raytrace_3d called without the grid arguments traces through the grids set here. The grids given
+    #  are copied in, the grids left out can be written afterwards into the arrays returned, for instance
+    #  by ROAM.genElectronDensityGridPairROAM, without building and copying a separate grid.
+    #
+    #  @param iono_grid_parms - [lat_min, lat_inc, num_lat, lon_min, lon_inc, num_lon, ht_min, ht_inc, num_ht]
+    #  @param iono_en_grid    - (num_ht, num_lon, num_lat) electron density grid (cm^-3), None to leave it
+    #  @param iono_en_grid_5  - the same 5 minutes later, None to leave it
+    #  @param collision_freq  - (num_ht, num_lon, num_lat) collision frequency grid, None to leave it
+    #
+    #  @retval (eN, eN_5, col_freq) - the whole arrays of the struct, the grids are their
+    #                                 [0:num_ht, 0:num_lon, 0:num_lat] corner
+    #
+    def setIonosphereGrids(self, iono_grid_parms, iono_en_grid=None, iono_en_grid_5=None, collision_freq=None):
+
+        # Electron density and collision frequency grids
+        if self.ionosphere_struct is None:
+            self.ionosphere_struct = IONOSPHERE_STRUCT()
+        ionosphere_struct = self.ionosphere_struct
+        lat_min, lat_inc, num_lat = iono_grid_parms[0:3]
+        lon_min, lon_inc, num_lon = iono_grid_parms[3:6]
+        ht_min, ht_inc, num_ht = iono_grid_parms[6:9]
+        #  (1) geodetic latitude (degrees) start
+        ionosphere_struct.lat_min = lat_min
+        #  (2) latitude step (degrees)
+        ionosphere_struct.lat_inc = lat_inc
+        #  (3) number of latitudes
+        ionosphere_struct.num_lat = num_lat
+        #  Max of latitude (degrees)
+        ionosphere_struct.lat_max = lat_min + (float(num_lat - 1) * lat_inc)
+        #  (4) geodetic lonfitude (degrees) start
+        ionosphere_struct.lon_min = lon_min
+        #  (5) lonfitude step (degrees)
+        ionosphere_struct.lon_inc = lon_inc
+        #  (6) number of longitudes
+        ionosphere_struct.num_lon = num_lon
+        #  Max of longitude (degrees)
+        ionosphere_struct.lon_max = lon_min + (float(num_lon - 1) * lon_inc)
+        #  (7) geodetic height (km) start
+        ionosphere_struct.ht_min = ht_min
+        #  (8) height step (km)
+        ionosphere_struct.ht_inc = ht_inc
+        #  (9) number of heights
+        ionosphere_struct.num_ht = num_ht
+        #  Max of heights (km)
+        ionosphere_struct.ht_max = ht_min + (float(num_ht - 1) * ht_inc)
+        # Electron density grid.
+        eN = numpy.ctypeslib.as_array(ionosphere_struct.eN)
+        if iono_en_grid is not None:
+            eN[0:num_ht, 0:num_lon, 0:num_lat] = iono_en_grid
+        # Electron density grid for 5 minutes later.
+        eN_5 = numpy.ctypeslib.as_array(ionosphere_struct.eN_5)
+        if iono_en_grid_5 is not None:
+            eN_5[0:num_ht, 0:num_lon, 0:num_lat] = iono_en_grid_5
+        # Collision frequency grid.
+        col_freq = numpy.ctypeslib.as_array(ionosphere_struct.col_freq)
+        if collision_freq is not None:
+            col_freq[0:num_ht, 0:num_lon, 0:num_lat] = collision_freq
+
+        return (eN, eN_5, col_freq)
+
+    ## Set the geomagnetic field grids of the GEOMAG_FIELD_STRUCT of raytrace_3d
+    #
+    #  @param geomag_grid_parms - [lat_min, lat_inc, num_lat, lon_min, lon_inc, num_lon, ht_min, ht_inc, num_ht]
+    #  @param Bx, By, Bz        - (num_ht, num_lon, num_lat) grids of the field components
+    #
+    def setGeomagGrids(self, geomag_grid_parms, Bx, By, Bz):
+
+        # Geomagnetic grids.
+        if self.geomag_field_struct is None:
+            self.geomag_field_struct = GEOMAG_FIELD_STRUCT()
+        geomag_field_struct = self.geomag_field_struct
+        lat_min, lat_inc, num_lat = geomag_grid_parms[0:3]
+        lon_min, lon_inc, num_lon = geomag_grid_parms[3:6]
+        ht_min, ht_inc, num_ht = geomag_grid_parms[6:9]
+        #  (1) geodetic latitude (degrees) start
+        geomag_field_struct.lat_min = lat_min
+        #  (2) latitude step (degrees)
+        geomag_field_struct.lat_inc = lat_inc
+        #  (3) number of latitudes
+        geomag_field_struct.num_lat = num_lat
+        #  Max of latitude (degrees)
+        geomag_field_struct.lat_max = lat_min + (float(num_lat - 1) * lat_inc)
+        #  (4) geodetic lonfitude (degrees) start
+        geomag_field_struct.lon_min = lon_min
+        #  (5) lonfitude step (degrees)
+        geomag_field_struct.lon_inc = lon_inc
+        #  (6) number of longitudes
+        geomag_field_struct.num_lon = num_lon
+        #  Max of longitude (degrees)
+        geomag_field_struct.lon_max = lon_min + (float(num_lon - 1) * lon_inc)
+        #  (7) geodetic height (km) start
+        geomag_field_struct.ht_min = ht_min
+        #  (8) height step (km)
+        geomag_field_struct.ht_inc = ht_inc
+        #  (9) number of heights
+        geomag_field_struct.num_ht = num_ht
+        #  Max of heights (km)
+        geomag_field_struct.ht_max = ht_min + (float(num_ht - 1) * ht_inc)
+        # Bx, By, Bz
+        grid_Bx = numpy.ctypeslib.as_array(geomag_field_struct.Bx)
+        grid_By = numpy.ctypeslib.as_array(geomag_field_struct.By)
+        grid_Bz = numpy.ctypeslib.as_array(geomag_field_struct.Bz)
+        grid_Bx[0:num_ht, 0:num_lon, 0:num_lat] = Bx
+        grid_By[0:num_ht, 0:num_lon, 0:num_lat] = By
+        grid_Bz[0:num_ht, 0:num_lon, 0:num_lat] = Bz
+
     ## Call raytrace3d provided by PHARLAP
     #
     #  @param raytrace3dInput - The named tuple input to raytrace3d
@@ -513,84 +623,8 @@ class Pharlap:
         geomag_field_struct  = self.geomag_field_struct
         # Repopulated the voxel grids with the input arguments
         if len(args) in (8, 9):
-            # Electron density and collision frequency grids
-            iono_grid_parms = args[3]
-            lat_min, lat_inc, num_lat = iono_grid_parms[0:3]
-            lon_min, lon_inc, num_lon = iono_grid_parms[3:6]
-            ht_min, ht_inc, num_ht = iono_grid_parms[6:9]
-            #  (1) geodetic latitude (degrees) start
-            ionosphere_struct.lat_min = lat_min
-            #  (2) latitude step (degrees)
-            ionosphere_struct.lat_inc = lat_inc
-            #  (3) number of latitudes
-            ionosphere_struct.num_lat = num_lat
-            #  Max of latitude (degrees)
-            ionosphere_struct.lat_max = lat_min + (float(num_lat - 1) * lat_inc)
-            #  (4) geodetic lonfitude (degrees) start
-            ionosphere_struct.lon_min = lon_min
-            #  (5) lonfitude step (degrees)
-            ionosphere_struct.lon_inc = lon_inc
-            #  (6) number of longitudes
-            ionosphere_struct.num_lon = num_lon
-            #  Max of longitude (degrees)
-            ionosphere_struct.lon_max = lon_min + (float(num_lon - 1) * lon_inc)
-            #  (7) geodetic height (km) start
-            ionosphere_struct.ht_min = ht_min
-            #  (8) height step (km)
-            ionosphere_struct.ht_inc = ht_inc
-            #  (9) number of heights
-            ionosphere_struct.num_ht = num_ht
-            #  Max of heights (km)
-            ionosphere_struct.ht_max = ht_min + (float(num_ht - 1) * ht_inc)
-            # Electron density grid.
-            iono_en_grid = args[0]
-            eN = numpy.ctypeslib.as_array(ionosphere_struct.eN)
-            eN[0:num_ht, 0:num_lon, 0:num_lat] = iono_en_grid
-            # Electron density grid for 5 minutes later.
-            iono_en_grid_5 = args[1]
-            eN_5 = numpy.ctypeslib.as_array(ionosphere_struct.eN_5)
-            eN_5[0:num_ht, 0:num_lon, 0:num_lat] = iono_en_grid_5
-            # Collision frequency grid.
-            collision_freq = args[2]
-            col_freq = numpy.ctypeslib.as_array(ionosphere_struct.col_freq)
-            col_freq[0:num_ht, 0:num_lon, 0:num_lat] = collision_freq
-
-            # Geomagnetic grids.
-            geomag_grid_parms = args[7]
-            lat_min, lat_inc, num_lat = geomag_grid_parms[0:3]
-            lon_min, lon_inc, num_lon = geomag_grid_parms[3:6]
-            ht_min, ht_inc, num_ht = geomag_grid_parms[6:9]
-            #  (1) geodetic latitude (degrees) start
-            geomag_field_struct.lat_min = lat_min
-            #  (2) latitude step (degrees)
-            geomag_field_struct.lat_inc = lat_inc
-            #  (3) number of latitudes
-            geomag_field_struct.num_lat = num_lat
-            #  Max of latitude (degrees)
-            geomag_field_struct.lat_max = lat_min + (float(num_lat - 1) * lat_inc)
-            #  (4) geodetic lonfitude (degrees) start
-            geomag_field_struct.lon_min = lon_min
-            #  (5) lonfitude step (degrees)
-            geomag_field_struct.lon_inc = lon_inc
-            #  (6) number of longitudes
-            geomag_field_struct.num_lon = num_lon
-            #  Max of longitude (degrees)
-            geomag_field_struct.lon_max = lon_min + (float(num_lon - 1) * lon_inc)
-            #  (7) geodetic height (km) start
-            geomag_field_struct.ht_min = ht_min
-            #  (8) height step (km)
-            geomag_field_struct.ht_inc = ht_inc
-            #  (9) number of heights
-            geomag_field_struct.num_ht = num_ht
-            #  Max of heights (km)
-            geomag_field_struct.ht_max = ht_min + (float(num_ht - 1) * ht_inc)
-            # Bx, By, Bz
-            Bx = numpy.ctypeslib.as_array(geomag_field_struct.Bx)
-            By = numpy.ctypeslib.as_array(geomag_field_struct.By)
-            Bz = numpy.ctypeslib.as_array(geomag_field_struct.Bz)
-            Bx[0:num_ht, 0:num_lon, 0:num_lat] = args[4]
-            By[0:num_ht, 0:num_lon, 0:num_lat] = args[5]
-            Bz[0:num_ht, 0:num_lon, 0:num_lat] = args[6]
+            self.setIonosphereGrids(args[3], args[0], args[1], args[2])
+            self.setGeomagGrids(args[7], args[4], args[5], args[6])
 
         # Accept ray_state_vec_in as an input argument
         if len(args) in (1, 9):
@@ -0,0 +1,165 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import math
+import threading
+import time
+import unittest
+from collections import OrderedDict
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package Shared.Utils.Cache
+#  Small in-memory caches shared by the modules
+
+## Snap a value to the nearest multiple of a step
+#
+#  @param value - the value to snap
+#  @param step  - the step, the value is returned untouched if step is not positive
+#
+#  @retval (index, snapped) - the integer index of the step and index*step
+#
+def quantize(value, step):
+    if not step or step <= 0:
+        return (value, value)
+    index = int(math.floor(value / step + 0.5))
+    return (index, index * step)
+
+## Thread safe least recently used cache with an optional time to live
+#
+#  Entries older than ttl seconds are dropped when they are looked up, and the least
+#  recently used entry is dropped when a new entry would make the cache exceed maxSize.
+#
+class LRUCache:
+
+    ## Constructor
+    #
+    #  @param maxSize - maximum number of entries
+    #  @param ttl     - seconds an entry stays valid, None to keep entries until they are evicted
+    #  @param clock   - callable returning the current time in seconds, mostly for testing
+    #
+    def __init__(self, maxSize, ttl=None, clock=time.monotonic):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> (time stored, value), most recently used last
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    ## Look up a key
+    #
+    #  @param key     - any hashable
+    #  @param default - returned when the key is missing or expired
+    #
+    #  @retval the cached value or default
+    #
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and self.clock() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    ## Store a value
+    #
+    #  @param key   - any hashable
+    #  @param value - the value to cache
+    #
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    ## Drop every entry, the counters are kept
+    #
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    ## Keys of the entries, least recently used first, expired entries included
+    #
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    ## Counters of the cache
+    #
+    #  @retval dictionary with hits, misses, evictions, expirations and size
+    #
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'size': len(self.entries)}
+
+class UnitTest_Cache(unittest.TestCase):
+
+    def test_quantize(self):
+        self.assertEqual(quantize(40.024, 0.05)[0], 800)
+        self.assertEqual(quantize(40.026, 0.05)[0], 801)
+        self.assertEqual(quantize(-106.38, 0.05)[0], -2128)
+        self.assertEqual(quantize(3.3, None), (3.3, 3.3))
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # b is now the least recently used
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.keys(), ['a', 'c'])
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'evictions': 1, 'expirations': 0, 'size': 2})
+
+    def test_ttl(self):
+        now = [0.0]
+        cache = LRUCache(10, ttl=300, clock=lambda: now[0])
+        cache.put('a', 1)
+        now[0] = 299.0
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 301.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
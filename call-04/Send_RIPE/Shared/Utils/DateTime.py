@@ -19,7 +19,7 @@
 # MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
 
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 import Shared.Utils.HfgeoLogger as Logger
 
 logger = Logger.getLogger()
@@ -84,12 +84,48 @@ def dtToDateVec(dt):
     dateVec = [dt.year, dt.month, dt.day, dt.hour, dt.minute]
     return dateVec
 
+## snapped = snapDateTime(dt, step)
+#  Rounds a python datetime.datetime object to the nearest multiple of step seconds after midnight
+#
+#  @param dt   datetime.datetime object
+#  @param step the step in seconds, should divide a day evenly (60, 300, ...)
+#
+#  @retval snapped datetime.datetime object
+#
+def snapDateTime(dt, step):
+    midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    seconds = (dt - midnight).total_seconds()
+    return midnight + timedelta(seconds=round(seconds / step) * step)
+
+## floored = floorDateTime(dt, step)
+#  Rounds a python datetime.datetime object down to a multiple of step seconds after midnight
+#
+#  @param dt   datetime.datetime object
+#  @param step the step in seconds, should divide a day evenly (60, 300, ...)
+#
+#  @retval floored datetime.datetime object, never after dt
+#
+def floorDateTime(dt, step):
+    midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    seconds = (dt - midnight).total_seconds()
+    return midnight + timedelta(seconds=(seconds // step) * step)
+
 class UnitTest_DateTime(unittest.TestCase):
     def test_dateTime2year(self):
         a = iso8601ToDecimalYear(datetime(2000, 9, 21, 0, 0))
         logger.info(a)
         self.assertAlmostEqual(a, 2000.7213, places=4)
 
+    def test_snapDateTime(self):
+        self.assertEqual(snapDateTime(datetime(2018, 1, 28, 13, 30, 29), 60), datetime(2018, 1, 28, 13, 30))
+        self.assertEqual(snapDateTime(datetime(2018, 1, 28, 13, 30, 31), 60), datetime(2018, 1, 28, 13, 31))
+        self.assertEqual(snapDateTime(datetime(2018, 1, 28, 23, 59, 59), 300), datetime(2018, 1, 29, 0, 0))
+
+    def test_floorDateTime(self):
+        self.assertEqual(floorDateTime(datetime(2018, 1, 28, 13, 34, 59), 300), datetime(2018, 1, 28, 13, 30))
+        self.assertEqual(floorDateTime(datetime(2018, 1, 28, 13, 35), 300), datetime(2018, 1, 28, 13, 35))
+        self.assertEqual(floorDateTime(datetime(2018, 1, 28, 23, 59, 59), 300), datetime(2018, 1, 28, 23, 55))
+
 if __name__ == '__main__':
     logger.setLevel('INFO')
     unittest.main()
@@ -130,36 +130,37 @@ def greatCircleBearingAndDistance(latLon1, latLon2, algo=1, maxIter=100, minTol=
         ddlon = 10*minTol*numpy.ones(nl)
         lprev = dlon
 
-        # loop
-        for i in range(len(dlon)):
-            iteration = 0
-            while (ddlon[i] > minTol) & (iteration <=maxIter):
-                # cos, sin, lambda , sigma, alpha, etc
-                clam[i]= numpy.cos(dlon[i])
-                slam[i] = numpy.sin(dlon[i])
-
-                csig[i] = ssu12[i] + ccu12[i] * clam[i]
-                ssig[i] = numpy.sqrt((cosu2[i] * slam[i])**2 + (csu12[i] - scu12[i] * clam[i])**2)
-                sig[i] = numpy.arctan2(ssig[i], csig[i])
-
-                salp[i] = ccu12[i] * slam[i] / ssig[i]
-                calp2[i] = 1 - salp[i]**2
-                if calp2[i] != 0:
-                    cos2sig[i] = csig[i] - (2 * ssu12[i] / calp2[i])
-                else:
-                    cos2sig[i] = 0  # equator
-
-                # update
-                CC = calp2[i] * ((flat / 4) + (flat**2 / 16) * (4 - 3 * calp2[i]))
-                tmp1 = sig[i] + CC * ssig[i] * (cos2sig[i] + CC * csig[i] * (-1 + 2 * (cos2sig[i]**2)))
-                dlon[i] = dlon[i] + flat * ((1 - CC) * salp[i] * tmp1)
-
-                # convergence?
-                ddlon[i] = abs(dlon[i] - lprev[i])
-
-                # counter
-                iteration = iteration + 1
-                lprev[i] = dlon[i]
+        # loop, every point not converged yet is updated at each iteration
+        iteration = 0
+        while iteration <= maxIter:
+            i = numpy.flatnonzero(ddlon > minTol)
+            if len(i) == 0:
+                break
+            # cos, sin, lambda , sigma, alpha, etc
+            clam[i] = numpy.cos(dlon[i])
+            slam[i] = numpy.sin(dlon[i])
+
+            csig[i] = ssu12[i] + ccu12[i] * clam[i]
+            ssig[i] = numpy.sqrt((cosu2[i] * slam[i])**2 + (csu12[i] - scu12[i] * clam[i])**2)
+            sig[i] = numpy.arctan2(ssig[i], csig[i])
+
+            salp[i] = ccu12[i] * slam[i] / ssig[i]
+            calp2[i] = 1 - salp[i]**2
+            # cos2sig is 0 at the equator
+            equator = calp2[i] == 0
+            cos2sig[i] = numpy.where(equator, 0, csig[i] - (2 * ssu12[i] / numpy.where(equator, 1, calp2[i])))
+
+            # update
+            CC = calp2[i] * ((flat / 4) + (flat**2 / 16) * (4 - 3 * calp2[i]))
+            tmp1 = sig[i] + CC * ssig[i] * (cos2sig[i] + CC * csig[i] * (-1 + 2 * (cos2sig[i]**2)))
+            dlon[i] = dlon[i] + flat * ((1 - CC) * salp[i] * tmp1)
+
+            # convergence?
+            ddlon[i] = abs(dlon[i] - lprev[i])
+
+            # counter
+            iteration = iteration + 1
+            lprev[i] = dlon[i]
 
         # now calculate angles
         az1 = numpy.arctan2(cosu2 * slam, csu12 - scu12 * clam)
@@ -181,6 +182,110 @@ def greatCircleBearingAndDistance(latLon1, latLon2, algo=1, maxIter=100, minTol=
 
     return az1, az2, dist
 
+## latLon2 = greatCircleDestination(latLon1, az1, dist, algo, maxIter, minTol)
+# calculates the points reached from starting points along the great circles of given starting azimuths
+# and distances, the direct problem of greatCircleBearingAndDistance.
+#
+# ALL UNITS in SI
+#
+# NOTE 1.   Vincenty's direct formulae are from
+#           http://www.movable-type.co.uk/scripts/latlong-vincenty.html
+#
+# @param latLon1    - array,  2 by K - lat/lon of starting points (in radians)
+# @param az1        - array,  1 by K - starting azimuths (in radians)
+# @param dist       - array,  1 by K - distances along the great circles (in meters)
+# @param algo       - integer        - optional algorithm flag
+#                                   algo = 1 (default)use Vincenty's algorithm for wgs84
+#                                   algo = 0 uses spherical Earth
+# @param maxIter    - integer        - optional, maximum number of iterations for Vincenty's algorithm
+# @param minTol     - integer,       - optional, minimum difference bettwen iterations for Vincenty's algorithm
+# @retval latLon2   - array, 2 by K  - lat/lon of the points reached (in radians), longitudes in [0, 2 pi)
+#
+def greatCircleDestination(latLon1, az1, dist, algo=1, maxIter=100, minTol=1e-12):
+    latLon2 = numpy.zeros(latLon1.shape)
+    if algo == 0:
+        dang = dist / wgs84Ellipsoid.meanRadius
+        sinLat2 = numpy.sin(latLon1[0, :]) * numpy.cos(dang) + numpy.cos(latLon1[0, :]) * numpy.sin(dang) * numpy.cos(az1)
+        latLon2[0, :] = numpy.arcsin(numpy.clip(sinLat2, -1, 1))
+        latLon2[1, :] = latLon1[1, :] + numpy.arctan2(numpy.sin(az1) * numpy.sin(dang) * numpy.cos(latLon1[0, :]),
+                                                      numpy.cos(dang) - numpy.sin(latLon1[0, :]) * sinLat2)
+    elif algo == 1:
+        # Vincenty's iterative algo
+        flat = wgs84Ellipsoid.f
+        semiMinor = wgs84Ellipsoid.a * (1 - wgs84Ellipsoid.f)
+        tanu1 = (1 - flat) * numpy.tan(latLon1[0, :])
+        cosu1 = 1. / numpy.sqrt(1 + tanu1**2)
+        sinu1 = tanu1 * cosu1
+
+        salp1 = numpy.sin(az1)
+        calp1 = numpy.cos(az1)
+        sig1 = numpy.arctan2(tanu1, calp1)
+        salp = cosu1 * salp1
+        calp2 = 1 - salp**2
+        u2 = calp2 * ((wgs84Ellipsoid.a**2 - semiMinor**2) / semiMinor**2)
+        A = 1 + (u2 * (1 / 16384)) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = (u2 * (1 / 1024)) * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+        # loop, every point not converged yet is updated at each iteration
+        sig0 = dist / (semiMinor * A)
+        sig = sig0.copy()
+        cos2sig = numpy.cos(2 * sig1 + sig)
+        dsig = numpy.zeros(len(sig))
+        ddsig = 10*minTol*numpy.ones(len(sig))
+        iteration = 0
+        while iteration <= maxIter:
+            i = numpy.flatnonzero(ddsig > minTol)
+            if len(i) == 0:
+                break
+            cos2sig[i] = numpy.cos(2 * sig1[i] + sig[i])
+            dsig[i] = B[i] * numpy.sin(sig[i]) * (cos2sig[i] + (0.25 * B[i]) * (
+                numpy.cos(sig[i]) * (-1 + 2 * (cos2sig[i]**2)) -
+                (B[i] * (1 / 6)) * cos2sig[i] * (-3 + 4 * numpy.sin(sig[i])**2) * (-3 + 4 * (cos2sig[i]**2))))
+            prev = sig[i]
+            sig[i] = sig0[i] + dsig[i]
+            ddsig[i] = abs(sig[i] - prev)
+            iteration = iteration + 1
+        cos2sig = numpy.cos(2 * sig1 + sig)
+
+        # now calculate the point
+        ssig = numpy.sin(sig)
+        csig = numpy.cos(sig)
+        tmp = sinu1 * ssig - cosu1 * csig * calp1
+        latLon2[0, :] = numpy.arctan2(sinu1 * csig + cosu1 * ssig * calp1, (1 - flat) * numpy.sqrt(salp**2 + tmp**2))
+        lam = numpy.arctan2(ssig * salp1, cosu1 * csig - sinu1 * ssig * calp1)
+        CC = calp2 * ((flat / 16) * (4 + flat * (4 - 3 * calp2)))
+        latLon2[1, :] = latLon1[1, :] + lam - (1 - CC) * flat * salp * (
+            sig + CC * ssig * (cos2sig + CC * csig * (-1 + 2 * (cos2sig**2))))
+    else:
+        logger.error('Algorithm types values supported by the great circle destination calculation are only 0 '
+                     'and 1, not : {} \n'.format(algo))
+
+    latLon2[1, :] = numpy.mod(latLon2[1, :], 2 * numpy.pi)
+    return latLon2
+
+## latLonCP = greatCircleControlPoints(latLon1, latLon2, fractions)
+# calculates control points along the great circles connecting two points, such as the midpoints of
+# transmitter to receiver paths. All the paths are handled by one inverse and one direct calculation
+# for a spherical Earth, which places the control points well within the resolution of the ionospheric
+# models and goes exactly through both ends of the paths.
+#
+# ALL UNITS in SI
+#
+# @param latLon1    - array,  2 by K - lat/lon of starting points (in radians)
+# @param latLon2    - array,  2 by K - lat/lon of final points (in radians)
+# @param fractions  - array,  F      - optional, fractions of the great circle distances of the control points,
+#                                      default the midpoints
+# @retval latLonCP  - array, 2 by K by F - lat/lon of the control points (in radians), longitudes in [0, 2 pi)
+#
+def greatCircleControlPoints(latLon1, latLon2, fractions=(0.5,)):
+    fractions = numpy.atleast_1d(numpy.asarray(fractions, dtype=float))
+    (az1, az2, dist) = greatCircleBearingAndDistance(latLon1, latLon2, algo=0)
+    numPaths = latLon1.shape[1]
+    # every path repeated for each of its control points
+    latLonCP = greatCircleDestination(numpy.repeat(latLon1, len(fractions), axis=1), numpy.repeat(az1, len(fractions)),
+                                      numpy.outer(dist, fractions).ravel(), algo=0)
+    return latLonCP.reshape(2, numPaths, len(fractions))
+
 class UnitTest_Geodesy(unittest.TestCase):
     def test_greatCircleBearingAndDistanceCalculation_sphericEarth(self):
         latlon1 = numpy.array([[33*numpy.pi/180, 34*numpy.pi/180, 35*numpy.pi/180, 36*numpy.pi/180],
@@ -221,6 +326,36 @@ class UnitTest_Geodesy(unittest.TestCase):
         numpy.testing.assert_almost_equal(az2, expected_az2, decimal=15)
         numpy.testing.assert_almost_equal(dist, expected_dist, decimal=9)
 
+    def test_greatCircleDestination(self):
+        latlon1 = numpy.array([[33*numpy.pi/180, 36*numpy.pi/180], [116*numpy.pi/180, 119*numpy.pi/180]])
+        latlon2 = numpy.array([[43*numpy.pi/180, 46*numpy.pi/180], [146*numpy.pi/180, 149*numpy.pi/180]])
+        # converged Vincenty inverse solutions between the points
+        az1 = numpy.array([1.016686495410925e+00, 9.905857186415333e-01])
+        dist = numpy.array([2.839727924298451e+06, 2.736379883855520e+06])
+        latlon = greatCircleDestination(latlon1, az1, dist, algo=1)
+        numpy.testing.assert_almost_equal(latlon, latlon2, decimal=12)
+        # spherical Earth, back to the final points
+        (az1, az2, dist) = greatCircleBearingAndDistance(latlon1, latlon2, algo=0)
+        numpy.testing.assert_almost_equal(greatCircleDestination(latlon1, az1, dist, algo=0), latlon2, decimal=12)
+        # longitudes are wrapped
+        latlon = greatCircleDestination(numpy.array([[0.0], [6.2]]), numpy.array([numpy.pi / 2]), numpy.array([1.e6]))
+        self.assertTrue(0 <= latlon[1, 0] < 1)
+
+    def test_greatCircleControlPoints(self):
+        latlon1 = numpy.array([[0.0, 40 * numpy.pi / 180], [0.0, 254.7 * numpy.pi / 180]])
+        latlon2 = numpy.array([[0.0, 45.07 * numpy.pi / 180], [numpy.pi / 2, 276.44 * numpy.pi / 180]])
+        latlonCP = greatCircleControlPoints(latlon1, latlon2, [0.0, 0.25, 0.5, 1.0])
+        self.assertEqual(latlonCP.shape, (2, 2, 4))
+        # along the equator, the midpoint is half way in longitude
+        numpy.testing.assert_almost_equal(latlonCP[:, 0, 2], [0.0, numpy.pi / 4], decimal=12)
+        numpy.testing.assert_almost_equal(latlonCP[:, :, 0], latlon1, decimal=12)
+        numpy.testing.assert_almost_equal(latlonCP[:, :, 3], latlon2, decimal=12)
+        # midpoints are as far from both ends
+        (_, _, dist1) = greatCircleBearingAndDistance(latlon1, latlonCP[:, :, 2], algo=0)
+        (_, _, dist2) = greatCircleBearingAndDistance(latlonCP[:, :, 2], latlon2, algo=0)
+        numpy.testing.assert_allclose(dist1, dist2, rtol=1e-9)
+        numpy.testing.assert_almost_equal(greatCircleControlPoints(latlon1, latlon2)[:, :, 0], latlonCP[:, :, 2])
+
 # @brief If the function is called from the command line then do the unit test
 #
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package Shared.Utils.SingleFlight
+#  Coalescing of identical concurrent calls
+
+## Runs a function at most once at a time per key
+#
+#  The first thread calling do() for a key runs the function. Threads calling do() with the
+#  same key while it runs wait for it and get its result, or its exception, instead of
+#  running the function again. Once the call is over the next call for the key runs again.
+#
+class SingleFlight:
+
+    ## Constructor
+    #
+    def __init__(self):
+        # Locking mechanism
+        self.lock = threading.Lock()
+        # key -> Future of the call in flight
+        self.calls = {}
+        # Number of calls answered with the result of another call
+        self.shared = 0
+
+    ## Run fcn(*args, **kwargs) unless a call with the same key is in flight
+    #
+    #  @param key - any hashable identifying the call
+    #  @param fcn - the function to run
+    #
+    #  @retval the result of the function
+    #
+    def do(self, key, fcn, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+            else:
+                self.shared += 1
+
+        # Somebody else is already on it
+        if not leader:
+            return future.result()
+
+        try:
+            result = fcn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+class UnitTest_SingleFlight(unittest.TestCase):
+
+    def test_coalesce(self):
+        singleFlight = SingleFlight()
+        calls = []
+        release = threading.Event()
+        def slow(value):
+            calls.append(value)
+            release.wait(5)
+            return value * 2
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(singleFlight.do('key', slow, 21))) for n in range(0, 4)]
+        for t in threads:
+            t.start()
+        # Give the followers time to find the call in flight
+        time.sleep(0.2)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42, 42, 42, 42])
+        self.assertEqual(singleFlight.shared, 3)
+        # Nothing left in flight, the next call runs again
+        self.assertEqual(singleFlight.do('key', slow, 1), 2)
+        self.assertEqual(calls, [21, 1])
+
+    def test_exception(self):
+        singleFlight = SingleFlight()
+        def fail():
+            raise ValueError('no data')
+        with self.assertRaises(ValueError):
+            singleFlight.do('key', fail)
+        self.assertEqual(singleFlight.calls, {})
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()
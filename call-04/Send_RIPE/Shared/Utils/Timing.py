@@ -0,0 +1,238 @@
+# Copyright (C) 2017 Boston College
+# http://www.bostoncollege.edu
+#
+# BC Proprietary Information
+#
+# US Government retains Unlimited Rights
+# Non-Government Users – restricted usage as defined through
+# licensing with STR or via arrangement with Government.
+#
+# In no event shall the initial developers or copyright holders be
+# liable for any damages whatsoever, including - but not restricted
+# to - lost revenue or profits or other direct, indirect, special,
+# incidental or consequential damages, even if they have been
+# advised of the possibility of such damages, except to the extent
+# invariable law, if any, provides otherwise.
+#
+# The Software is provided AS IS with NO
+# WARRANTY OF ANY KIND, INCLUDING THE WARRANTY OF DESIGN,
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+
+import functools
+import threading
+import time
+import unittest
+from collections import deque
+from contextlib import contextmanager
+import numpy
+import Shared.Utils.HfgeoLogger as Logger
+
+logger = Logger.getLogger()
+
+## @package Shared.Utils.Timing
+#  Per stage timing of the processing
+#
+#  Code wraps its stages in stage('name') or decorates them with timed('name'). Every stage
+#  is recorded in the rolling window of the module registry, and in the breakdown of the
+#  request being processed by the thread, if request() was entered. Stages nest, the time of
+#  a stage includes the time of the stages it calls.
+
+## Bucket edges of the histograms in seconds, 10 us to 100 s, two buckets per decade
+histogramEdges = numpy.logspace(-5, 2, 15)
+
+## Rolling window of the durations of every stage
+#
+class StageTimings:
+
+    ## Constructor
+    #
+    #  @param windowSize - number of durations kept per stage
+    #
+    def __init__(self, windowSize=1000):
+        self.windowSize = windowSize
+        self.lock = threading.Lock()
+        # stage -> deque of durations in seconds
+        self.windows = {}
+
+    ## Record one duration
+    #
+    #  @param stage   - string - name of the stage
+    #  @param seconds - duration of the stage
+    #
+    def record(self, stage, seconds):
+        with self.lock:
+            window = self.windows.get(stage)
+            if window is None:
+                window = deque(maxlen=self.windowSize)
+                self.windows[stage] = window
+            window.append(seconds)
+
+    ## Durations in the window of a stage
+    #
+    #  @retval numpy array in seconds, empty if the stage was never recorded
+    #
+    def durations(self, stage):
+        with self.lock:
+            return numpy.array(self.windows.get(stage, []), dtype=float)
+
+    ## Names of the stages recorded so far
+    #
+    def stages(self):
+        with self.lock:
+            return sorted(self.windows)
+
+    ## Histogram of the window of a stage
+    #
+    #  @param stage - string - name of the stage
+    #  @param edges - bucket edges in seconds, durations outside of the edges are counted in the end buckets
+    #
+    #  @retval (edges, counts)
+    #
+    def histogram(self, stage, edges=histogramEdges):
+        durations = numpy.clip(self.durations(stage), edges[0], edges[-1])
+        (counts, edges) = numpy.histogram(durations, bins=edges)
+        return (edges, counts)
+
+    ## Statistics of the windows
+    #
+    #  @retval dictionary stage -> dictionary with count, mean, p50, p95 and max in seconds
+    #
+    def summary(self):
+        summary = {}
+        for stage in self.stages():
+            durations = self.durations(stage)
+            summary[stage] = {'count': len(durations),
+                              'mean': float(numpy.mean(durations)),
+                              'p50': float(numpy.percentile(durations, 50)),
+                              'p95': float(numpy.percentile(durations, 95)),
+                              'max': float(numpy.max(durations))}
+        return summary
+
+    ## Drop every duration
+    #
+    def clear(self):
+        with self.lock:
+            self.windows.clear()
+
+## The registry every stage is recorded in
+timings = StageTimings()
+
+# The breakdown of the request processed by each thread
+local = threading.local()
+
+## Time a stage
+#
+#  @param name - string - name of the stage
+#
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        timings.record(name, seconds)
+        breakdown = getattr(local, 'breakdown', None)
+        if breakdown is not None:
+            entry = breakdown.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+
+## Decorator timing every call of a function as a stage
+#
+#  @param name - string - name of the stage
+#
+def timed(name):
+    def decorator(fcn):
+        @functools.wraps(fcn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fcn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+## Collect the stages run by this thread into the breakdown of one request
+#
+#  Yields the breakdown, a dictionary stage -> {'calls': n, 'seconds': total}, filled in as
+#  the stages complete. Stages run by other threads or processes are not part of it.
+#
+@contextmanager
+def request():
+    previous = getattr(local, 'breakdown', None)
+    local.breakdown = {}
+    try:
+        yield local.breakdown
+    finally:
+        local.breakdown = previous
+
+## Call a function collecting its stages into a breakdown of its own
+#
+#  For the work of a request handed to another thread, the breakdown is added to the one of
+#  the request with merge().
+#
+#  @retval (result, breakdown) - what fcn returns and the stages it ran
+#
+def collect(fcn, *args, **kwargs):
+    with request() as breakdown:
+        return (fcn(*args, **kwargs), breakdown)
+
+## Add the stages of a breakdown to the breakdown of the request processed by this thread
+#
+#  @param breakdown - dictionary stage -> {'calls': n, 'seconds': total}, see collect
+#
+def merge(breakdown):
+    current = getattr(local, 'breakdown', None)
+    if current is None:
+        return
+    for name, entry in breakdown.items():
+        total = current.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        total['calls'] += entry['calls']
+        total['seconds'] += entry['seconds']
+
+class UnitTest_Timing(unittest.TestCase):
+
+    def setUp(self):
+        timings.clear()
+
+    def test_breakdown(self):
+        @timed('test.inner')
+        def inner():
+            time.sleep(0.01)
+        with request() as breakdown:
+            with stage('test.outer'):
+                inner()
+                inner()
+        # Outside of a request only the registry records
+        inner()
+        self.assertEqual(breakdown['test.inner']['calls'], 2)
+        self.assertEqual(breakdown['test.outer']['calls'], 1)
+        self.assertGreaterEqual(breakdown['test.outer']['seconds'], breakdown['test.inner']['seconds'])
+        self.assertEqual(timings.summary()['test.inner']['count'], 3)
+
+    def test_merge(self):
+        from concurrent.futures import ThreadPoolExecutor
+        @timed('test.inner')
+        def inner():
+            return 1
+        with request() as breakdown:
+            inner()
+            with ThreadPoolExecutor() as executor:
+                (result, stages) = executor.submit(collect, inner).result()
+            merge(stages)
+        self.assertEqual(result, 1)
+        self.assertEqual(stages['test.inner']['calls'], 1)
+        self.assertEqual(breakdown['test.inner']['calls'], 2)
+
+    def test_histogram(self):
+        registry = StageTimings(windowSize=3)
+        for seconds in [0.001, 0.002, 1.0, 1000.0]:
+            registry.record('a', seconds)
+        (edges, counts) = registry.histogram('a')
+        # The window only keeps the last 3, the one over 100 s lands in the last bucket
+        self.assertEqual(counts.sum(), 3)
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(registry.summary()['a']['max'], 1000.0)
+
+if __name__ == '__main__':
+    logger.setLevel('INFO')
+    unittest.main()